@@ -0,0 +1,696 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+An IdentityManager backend that talks to the Keystone v3 API with
+asyncio and aiohttp, rather than keystoneclient, so that independent
+lookups can be in flight at the same time over one pooled connector.
+
+Needs Python 3.5+ and aiohttp, from the "asyncio" extra, and is enabled
+with:
+
+    IDENTITY_SETTINGS:
+        backend: asyncio
+
+The coroutines run on an event loop in a background thread, behind
+a synchronous IdentityManager with the same interface as the one in
+user_store, so the actions don't need to change.
+"""
+
+import asyncio
+from collections import defaultdict, OrderedDict
+import concurrent.futures
+from logging import getLogger
+import os
+import threading
+import time
+
+import aiohttp
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from keystoneauth1 import exceptions as ksa_exceptions
+
+from adjutant import exceptions
+from adjutant.actions import openstack_clients
+from adjutant.actions.user_store import (
+    domain_cache, invalidate_project, project_cache, region_cache)
+
+# Event loop, and the client using it, shared by the whole process
+loop = None
+loop_pid = None
+client = None
+loop_lock = threading.Lock()
+
+error_classes = {
+    400: ksa_exceptions.BadRequest,
+    401: ksa_exceptions.Unauthorized,
+    403: ksa_exceptions.Forbidden,
+    404: ksa_exceptions.NotFound,
+    409: ksa_exceptions.Conflict,
+}
+
+
+def _id(resource):
+    return getattr(resource, 'id', resource)
+
+
+def _error(status, data, method, url):
+    message = None
+    if isinstance(data, dict):
+        message = (data.get('error') or {}).get('message')
+    error_class = error_classes.get(status)
+    if error_class is None:
+        if status >= 500:
+            error_class = ksa_exceptions.HttpServerError
+        else:
+            error_class = ksa_exceptions.HttpError
+    return error_class(
+        message=message, http_status=status, method=method, url=url)
+
+
+class Resource(object):
+    """
+    A Keystone resource, with its fields as attributes, the way
+    keystoneclient returns them.
+    """
+
+    def __init__(self, info):
+        self._info = info
+        for key, value in info.items():
+            setattr(self, key, value)
+
+    def to_dict(self):
+        return dict(self._info)
+
+    def __repr__(self):
+        return '<Resource %s>' % self._info
+
+
+class KeystoneClient(object):
+    """
+    Authenticated access to the Keystone v3 API as the Adjutant
+    service user, over a pooled aiohttp session.
+
+    Calls go through the 'identity' circuit breaker, the same as the
+    keystoneclient ones do.
+    """
+
+    # Re-authenticate once the token has less than this long to live.
+    MIN_TOKEN_LIFE_SECONDS = 120
+
+    def __init__(self):
+        self.session = None
+        self.auth_lock = None
+        self.token = None
+        self.expires = None
+        self.endpoint = None
+
+    @property
+    def auth_url(self):
+        return settings.KEYSTONE['auth_url'].rstrip('/')
+
+    @property
+    def timeout(self):
+        return settings.CLIENT_SETTINGS.get('request_timeout')
+
+    def _setup(self):
+        # NOTE: Built on first use, as aiohttp and asyncio
+        # want these made on the loop they'll be used from.
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=settings.IDENTITY_SETTINGS.get('async_pool_size', 20))
+            self.session = aiohttp.ClientSession(connector=connector)
+            self.auth_lock = asyncio.Lock()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def expires_in(self):
+        if self.expires is None:
+            return None
+        return (self.expires - timezone.now()).total_seconds()
+
+    def _needs_auth(self):
+        expires_in = self.expires_in()
+        return (self.token is None or expires_in is None or
+                expires_in < self.MIN_TOKEN_LIFE_SECONDS)
+
+    def _find_endpoint(self, catalog):
+        # NOTE: keystoneclient defaults to the admin endpoint.
+        for service in catalog:
+            if service.get('type') != 'identity':
+                continue
+            for endpoint in service.get('endpoints', []):
+                if endpoint.get('interface') == 'admin':
+                    return endpoint['url'].rstrip('/')
+        return self.auth_url
+
+    async def authenticate(self):
+        domain = {'id': settings.KEYSTONE.get('domain_id', 'default')}
+        body = {'auth': {
+            'identity': {
+                'methods': ['password'],
+                'password': {'user': {
+                    'name': settings.KEYSTONE['username'],
+                    'password': settings.KEYSTONE['password'],
+                    'domain': domain}}},
+            'scope': {'project': {
+                'name': settings.KEYSTONE['project_name'],
+                'domain': domain}},
+        }}
+        url = self.auth_url + '/auth/tokens'
+        status, headers, data = await self._send('POST', url, body=body)
+        if status >= 400:
+            raise _error(status, data, 'POST', url)
+
+        token = data['token']
+        endpoint = self._find_endpoint(token.get('catalog', []))
+        if not endpoint.endswith('/v3'):
+            endpoint += '/v3'
+        self.endpoint = endpoint
+        self.expires = parse_datetime(token['expires_at'])
+        self.token = headers['X-Subject-Token']
+
+    async def get_token(self):
+        self._setup()
+        if self._needs_auth():
+            async with self.auth_lock:
+                # Someone else may have got one while we waited.
+                if self._needs_auth():
+                    await self.authenticate()
+        return self.token
+
+    async def _send(self, method, url, params=None, body=None, token=None):
+        breaker = openstack_clients.get_breaker('identity')
+        breaker.before_call()
+
+        headers = {'Accept': 'application/json'}
+        if token:
+            headers['X-Auth-Token'] = token
+        timeout = None
+        if self.timeout:
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+
+        try:
+            async with self.session.request(
+                    method, url, params=params, json=body, headers=headers,
+                    timeout=timeout) as response:
+                data = None
+                if response.content_type == 'application/json':
+                    data = await response.json()
+                status = response.status
+                response_headers = response.headers
+        except asyncio.CancelledError:
+            # The caller gave up, which says nothing about Keystone.
+            breaker.record_unknown()
+            raise
+        except asyncio.TimeoutError:
+            breaker.record_failure()
+            raise ksa_exceptions.ConnectTimeout(
+                "Request to %s timed out" % url)
+        except aiohttp.ClientError as e:
+            breaker.record_failure()
+            raise ksa_exceptions.ConnectFailure(
+                "Unable to establish connection to %s: %s" % (url, e))
+
+        if status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return status, response_headers, data
+
+    async def request(self, method, path, params=None, body=None):
+        """
+        Makes a call to the given path of the API, returning
+        the decoded response body.
+        """
+        token = await self.get_token()
+        url = self.endpoint + path
+        status, headers, data = await self._send(
+            method, url, params=params, body=body, token=token)
+        if status == 401 and token == self.token:
+            # Revoked under us, so get a new one and try once more.
+            self.token = None
+            token = await self.get_token()
+            status, headers, data = await self._send(
+                method, url, params=params, body=body, token=token)
+        if status >= 400:
+            raise _error(status, data, method, url)
+        return data
+
+    async def get(self, path, key, params=None):
+        data = await self.request('GET', path, params=params)
+        return Resource(data[key])
+
+    async def list(self, path, key, params=None):
+        if params:
+            params = {name: str(value) for name, value in params.items()
+                      if value is not None}
+        data = await self.request('GET', path, params=params)
+        return [Resource(info) for info in data[key]]
+
+
+class RoleCatalog(object):
+    """
+    All the roles in Keystone, loaded in one call and kept for
+    IDENTITY_SETTINGS['role_cache_ttl'] seconds, and reloaded at
+    most once for a missing role until the next load, like
+    user_store.RoleCatalog.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.lock = None
+        self.roles_by_name = {}
+        self.roles_by_id = {}
+        self.misses = set()
+        self.loaded_at = None
+
+    @property
+    def ttl(self):
+        return settings.IDENTITY_SETTINGS.get('role_cache_ttl', 600)
+
+    def _is_stale(self, since=None):
+        return (self.loaded_at is None or
+                (since is not None and self.loaded_at < since) or
+                time.time() - self.loaded_at > self.ttl)
+
+    async def load(self, since=None):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            # Only one load at a time, shared by whoever is waiting.
+            if not self._is_stale(since):
+                return
+            roles = await self.client.list('/roles', 'roles')
+            self.roles_by_name = {role.name: role for role in roles}
+            self.roles_by_id = {role.id: role for role in roles}
+            self.misses = set()
+            self.loaded_at = time.time()
+
+    async def _lookup(self, attr, key):
+        started = time.time()
+        if self._is_stale():
+            await self.load()
+        role = getattr(self, attr).get(key)
+        if role is None and (attr, key) not in self.misses:
+            # Maybe a new role, so load anything newer than the
+            # start of this lookup.
+            await self.load(since=started)
+            role = getattr(self, attr).get(key)
+            if role is None:
+                self.misses.add((attr, key))
+        return role
+
+    async def get_role(self, role_id):
+        return await self._lookup('roles_by_id', role_id)
+
+    async def find_role(self, name):
+        return await self._lookup('roles_by_name', name)
+
+
+class AsyncIdentityManager(object):
+    """
+    Coroutine versions of the IdentityManager methods, with the same
+    arguments and results.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.roles = client.role_catalog
+
+    async def gather(self, *calls):
+        """
+        Runs the given calls at the same time, each given as a tuple
+        of the method name followed by its arguments, and returns
+        their results in order.
+        """
+        return await asyncio.gather(*[
+            getattr(self, call[0])(*call[1:]) for call in calls])
+
+    async def _first(self, path, key, params):
+        try:
+            found = await self.client.list(path, key, params)
+        except ksa_exceptions.NotFound:
+            return None
+        # NOTE: names are unique in a domain
+        return found[0] if found else None
+
+    async def _get(self, path, key):
+        try:
+            return await self.client.get(path, key)
+        except ksa_exceptions.NotFound:
+            return None
+
+    async def _update_user(self, user, **fields):
+        await self.client.request(
+            'PATCH', '/users/%s' % _id(user), body={'user': fields})
+
+    async def find_user(self, name, domain):
+        return await self._first(
+            '/users', 'users', {'name': name, 'domain_id': _id(domain)})
+
+    async def get_user(self, user_id):
+        return await self._get('/users/%s' % user_id, 'user')
+
+    async def list_users(self, project, role=None, name=None):
+        """
+        Same as IdentityManager.list_users, but the users of each
+        domain, and any users missing from those, are fetched at
+        the same time.
+        """
+        try:
+            assignments = await self.client.list(
+                '/role_assignments', 'role_assignments',
+                {'scope.project.id': _id(project), 'include_names': True})
+        except ksa_exceptions.NotFound:
+            return []
+
+        if name:
+            name = name.lower()
+
+        roles = OrderedDict()
+        domains = set()
+        for assignment in assignments:
+            assigned_user = getattr(assignment, 'user', None)
+            if assigned_user is None:
+                # Just means the assignment is a group, so ignore it.
+                continue
+            user_name = assigned_user.get('name')
+            if name and user_name and name not in user_name.lower():
+                continue
+            role_assignment = await self.roles.get_role(
+                assignment.role['id'])
+            if role_assignment is None:
+                getLogger('adjutant').warning(
+                    "Skipping assignment of unknown role %s to user %s." %
+                    (assignment.role['id'], assigned_user['id']))
+                continue
+            roles.setdefault(assigned_user['id'], []).append(role_assignment)
+            domain = assigned_user.get('domain', {}).get('id')
+            if domain:
+                domains.add(domain)
+
+        if role:
+            roles = OrderedDict(
+                (user_id, user_roles) for user_id, user_roles in roles.items()
+                if role in [r.name for r in user_roles])
+
+        if not roles:
+            return []
+
+        listings = await asyncio.gather(*[
+            self.client.list('/users', 'users', {
+                'domain_id': domain, 'name__icontains': name or None})
+            for domain in domains])
+        users_by_id = {
+            user.id: user for listing in listings for user in listing
+            if user.id in roles}
+
+        # No domain in the assignment, or newer than the listing.
+        missing = [user_id for user_id in roles
+                   if user_id not in users_by_id]
+        for user in await asyncio.gather(*[
+                self.get_user(user_id) for user_id in missing]):
+            if user and not (name and name not in user.name.lower()):
+                users_by_id[user.id] = user
+
+        users = []
+        for user_id, user_roles in roles.items():
+            user = users_by_id.get(user_id)
+            if user:
+                user.roles = user_roles
+                users.append(user)
+        return users
+
+    async def create_user(self, name, password, email, created_on,
+                          domain=None, default_project=None):
+        fields = {
+            'name': name,
+            'password': password,
+            'email': email,
+            'created_on': created_on,
+            'domain_id': _id(domain),
+            'default_project_id': _id(default_project),
+        }
+        data = await self.client.request('POST', '/users', body={
+            'user': {key: value for key, value in fields.items()
+                     if value is not None}})
+        return Resource(data['user'])
+
+    async def enable_user(self, user):
+        await self._update_user(user, enabled=True)
+
+    async def disable_user(self, user):
+        await self._update_user(user, enabled=False)
+
+    async def update_user_password(self, user, password):
+        await self._update_user(user, password=password)
+
+    async def update_user_email(self, user, email):
+        await self._update_user(user, email=email)
+
+    async def update_user_name(self, user, name):
+        await self._update_user(user, name=name)
+
+    async def find_role(self, name):
+        return await self.roles.find_role(name)
+
+    async def get_roles(self, user, project):
+        return await self.client.list(
+            '/projects/%s/users/%s/roles' % (_id(project), _id(user)),
+            'roles')
+
+    async def get_all_roles(self, user):
+        assignments = await self.client.list(
+            '/role_assignments', 'role_assignments', {'user.id': _id(user)})
+        projects = defaultdict(list)
+        for assignment in assignments:
+            project = assignment.scope['project']['id']
+            projects[project].append(
+                await self.roles.get_role(assignment.role['id']))
+        return projects
+
+    def _role_path(self, user, role, project):
+        return '/projects/%s/users/%s/roles/%s' % (
+            _id(project), _id(user), _id(role))
+
+    async def add_user_role(self, user, role, project):
+        try:
+            await self.client.request(
+                'PUT', self._role_path(user, role, project))
+        except ksa_exceptions.Conflict:
+            # Conflict is ok, it means the user already has this role.
+            pass
+
+    async def remove_user_role(self, user, role, project):
+        await self.client.request(
+            'DELETE', self._role_path(user, role, project))
+
+    async def find_project(self, project_name, domain):
+        return await self._first(
+            '/projects', 'projects',
+            {'name': project_name, 'domain_id': _id(domain)})
+
+    async def get_project(self, project_id):
+        return await self._get('/projects/%s' % project_id, 'project')
+
+    async def update_project(self, project, name=None, domain=None,
+                             description=None, enabled=None, **kwargs):
+        kwargs.update(name=name, domain_id=_id(domain),
+                      description=description, enabled=enabled)
+        try:
+            data = await self.client.request(
+                'PATCH', '/projects/%s' % _id(project), body={
+                    'project': {key: value for key, value in kwargs.items()
+                                if value is not None}})
+        except ksa_exceptions.NotFound:
+            return None
+        return Resource(data['project'])
+
+    async def create_project(self, project_name, created_on, parent=None,
+                             domain=None):
+        fields = {
+            'name': project_name,
+            'created_on': created_on,
+            'enabled': True,
+            'domain_id': _id(domain),
+            'parent_id': _id(parent),
+        }
+        data = await self.client.request('POST', '/projects', body={
+            'project': {key: value for key, value in fields.items()
+                        if value is not None}})
+        return Resource(data['project'])
+
+    async def get_domain(self, domain_id):
+        return await self._get('/domains/%s' % domain_id, 'domain')
+
+    async def find_domain(self, domain_name):
+        return await self._first(
+            '/domains', 'domains', {'name': domain_name})
+
+    async def get_region(self, region_id):
+        return await self._get('/regions/%s' % region_id, 'region')
+
+
+def get_loop():
+    """
+    Returns the event loop the coroutines run on, starting it in a
+    background thread on first use, and again after a fork, as the
+    thread doesn't survive one.
+    """
+    global loop, loop_pid, client
+    with loop_lock:
+        pid = os.getpid()
+        if loop_pid != pid:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever)
+            thread.daemon = True
+            thread.start()
+            client = None
+            loop_pid = pid
+        return loop
+
+
+def get_client():
+    """ Returns the KeystoneClient shared by the whole process """
+    global client
+    event_loop = get_loop()
+    with loop_lock:
+        if client is None:
+            client = KeystoneClient()
+            client.role_catalog = RoleCatalog(client)
+        return event_loop, client
+
+
+def reset_client():
+    """ Closes the shared KeystoneClient, so the next call gets a new one """
+    global client
+    with loop_lock:
+        old_client, client = client, None
+    if old_client is not None:
+        asyncio.run_coroutine_threadsafe(old_client.close(), loop).result()
+
+
+class IdentityManager(object):
+    """
+    Drop in replacement for user_store.IdentityManager, running
+    AsyncIdentityManager on the shared event loop.
+
+    The project, domain and region lookups go through the same
+    caches as user_store.IdentityManager, and the deadline of the
+    calling thread applies to each call.
+    """
+
+    def __init__(self):
+        self.loop, client = get_client()
+        self.manager = AsyncIdentityManager(client)
+
+    def _run(self, coroutine):
+        expires_at = openstack_clients.get_deadline()
+        timeout = None
+        if expires_at is not None:
+            timeout = expires_at - time.time()
+            if timeout <= 0:
+                coroutine.close()
+                raise exceptions.DeadlineExceeded(
+                    "Ran out of time before calling service 'identity'.")
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise exceptions.DeadlineExceeded(
+                "Ran out of time calling service 'identity'.")
+
+    def _call(self, method_name, *args, **kwargs):
+        return self._run(
+            getattr(self.manager, method_name)(*args, **kwargs))
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not hasattr(self.manager, name):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._call(name, *args, **kwargs)
+
+    def _cache_for(self, call):
+        """
+        The LookupCache and key the given call is cached under, or
+        (None, None) if it isn't cached.
+        """
+        name, args = call[0], call[1:]
+        if name == 'get_project':
+            return project_cache, args[0]
+        if name == 'get_domain':
+            return domain_cache, ('id', args[0])
+        if name == 'find_domain':
+            return domain_cache, ('name', args[0])
+        if name == 'get_region':
+            return region_cache, args[0]
+        return None, None
+
+    def gather(self, *calls):
+        """
+        Runs independent calls at the same time, each given as a
+        tuple of the method name followed by its arguments, and
+        returns their results in order.
+
+        Calls the caches have a result for are served from them, and
+        the results of the rest are cached as they would be when made
+        one at a time.
+        """
+        results = {}
+        for i, call in enumerate(calls):
+            cache, key = self._cache_for(call)
+            if cache is not None:
+                found, value = cache.lookup(
+                    key, lambda call=call: self._call(*call))
+                if found:
+                    results[i] = value
+        missing = [i for i in range(len(calls)) if i not in results]
+        if missing:
+            found = self._call('gather', *[calls[i] for i in missing])
+            for i, value in zip(missing, found):
+                results[i] = value
+                cache, key = self._cache_for(calls[i])
+                if cache is not None:
+                    cache.set(key, value)
+        return [results[i] for i in range(len(calls))]
+
+    def get_project(self, project_id):
+        return project_cache.get(
+            project_id, lambda: self._call('get_project', project_id))
+
+    def update_project(self, project, *args, **kwargs):
+        try:
+            return self._call('update_project', project, *args, **kwargs)
+        finally:
+            invalidate_project(_id(project))
+
+    def get_domain(self, domain_id):
+        return domain_cache.get(
+            ('id', domain_id), lambda: self._call('get_domain', domain_id))
+
+    def find_domain(self, domain_name):
+        return domain_cache.get(
+            ('name', domain_name),
+            lambda: self._call('find_domain', domain_name))
+
+    def get_region(self, region_id):
+        return region_cache.get(
+            region_id, lambda: self._call('get_region', region_id))
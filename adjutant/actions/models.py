@@ -18,8 +18,10 @@ from django.conf import settings
 from django.db import models
 from django.utils import timezone
 
+from adjutant.api.models import DirtyFieldsMixin
 
-class Action(models.Model):
+
+class Action(DirtyFieldsMixin, models.Model):
     """
     Database model representation of an action.
     """
@@ -42,6 +44,28 @@ class Action(models.Model):
     order = models.IntegerField()
     created = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['task', 'order'],
+                         name='actions_task_order_idx'),
+        ]
+
+    # What goes into the task's summary of its actions.
+    SUMMARY_FIELDS = ('valid', 'need_token', 'auto_approve')
+
+    def save(self, *args, **kwargs):
+        """
+        Also updates the task's summary of its actions, when this is
+        a new action or one that changed what goes into it.
+        """
+        saving = kwargs.get('update_fields') or self.SUMMARY_FIELDS
+        changed = (self._state.adding or
+                   set(self.dirty_fields()) & set(saving) &
+                   set(self.SUMMARY_FIELDS))
+        super(Action, self).save(*args, **kwargs)
+        if changed:
+            self.task.update_action_summary()
+
     def get_action(self):
         """Returns self as the appropriate action wrapper type."""
         data = self.action_data
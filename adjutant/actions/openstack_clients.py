@@ -13,8 +13,16 @@
 #    under the License.
 
 
+from contextlib import contextmanager
+from logging import getLogger
+import os
+import threading
+import time
+
 from django.conf import settings
+from django.utils import timezone
 
+from keystoneauth1 import exceptions as ksa_exceptions
 from keystoneauth1.identity import v3
 from keystoneauth1 import session
 from keystoneclient import client as ks_client
@@ -23,6 +31,8 @@ from cinderclient import client as cinderclient
 from neutronclient.v2_0 import client as neutronclient
 from novaclient import client as novaclient
 
+from adjutant import exceptions
+
 # Defined for use locally
 DEFAULT_COMPUTE_VERSION = "2"
 DEFAULT_IDENTITY_VERSION = "3"
@@ -35,47 +45,393 @@ DEFAULT_VOLUME_VERSION = "2"
 # Auth session shared by default with all clients
 client_auth_session = None
 
+# Clients built on the shared session, keyed by (service, region, version).
+# The clients hold no per request state, so one per process is enough.
+client_cache = {}
+
+# NOTE: The pid that built the session and clients. A forked worker
+# (e.g. gunicorn with preload) must not reuse the connection pool of its
+# parent, so if this doesn't match we throw everything away and start over.
+client_pid = None
+
+client_lock = threading.RLock()
+
+# Renews the token of the shared session, if CLIENT_SETTINGS['auth_refresh']
+client_auth_refresher = None
+
+# Circuit breakers, keyed by service type.
+breakers = {}
+breakers_lock = threading.Lock()
+
+# Deadline for calls made by the current thread, see 'deadline'.
+local = threading.local()
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the failures of calls to one service.
+
+    After CLIENT_SETTINGS['breaker_failures'] failures in a row the
+    breaker opens, and calls fail straight away with ServiceUnavailable
+    rather than waiting on a service that is down. After
+    CLIENT_SETTINGS['breaker_reset'] seconds one call is let through to
+    try the service again. If it works the breaker closes, otherwise
+    it stays open for another breaker_reset seconds.
+
+    Only outages count as failures: connection errors, timeouts
+    and 5xx responses. A 404 or 409 is the service working fine.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, service):
+        self.service = service
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def failure_threshold(self):
+        return settings.CLIENT_SETTINGS.get('breaker_failures', 5)
+
+    @property
+    def reset_timeout(self):
+        return settings.CLIENT_SETTINGS.get('breaker_reset', 30)
+
+    def before_call(self):
+        """
+        Raises ServiceUnavailable if the call shouldn't be made.
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return
+            if (self.state == self.OPEN and
+                    time.time() - self.opened_at >= self.reset_timeout):
+                # let this call through as a trial
+                self.state = self.HALF_OPEN
+                return
+        raise exceptions.ServiceUnavailable(
+            "Service '%s' is failing, so calls to it are being refused "
+            "for now." % self.service)
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if (self.state == self.HALF_OPEN or
+                    self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def record_unknown(self):
+        """
+        The call ended without telling us anything about the service.
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                # let the next call have a try instead
+                self.state = self.OPEN
+
+    def to_dict(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'opened_at': self.opened_at,
+        }
+
+
+def get_breaker(service):
+    with breakers_lock:
+        if service not in breakers:
+            breakers[service] = CircuitBreaker(service)
+        return breakers[service]
+
+
+def get_breaker_states():
+    """ Returns the state of the circuit breaker for each service """
+    with breakers_lock:
+        return dict(
+            (service, breaker.to_dict())
+            for service, breaker in breakers.items())
+
+
+def reset_breakers():
+    with breakers_lock:
+        breakers.clear()
+
+
+@contextmanager
+def deadline(expires_at):
+    """
+    Calls to OpenStack services made by this thread within the block
+    must finish by expires_at (a time.time() value), or they raise
+    DeadlineExceeded. Requests are given no more than the time left.
+
+    A deadline of None adds no limit. Nested deadlines can only
+    make the limit earlier.
+    """
+    previous = get_deadline()
+    if expires_at is None or (previous is not None and
+                              previous < expires_at):
+        expires_at = previous
+    local.deadline = expires_at
+    try:
+        yield
+    finally:
+        local.deadline = previous
+
+
+def get_deadline():
+    return getattr(local, 'deadline', None)
+
+
+def is_outage(error):
+    """
+    Whether an error means the service is in trouble, rather than
+    there being something wrong with the request.
+    """
+    if isinstance(error, (ksa_exceptions.ConnectionError,
+                          ksa_exceptions.RequestTimeout,
+                          ksa_exceptions.HttpServerError)):
+        return True
+    return False
+
+
+class GuardedSession(session.Session):
+    """
+    Auth session which every client shares. Sends each request through
+    the circuit breaker for its service, and applies the deadline of
+    the calling thread.
+    """
+
+    def request(self, url, method, **kwargs):
+        endpoint_filter = kwargs.get('endpoint_filter') or {}
+        # NOTE: Requests with no service type are for tokens.
+        service = (kwargs.get('service_type') or
+                   endpoint_filter.get('service_type') or 'identity')
+        breaker = get_breaker(service)
+
+        expires_at = get_deadline()
+        limited = False
+        if expires_at is not None:
+            remaining = expires_at - time.time()
+            if remaining <= 0:
+                raise exceptions.DeadlineExceeded(
+                    "Ran out of time before calling service '%s'." % service)
+            timeout = kwargs.get('timeout', self.timeout)
+            if timeout is None or timeout > remaining:
+                kwargs['timeout'] = remaining
+                limited = True
+
+        breaker.before_call()
+        try:
+            response = super(GuardedSession, self).request(
+                url, method, **kwargs)
+        except Exception as e:
+            if isinstance(e, ksa_exceptions.ConnectTimeout) and limited:
+                # Our deadline, not the service, ran out.
+                breaker.record_unknown()
+                raise exceptions.DeadlineExceeded(
+                    "Ran out of time calling service '%s'." % service)
+            if is_outage(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+
+class AuthRefresher(object):
+    """
+    Renews the token of an auth session in a background thread,
+    CLIENT_SETTINGS['auth_refresh_margin'] seconds before it expires,
+    so no request has to wait on Keystone for a new one.
+
+    If renewing fails it is retried every
+    CLIENT_SETTINGS['auth_refresh_retry'] seconds, and the current
+    token keeps being used until it actually expires.
+    """
+
+    def __init__(self, auth_session):
+        self.session = auth_session
+        self.auth = auth_session.auth
+        self.stop_event = threading.Event()
+        self.logger = getLogger('adjutant')
+        # NOTE: By default the plugin itself re-authenticates
+        # a couple of minutes before expiry, in whichever request gets
+        # there first. We do that here, so only let it do so once the
+        # token has actually expired.
+        self.auth.MIN_TOKEN_LIFE_SECONDS = 1
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    @property
+    def margin(self):
+        return settings.CLIENT_SETTINGS.get('auth_refresh_margin', 300)
+
+    @property
+    def retry(self):
+        return settings.CLIENT_SETTINGS.get('auth_refresh_retry', 30)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def refresh(self):
+        """
+        Fetches a new token, keeping the current one if that fails.
+        """
+        try:
+            self.auth.auth_ref = self.auth.get_auth_ref(self.session)
+            return True
+        except Exception as e:
+            self.logger.warning(
+                "(%s) - Failed to renew the Keystone token: %s" %
+                (timezone.now(), e))
+            return False
+
+    def _next_refresh(self):
+        expires_in = get_auth_expires_in(self.session)
+        if expires_in is None:
+            return 0
+        return max(expires_in - self.margin, 0)
+
+    def run(self):
+        while True:
+            wait = self._next_refresh()
+            if wait <= 0:
+                self.refresh()
+                # Don't spin if failing, or the token lives
+                # for less than the margin.
+                wait = max(self._next_refresh(), self.retry)
+            if self.stop_event.wait(wait):
+                return
+
+
+def _check_pid():
+    """ Resets the session and clients if we are in a forked child """
+    global client_auth_session, client_auth_refresher, client_pid
+    pid = os.getpid()
+    if client_pid != pid:
+        # The refresher thread didn't survive the fork.
+        client_auth_refresher = None
+        client_auth_session = None
+        client_cache.clear()
+        client_pid = pid
+
+
+def reset_clients():
+    """ Drops the shared session and all the cached clients """
+    global client_auth_session, client_auth_refresher
+    with client_lock:
+        if client_auth_refresher:
+            client_auth_refresher.stop()
+        client_auth_refresher = None
+        client_auth_session = None
+        client_cache.clear()
+
+
+def get_auth_expires_in(auth_session=None):
+    """
+    Returns the seconds until the token of the given, or the shared,
+    auth session expires, or None if it has no token yet.
+    """
+    auth_session = auth_session or client_auth_session
+    auth_ref = getattr(getattr(auth_session, 'auth', None), 'auth_ref', None)
+    if auth_ref is None or auth_ref.expires is None:
+        return None
+    return (auth_ref.expires - timezone.now()).total_seconds()
+
 
 def get_auth_session():
     """ Returns a global auth session to be shared by all clients """
-    global client_auth_session
-    if not client_auth_session:
+    global client_auth_session, client_auth_refresher
+    with client_lock:
+        _check_pid()
+        if not client_auth_session:
+
+            auth = v3.Password(
+                username=settings.KEYSTONE['username'],
+                password=settings.KEYSTONE['password'],
+                project_name=settings.KEYSTONE['project_name'],
+                auth_url=settings.KEYSTONE['auth_url'],
+                user_domain_id=settings.KEYSTONE.get('domain_id', "default"),
+                project_domain_id=settings.KEYSTONE.get(
+                    'domain_id', "default"),
+            )
+            client_auth_session = GuardedSession(
+                auth=auth,
+                timeout=settings.CLIENT_SETTINGS.get('request_timeout'))
+
+            if settings.CLIENT_SETTINGS.get('auth_refresh', False):
+                client_auth_refresher = AuthRefresher(client_auth_session)
+                client_auth_refresher.start()
+
+        return client_auth_session
 
-        auth = v3.Password(
-            username=settings.KEYSTONE['username'],
-            password=settings.KEYSTONE['password'],
-            project_name=settings.KEYSTONE['project_name'],
-            auth_url=settings.KEYSTONE['auth_url'],
-            user_domain_id=settings.KEYSTONE.get('domain_id', "default"),
-            project_domain_id=settings.KEYSTONE.get('domain_id', "default"),
-        )
-        client_auth_session = session.Session(auth=auth)
 
-    return client_auth_session
+def get_cached_client(service, region, version, build_client):
+    """
+    Returns the client for the given service, region and version,
+    building it with build_client(auth_session) on first use.
+    """
+    key = (service, region, version)
+    with client_lock:
+        # NOTE: get the session first, as that is what
+        # notices a fork and clears the cache.
+        auth_session = get_auth_session()
+        try:
+            return client_cache[key]
+        except KeyError:
+            client = build_client(auth_session)
+            client_cache[key] = client
+            return client
 
 
 def get_keystoneclient(version=DEFAULT_IDENTITY_VERSION):
-    return ks_client.Client(
-        version,
-        session=get_auth_session())
+    return get_cached_client(
+        'identity', None, version,
+        lambda auth_session: ks_client.Client(
+            version, session=auth_session))
 
 
 def get_neutronclient(region):
     # always returns neutron client v2
-    return neutronclient.Client(
-        session=get_auth_session(),
-        region_name=region)
+    return get_cached_client(
+        'network', region, '2',
+        lambda auth_session: neutronclient.Client(
+            session=auth_session,
+            region_name=region))
 
 
 def get_novaclient(region, version=DEFAULT_COMPUTE_VERSION):
-    return novaclient.Client(
-        version,
-        session=get_auth_session(),
-        region_name=region)
+    return get_cached_client(
+        'compute', region, version,
+        lambda auth_session: novaclient.Client(
+            version,
+            session=auth_session,
+            region_name=region))
 
 
 def get_cinderclient(region, version=DEFAULT_VOLUME_VERSION):
-    return cinderclient.Client(
-        version,
-        session=get_auth_session(),
-        region_name=region)
+    return get_cached_client(
+        'volume', region, version,
+        lambda auth_session: cinderclient.Client(
+            version,
+            session=auth_session,
+            region_name=region))
@@ -12,35 +12,268 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+import functools
+from logging import getLogger
+import threading
+import time
 
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
 from keystoneclient import exceptions as ks_exceptions
 
 from adjutant.actions.openstack_clients import get_keystoneclient
 
+# Flattened settings.ROLES_MAPPING, built on first use.
+_managable_roles_mapping = None
+
+
+@receiver(setting_changed)
+def _reset_managable_roles_mapping(setting, **kwargs):
+    global _managable_roles_mapping
+    if setting == 'ROLES_MAPPING':
+        _managable_roles_mapping = None
+
+
+def get_managable_roles_mapping():
+    """
+    Returns a dict of role name to the frozenset of role names
+    that role is allowed to manage.
+    """
+    global _managable_roles_mapping
+    if _managable_roles_mapping is None:
+        _managable_roles_mapping = {
+            role_name: frozenset(managable)
+            for role_name, managable in settings.ROLES_MAPPING.items()}
+    return _managable_roles_mapping
+
 
 def get_managable_roles(user_roles):
     """
     Given a list of user role names, returns a list of names
     that the user is allowed to manage.
     """
-    manage_mapping = settings.ROLES_MAPPING
-    # merge mapping lists to form a flat permitted roles list
-    managable_role_names = [mrole for role_name in user_roles
-                            if role_name in manage_mapping
-                            for mrole in manage_mapping[role_name]]
-    # a set has unique items
-    managable_role_names = set(managable_role_names)
+    manage_mapping = get_managable_roles_mapping()
+    # merge mapping sets to form a flat permitted roles set
+    managable_role_names = set()
+    for role_name in user_roles:
+        managable_role_names |= manage_mapping.get(role_name, frozenset())
     return managable_role_names
 
 
+class RoleCatalog(object):
+    """
+    In process snapshot of all the roles in Keystone, so role
+    lookups don't cost a Keystone round trip each.
+
+    The whole catalog is loaded in one call, and once it is older
+    than IDENTITY_SETTINGS['role_cache_ttl'] it is reloaded in a
+    background thread while the old snapshot keeps being served.
+    A lookup for a role that isn't in the snapshot reloads it
+    right away, in case the role is new. If it still isn't there,
+    lookups for it don't reload again until the next load.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refresh_thread = None
+        self.clear()
+
+    def clear(self):
+        self.roles_by_name = {}
+        self.roles_by_id = {}
+        self.misses = set()
+        self.loaded_at = None
+
+    @property
+    def ttl(self):
+        return settings.IDENTITY_SETTINGS.get('role_cache_ttl', 600)
+
+    def load(self, ks_client):
+        roles = ks_client.roles.list()
+        # NOTE: Swap in whole new dicts rather than mutating
+        # the current ones, so readers never see a half loaded catalog.
+        self.roles_by_name = {role.name: role for role in roles}
+        self.roles_by_id = {role.id: role for role in roles}
+        self.misses = set()
+        self.loaded_at = time.time()
+
+    def _refresh(self):
+        try:
+            self.load(get_keystoneclient())
+        except Exception:
+            # We keep serving the old snapshot, and try again
+            # on the next lookup.
+            pass
+
+    def _check_age(self, ks_client):
+        """ Returns True if it had to load the catalog right away """
+        if self.loaded_at is None:
+            self.load(ks_client)
+            return True
+        elif time.time() - self.loaded_at > self.ttl:
+            with self.lock:
+                if (self.refresh_thread is not None and
+                        self.refresh_thread.is_alive()):
+                    return
+                self.refresh_thread = threading.Thread(target=self._refresh)
+                self.refresh_thread.daemon = True
+                self.refresh_thread.start()
+        return False
+
+    def _lookup(self, ks_client, attr, key):
+        loaded = self._check_age(ks_client)
+        role = getattr(self, attr).get(key)
+        if role is None and (attr, key) not in self.misses:
+            if not loaded:
+                self.load(ks_client)
+                role = getattr(self, attr).get(key)
+            if role is None:
+                self.misses.add((attr, key))
+        return role
+
+    def get_role(self, ks_client, role_id):
+        return self._lookup(ks_client, 'roles_by_id', role_id)
+
+    def find_role(self, ks_client, name):
+        return self._lookup(ks_client, 'roles_by_name', name)
+
+
+role_catalog = RoleCatalog()
+
+
+class LookupCache(object):
+    """
+    Read-through cache for Keystone lookups by key.
+
+    - Results are kept for IDENTITY_SETTINGS['<name>_cache_ttl'] seconds.
+    - 'Not found' (None) results are cached too, but only for
+      IDENTITY_SETTINGS['negative_cache_ttl'] seconds.
+    - For IDENTITY_SETTINGS['stale_cache_ttl'] seconds after that the
+      old result is still served, while a background thread fetches a
+      new one, and is also served if fetching a new one fails. That way
+      a slow or struggling Keystone doesn't hold up requests.
+    - Past that the old result is never served, so errors fetching a
+      new one are raised rather than hidden behind a result that may
+      be long out of date.
+    """
+
+    max_entries = 10000
+
+    def __init__(self, name, default_ttl=60):
+        self.name = name
+        self.default_ttl = default_ttl
+        self.lock = threading.Lock()
+        self.refreshing = set()
+        self.clear()
+
+    def clear(self):
+        self.entries = {}
+
+    @property
+    def ttl(self):
+        return settings.IDENTITY_SETTINGS.get(
+            '%s_cache_ttl' % self.name, self.default_ttl)
+
+    @property
+    def negative_ttl(self):
+        return settings.IDENTITY_SETTINGS.get('negative_cache_ttl', 10)
+
+    @property
+    def stale_ttl(self):
+        return settings.IDENTITY_SETTINGS.get('stale_cache_ttl', 60)
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def set(self, key, value):
+        if len(self.entries) >= self.max_entries:
+            self._prune()
+        self.entries[key] = (value, time.time())
+
+    def _prune(self):
+        now = time.time()
+        oldest = max(self.ttl, self.negative_ttl) + self.stale_ttl
+        self.entries = {
+            key: entry for key, entry in list(self.entries.items())
+            if now - entry[1] <= oldest}
+        if len(self.entries) >= self.max_entries:
+            self.clear()
+
+    def _refresh(self, key, load):
+        try:
+            self.set(key, load())
+        except Exception:
+            # Leave the stale entry in place.
+            pass
+        finally:
+            with self.lock:
+                self.refreshing.discard(key)
+
+    def _refresh_in_background(self, key, load):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+        thread = threading.Thread(target=self._refresh, args=(key, load))
+        thread.daemon = True
+        thread.start()
+
+    def lookup(self, key, load):
+        """
+        Returns (True, value) if there is a value for key recent
+        enough to serve, refreshing it with load() in the background
+        if it is stale, and otherwise (False, None).
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.time() - stored_at
+            ttl = self.ttl if value is not None else self.negative_ttl
+            if age <= ttl:
+                return True, value
+            if age <= ttl + self.stale_ttl:
+                self._refresh_in_background(key, load)
+                return True, value
+        return False, None
+
+    def get(self, key, load):
+        """
+        Returns the cached value for key, calling load() to
+        fetch it if it isn't cached or is too old.
+        """
+        found, value = self.lookup(key, load)
+        if found:
+            return value
+
+        value = load()
+        self.set(key, value)
+        return value
+
+
+project_cache = LookupCache('project')
+domain_cache = LookupCache('domain', default_ttl=300)
+region_cache = LookupCache('region', default_ttl=300)
+
+
+def invalidate_project(project_id):
+    """
+    Drops any cached lookup of the given project, including a
+    cached 'not found'.
+    """
+    project_cache.invalidate(project_id)
+
+
 class IdentityManager(object):
     """
     A wrapper object for the Keystone Client. Mainly setup as
     such for easier testing, but also so it can be replaced
     later with an LDAP + Keystone Client variant.
+
+    Cheap to build, as the Keystone Client underneath is shared
+    by the whole process (see openstack_clients.get_cached_client).
     """
 
     def __init__(self):
@@ -64,7 +297,7 @@ class IdentityManager(object):
             user = None
         return user
 
-    def list_users(self, project):
+    def list_users(self, project, role=None, name=None):
         """
         Build a list of users for a given project using
         the v3 api.
@@ -72,29 +305,80 @@ class IdentityManager(object):
         Rather than simply list users, we use the assignments
         endpoint so we can also fetch all the roles for those users
         in the given project. Saves further api calls later on.
+
+        The users themselves are then listed in bulk, once per domain
+        they belong to, and joined locally, so the number of calls
+        doesn't grow with the number of users in the project.
+
+        Can optionally be limited to users with the given role name,
+        and to users whose name contains the given string (case
+        insensitive). Both are applied before any users are fetched,
+        and the name is also passed along to Keystone.
         """
         try:
-            roles = self.ks_client.roles.list()
-            role_dict = {role.id: role for role in roles}
-
-            users = {}
             user_assignments = self.ks_client.role_assignments.list(
-                project=project)
-            for assignment in user_assignments:
-                try:
-                    user = users.get(assignment.user['id'], None)
-                    if user:
-                        user.roles.append(role_dict[assignment.role['id']])
-                    else:
-                        user = self.ks_client.users.get(assignment.user['id'])
-                        user.roles = [role_dict[assignment.role['id']], ]
-                        users[user.id] = user
-                except AttributeError:
-                    # Just means the assignment is a group, so ignore it.
-                    pass
+                project=project, include_names=True)
         except ks_exceptions.NotFound:
             return []
-        return users.values()
+
+        if name:
+            name = name.lower()
+
+        roles = OrderedDict()
+        domains = set()
+        for assignment in user_assignments:
+            try:
+                assigned_user = assignment.user
+            except AttributeError:
+                # Just means the assignment is a group, so ignore it.
+                continue
+            user_name = assigned_user.get('name')
+            if name and user_name and name not in user_name.lower():
+                continue
+            role_assignment = role_catalog.get_role(
+                self.ks_client, assignment.role['id'])
+            if role_assignment is None:
+                getLogger('adjutant').warning(
+                    "Skipping assignment of unknown role %s to user %s." %
+                    (assignment.role['id'], assigned_user['id']))
+                continue
+            roles.setdefault(assigned_user['id'], []).append(role_assignment)
+            domain = assigned_user.get('domain', {}).get('id')
+            if domain:
+                domains.add(domain)
+
+        if role:
+            roles = OrderedDict(
+                (user_id, user_roles) for user_id, user_roles in roles.items()
+                if role in [r.name for r in user_roles])
+
+        if not roles:
+            return []
+
+        filters = {}
+        if name:
+            filters['name__icontains'] = name
+        users_by_id = {}
+        for domain in domains:
+            for user in self.ks_client.users.list(domain=domain, **filters):
+                if user.id in roles:
+                    users_by_id[user.id] = user
+
+        users = []
+        for user_id, user_roles in roles.items():
+            user = users_by_id.get(user_id)
+            if not user:
+                # No domain in the assignment, or the user is newer
+                # than the listing.
+                try:
+                    user = self.ks_client.users.get(user_id)
+                except ks_exceptions.NotFound:
+                    continue
+                if name and name not in user.name.lower():
+                    continue
+            user.roles = user_roles
+            users.append(user)
+        return users
 
     def create_user(self, name, password, email, created_on, domain=None,
                     default_project=None):
@@ -120,11 +404,7 @@ class IdentityManager(object):
         self.ks_client.users.update(user, name=name)
 
     def find_role(self, name):
-        try:
-            role = self.ks_client.roles.find(name=name)
-        except ks_exceptions.NotFound:
-            role = None
-        return role
+        return role_catalog.find_role(self.ks_client, name)
 
     def get_roles(self, user, project):
         return self.ks_client.roles.list(user=user, project=project)
@@ -135,14 +415,12 @@ class IdentityManager(object):
 
         Uses the new v3 assignments api method to quickly do this.
         """
-        roles = self.ks_client.roles.list()
-        role_dict = {role.id: role for role in roles}
-
         user_assignments = self.ks_client.role_assignments.list(user=user)
         projects = defaultdict(list)
         for assignment in user_assignments:
             project = assignment.scope['project']['id']
-            projects[project].append(role_dict[assignment.role['id']])
+            projects[project].append(role_catalog.get_role(
+                self.ks_client, assignment.role['id']))
 
         return projects
 
@@ -172,12 +450,16 @@ class IdentityManager(object):
         except ks_exceptions.NotFound:
             return None
 
-    def get_project(self, project_id):
+    def _get_project(self, project_id):
         try:
             return self.ks_client.projects.get(project_id)
         except ks_exceptions.NotFound:
             return None
 
+    def get_project(self, project_id):
+        return project_cache.get(
+            project_id, lambda: self._get_project(project_id))
+
     def update_project(self, project, name=None, domain=None, description=None,
                        enabled=None, **kwargs):
         try:
@@ -187,6 +469,8 @@ class IdentityManager(object):
                 **kwargs)
         except ks_exceptions.NotFound:
             return None
+        finally:
+            invalidate_project(getattr(project, 'id', project))
 
     def create_project(self, project_name, created_on, parent=None,
                        domain=None):
@@ -194,13 +478,21 @@ class IdentityManager(object):
             project_name, domain, parent=parent, created_on=created_on)
         return project
 
-    def get_domain(self, domain_id):
+    def _get_domain(self, domain_id):
         try:
             return self.ks_client.domains.get(domain_id)
         except ks_exceptions.NotFound:
             return None
 
+    def get_domain(self, domain_id):
+        return domain_cache.get(
+            ('id', domain_id), lambda: self._get_domain(domain_id))
+
     def find_domain(self, domain_name):
+        return domain_cache.get(
+            ('name', domain_name), lambda: self._find_domain(domain_name))
+
+    def _find_domain(self, domain_name):
         try:
             domains = self.ks_client.domains.list(name=domain_name)
             if domains:
@@ -211,9 +503,160 @@ class IdentityManager(object):
         except ks_exceptions.NotFound:
             return None
 
-    def get_region(self, region_id):
+    def _get_region(self, region_id):
         try:
             region = self.ks_client.regions.get(region_id)
         except ks_exceptions.NotFound:
             region = None
         return region
+
+    def get_region(self, region_id):
+        return region_cache.get(
+            region_id, lambda: self._get_region(region_id))
+
+    def gather(self, *calls):
+        """
+        Runs independent calls, each given as a tuple of the method
+        name followed by its arguments, and returns their results in
+        order. One after the other here, but at the same time with
+        the asyncio backend.
+        """
+        return [getattr(self, call[0])(*call[1:]) for call in calls]
+
+
+class IdentityMemo(object):
+    """
+    Memo of IdentityManager reads, shared by the actions of a task
+    during one stage ('pre_approve', 'post_approve', 'submit'), so
+    that the same lookup made by several actions, or several times by
+    one action, only reaches Keystone once.
+
+    Each read depends on some kinds of data, and each write changes
+    some kinds of data. A write drops every memoized read that depends
+    on what it changed.
+    """
+
+    reads = {
+        'find_user': {'user'},
+        'get_user': {'user'},
+        'list_users': {'user', 'assignment'},
+        'find_role': {'role'},
+        'get_roles': {'assignment'},
+        'get_all_roles': {'assignment'},
+        'find_project': {'project'},
+        'get_project': {'project'},
+        'get_domain': {'domain'},
+        'find_domain': {'domain'},
+        'get_region': {'region'},
+    }
+    writes = {
+        'create_user': {'user'},
+        'enable_user': {'user'},
+        'disable_user': {'user'},
+        'update_user_password': {'user'},
+        'update_user_email': {'user'},
+        'update_user_name': {'user'},
+        'add_user_role': {'assignment'},
+        'remove_user_role': {'assignment'},
+        'create_project': {'project'},
+        'update_project': {'project'},
+    }
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.actions = set()
+        self.entries = {}
+
+    def join(self, stage, action_id):
+        """
+        Registers an action as running the given stage with this memo.
+
+        Returns False if the memo is for a different stage, or the
+        action has already run this stage, meaning the stage is being
+        run again and a new memo is needed.
+        """
+        if stage != self.stage or action_id in self.actions:
+            return False
+        self.actions.add(action_id)
+        return True
+
+    @staticmethod
+    def _key(name, args, kwargs):
+        key = (name,
+               tuple(getattr(arg, 'id', arg) for arg in args),
+               tuple(sorted((k, getattr(v, 'id', v))
+                            for k, v in kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def read(self, method_name, method, *args, **kwargs):
+        key = self._key(method_name, args, kwargs)
+        if key is None:
+            return method(*args, **kwargs)
+        if key not in self.entries:
+            self.entries[key] = method(*args, **kwargs)
+        return self.entries[key]
+
+    def write(self, method_name, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self.invalidate(self.writes[method_name])
+
+    def invalidate(self, changed):
+        """ Drops every memoized read depending on the changed kinds """
+        self.entries = {
+            key: value for key, value in self.entries.items()
+            if not changed & self.reads[key[0]]}
+
+
+class MemoizedIdentityManager(object):
+    """
+    Wraps an IdentityManager so its reads go through an IdentityMemo.
+    """
+
+    def __init__(self, memo):
+        self.memo = memo
+        self.manager = IdentityManager()
+
+    def gather(self, *calls):
+        """
+        Serves what it can of the calls from the memo, and gathers
+        the rest from the manager underneath.
+        """
+        results = {}
+        keys = {}
+        for i, call in enumerate(calls):
+            if call[0] in self.memo.reads:
+                keys[i] = self.memo._key(call[0], call[1:], {})
+            if keys.get(i) in self.memo.entries:
+                results[i] = self.memo.entries[keys[i]]
+        missing = [i for i in range(len(calls)) if i not in results]
+        try:
+            found = self.manager.gather(*[calls[i] for i in missing])
+        finally:
+            changed = set()
+            for i in missing:
+                changed |= self.memo.writes.get(calls[i][0], set())
+            if changed:
+                self.memo.invalidate(changed)
+        for i, result in zip(missing, found):
+            results[i] = result
+            if keys.get(i) is not None:
+                self.memo.entries[keys[i]] = result
+        return [results[i] for i in range(len(calls))]
+
+    def __getattr__(self, name):
+        attr = getattr(self.manager, name)
+        if name in self.memo.reads:
+            return functools.partial(self.memo.read, name, attr)
+        if name in self.memo.writes:
+            return functools.partial(self.memo.write, name, attr)
+        return attr
+
+
+if settings.IDENTITY_SETTINGS.get('backend') == 'asyncio':
+    from adjutant.actions.async_user_store import IdentityManager  # noqa
@@ -1,6 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
 import six
 from smtplib import SMTPException
 
+from adjutant.actions import openstack_clients
 from adjutant.api.v1.utils import create_notification
 
 from django.core.mail import EmailMultiAlternatives
@@ -93,3 +95,37 @@ def send_email(to_addresses, context, conf, task):
             create_notification(task, notes, error=True)
 
         return False
+
+
+def run_concurrently(func, calls, max_workers):
+    """
+    Runs func once per tuple of arguments in calls, with at most
+    max_workers running at once, and waits for them all.
+
+    Returns a list of (arguments, exception) for the calls that
+    raised, in the order of calls. Nothing is run in a new thread
+    if max_workers or the number of calls is 1.
+    """
+    errors = []
+    if max_workers <= 1 or len(calls) <= 1:
+        for args in calls:
+            try:
+                func(*args)
+            except Exception as e:
+                errors.append((args, e))
+        return errors
+
+    # the calls share the caller's deadline
+    expires_at = openstack_clients.get_deadline()
+
+    def call(*args):
+        with openstack_clients.deadline(expires_at):
+            return func(*args)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(calls))) as pool:
+        futures = [(args, pool.submit(call, *args)) for args in calls]
+    for args, future in futures:
+        error = future.exception()
+        if error is not None:
+            errors.append((args, error))
+    return errors
@@ -13,12 +13,15 @@
 #    under the License.
 
 from logging import getLogger
+import time
 
 from django.conf import settings
 from django.utils import timezone
 
-from adjutant.actions import user_store
+from adjutant.actions import openstack_clients, user_store
 from adjutant.actions.models import Action
+from adjutant.actions.utils import run_concurrently
+from adjutant.exceptions import DeadlineExceeded, ServiceUnavailable
 
 
 class BaseAction(object):
@@ -54,6 +57,16 @@ class BaseAction(object):
 
     Other than the task cache, actions should not be altering database
     models other than themselves. This is not enforced, just a guideline.
+
+    Identity lookups should go through 'get_id_manager', so that the
+    same lookup made by the actions in a stage only runs once.
+
+    Changes to the action should be saved with 'save_action', which
+    during a stage leaves them to be saved together, as one update of
+    just the changed fields, at the end of it. Anything that changes
+    OpenStack or the outside world should be followed by 'checkpoint',
+    so what it did is recorded straight away, for rerunning the stage
+    should it fail later on.
     """
 
     required = []
@@ -67,6 +80,7 @@ class BaseAction(object):
         """
 
         self.logger = getLogger('adjutant')
+        self.in_stage = False
 
         for field in self.required:
             field_data = data[field]
@@ -82,7 +96,6 @@ class BaseAction(object):
                 task=task,
                 order=order
             )
-            action.save()
             self.action = action
 
     @property
@@ -104,7 +117,7 @@ class BaseAction(object):
 
     def set_cache(self, key, value):
         self.action.cache[key] = value
-        self.action.save()
+        self.save_action()
 
     @property
     def token_fields(self):
@@ -112,7 +125,7 @@ class BaseAction(object):
 
     def set_token_fields(self, token_fields):
         self.action.cache["token_fields"] = token_fields
-        self.action.save()
+        self.save_action()
 
     @property
     def auto_approve(self):
@@ -121,7 +134,24 @@ class BaseAction(object):
     def set_auto_approve(self, can_approve=True):
         self.add_note("Auto approve set to %s." % can_approve)
         self.action.auto_approve = can_approve
-        self.action.save()
+        self.save_action()
+
+    def save_action(self):
+        """
+        Saves the changes to the action, or during a stage leaves them
+        to be saved at the end of it.
+        """
+        if not self.in_stage:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Saves the changed fields of the action and its task, and the
+        notes added, now.
+        """
+        self.action.save_dirty()
+        self.action.task.save_dirty()
+        self.action.task.flush_action_notes()
 
     def add_note(self, note):
         """
@@ -146,14 +176,72 @@ class BaseAction(object):
             return settings.DEFAULT_ACTION_SETTINGS.get(
                 self.__class__.__name__, {})
 
+    def get_id_manager(self):
+        """
+        Returns an IdentityManager for this action to use.
+
+        While a stage is running, its reads are memoized on the task
+        and shared with the other actions running the same stage.
+        """
+        memo = getattr(self.action.task, 'identity_memo', None)
+        if memo is None:
+            return user_store.IdentityManager()
+        return user_store.MemoizedIdentityManager(memo)
+
+    def prefetch(self, *calls):
+        """
+        Makes the given independent IdentityManager reads together,
+        each given as a tuple of the method name followed by its
+        arguments, so that the checks after can be served them from
+        the stage's memo. With the asyncio backend they are all in
+        flight at the same time, rather than one after the other.
+
+        Calls with an argument of None are left out, as they are
+        checks that would fail before getting that far.
+        """
+        if getattr(self.action.task, 'identity_memo', None) is None:
+            return
+        calls = [call for call in calls if None not in call[1:]]
+        if calls:
+            self.get_id_manager().gather(*calls)
+
+    def _start_stage(self, stage):
+        task = self.action.task
+        self.action.track_changes()
+        task.track_changes()
+        memo = getattr(task, 'identity_memo', None)
+        if memo is None or not memo.join(stage, self.action.pk):
+            task.identity_memo = user_store.IdentityMemo(stage)
+            task.identity_memo.join(stage, self.action.pk)
+            budget = settings.CLIENT_SETTINGS.get('stage_deadline')
+            task.stage_deadline = time.time() + budget if budget else None
+
+    def _run_stage(self, stage, stage_fn, *args):
+        """
+        Runs the stage, sharing the stage's identity memo and its
+        deadline for calls to OpenStack with the other actions, and
+        saving what it changed at the end.
+        """
+        self._start_stage(stage)
+        self.in_stage = True
+        try:
+            with openstack_clients.deadline(self.action.task.stage_deadline):
+                return stage_fn(*args)
+        except (ServiceUnavailable, DeadlineExceeded) as e:
+            self.add_note("Error: %s" % e)
+            raise
+        finally:
+            self.in_stage = False
+            self.checkpoint()
+
     def pre_approve(self):
-        return self._pre_approve()
+        return self._run_stage('pre_approve', self._pre_approve)
 
     def post_approve(self):
-        return self._post_approve()
+        return self._run_stage('post_approve', self._post_approve)
 
     def submit(self, token_data):
-        return self._submit(token_data)
+        return self._run_stage('submit', self._submit, token_data)
 
     def _pre_approve(self):
         raise NotImplementedError
@@ -184,7 +272,7 @@ class ResourceMixin(object):
         return True
 
     def _validate_domain_id(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         domain = id_manager.get_domain(self.domain_id)
         if not domain:
             self.add_note('Domain does not exist.')
@@ -200,7 +288,7 @@ class ResourceMixin(object):
             return False
 
         # Now actually check the project exists.
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         project = id_manager.get_project(self.project_id)
         if not project:
             self.add_note('Project with id %s does not exist.' %
@@ -210,7 +298,7 @@ class ResourceMixin(object):
         return True
 
     def _validate_domain_name(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         self.domain = id_manager.find_domain(self.domain_name)
         if not self.domain:
             self.add_note('Domain does not exist.')
@@ -225,7 +313,7 @@ class UserMixin(ResourceMixin):
 
     # Accessors
     def _validate_username_exists(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
 
         self.user = id_manager.find_user(self.username, self.domain.id)
         if not self.user:
@@ -256,7 +344,7 @@ class UserMixin(ResourceMixin):
         return intersection == requested_roles
 
     def find_user(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         return id_manager.find_user(self.username, self.domain_id)
 
     # Mutators
@@ -266,9 +354,22 @@ class UserMixin(ResourceMixin):
     def remove_roles(self, user, roles, project_id):
         return self._user_roles_edit(user, roles, project_id, remove=True)
 
+    def grant_roles_to_users(self, users, roles, project_id):
+        return self._users_roles_edit(users, roles, project_id, remove=False)
+
     # Helper function to add or remove roles
     def _user_roles_edit(self, user, roles, project_id, remove=False):
-        id_manager = user_store.IdentityManager()
+        return self._users_roles_edit([user], roles, project_id, remove)
+
+    def _users_roles_edit(self, users, roles, project_id, remove=False):
+        """
+        Adds or removes the roles for each of the users.
+
+        The Keystone calls are made in parallel, up to
+        IDENTITY_SETTINGS['role_edit_concurrency'] at once. Every
+        failure is noted, and the first is raised once all are done.
+        """
+        id_manager = self.get_id_manager()
         if not remove:
             action_fn = id_manager.add_user_role
             action_string = "granting"
@@ -283,17 +384,27 @@ class UserMixin(ResourceMixin):
                     ks_roles.append(ks_role)
                 else:
                     raise TypeError("Keystone missing role: %s" % role)
-
-            for role in ks_roles:
-                action_fn(user, role, project_id)
         except Exception as e:
-            self.add_note(
-                "Error: '%s' while %s the roles: %s on user: %s " %
-                (e, action_string, roles, user))
+            for user in users:
+                self.add_note(
+                    "Error: '%s' while %s the roles: %s on user: %s " %
+                    (e, action_string, roles, user))
             raise
 
+        edits = [(user, role, project_id)
+                 for user in users for role in ks_roles]
+        errors = run_concurrently(
+            action_fn, edits,
+            settings.IDENTITY_SETTINGS.get('role_edit_concurrency', 4))
+        for (user, role, project_id), e in errors:
+            self.add_note(
+                "Error: '%s' while %s the role: %s on user: %s " %
+                (e, action_string, role.name, user))
+        if errors:
+            raise errors[0][1]
+
     def enable_user(self, user=None):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         try:
             if not user:
                 user = self.find_user()
@@ -305,7 +416,7 @@ class UserMixin(ResourceMixin):
             raise
 
     def create_user(self, password):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         try:
             user = id_manager.create_user(
                 name=self.username, password=password,
@@ -320,7 +431,7 @@ class UserMixin(ResourceMixin):
         return user
 
     def update_password(self, password, user=None):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         try:
             if not user:
                 user = self.find_user()
@@ -332,7 +443,7 @@ class UserMixin(ResourceMixin):
             raise
 
     def update_email(self, email, user=None):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         try:
             if not user:
                 user = self.find_user()
@@ -344,7 +455,7 @@ class UserMixin(ResourceMixin):
             raise
 
     def update_user_name(self, username, user=None):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         try:
             if not user:
                 user = self.find_user()
@@ -360,7 +471,7 @@ class ProjectMixin(ResourceMixin):
     """Mixin with functions for projects."""
 
     def _validate_parent_project(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         # NOTE(adriant): If parent id is None, Keystone defaults to the domain.
         # So we only care to validate if parent_id is not None.
         if self.parent_id:
@@ -372,7 +483,7 @@ class ProjectMixin(ResourceMixin):
         return True
 
     def _validate_project_absent(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         project = id_manager.find_project(
             self.project_name, self.domain_id)
         if project:
@@ -385,7 +496,7 @@ class ProjectMixin(ResourceMixin):
         return True
 
     def _create_project(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         try:
             project = id_manager.create_project(
                 self.project_name, created_on=str(timezone.now()),
@@ -395,9 +506,12 @@ class ProjectMixin(ResourceMixin):
                 "Error: '%s' while creating project: %s" %
                 (e, self.project_name))
             raise
+        # drop anything cached about this id, e.g. an earlier 'not found'
+        user_store.invalidate_project(project.id)
         # put project_id into action cache:
         self.action.task.cache['project_id'] = project.id
         self.set_cache('project_id', project.id)
+        self.checkpoint()
         self.add_note("New project '%s' created." % project.name)
 
 
@@ -407,7 +521,7 @@ class UserIdAction(BaseAction):
         """
         Gets the target user by id
         """
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         user = id_manager.get_user(self.user_id)
 
         return user
@@ -440,7 +554,7 @@ class UserNameAction(BaseAction):
         """
         Gets the target user by their username
         """
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         user = id_manager.find_user(self.username, self.domain_id)
 
         return user
@@ -17,7 +17,6 @@ import six
 from django.conf import settings
 
 from adjutant.actions.v1.base import BaseAction
-from adjutant.actions import user_store
 from adjutant.actions.utils import send_email
 
 
@@ -31,7 +30,7 @@ class SendAdditionalEmailAction(BaseAction):
                 self.emails.add(self.action.task.keystone_user['username'])
             else:
                 try:
-                    id_manager = user_store.IdentityManager()
+                    id_manager = self.get_id_manager()
                     email = id_manager.get_user(
                         self.action.task.keystone_user['user_id']).email
                     self.emails.add(email)
@@ -44,7 +43,7 @@ class SendAdditionalEmailAction(BaseAction):
             self.add_note('Adding email addresses for roles %s in project %s'
                           % (roles, project_id))
 
-            id_manager = user_store.IdentityManager()
+            id_manager = self.get_id_manager()
             users = id_manager.list_users(project_id)
             for user in users:
                 user_roles = [role.name for role in user.roles]
@@ -66,7 +65,7 @@ class SendAdditionalEmailAction(BaseAction):
 
     def _validate(self):
         self.action.valid = True
-        self.action.save()
+        self.save_action()
 
     def _pre_approve(self):
         self.perform_action('initial')
@@ -79,6 +78,8 @@ class SendAdditionalEmailAction(BaseAction):
 
     def perform_action(self, stage):
         self._validate()
+        # As the actions are read back from the database below.
+        self.checkpoint()
 
         task = self.action.task
         for action in task.actions:
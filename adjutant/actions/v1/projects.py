@@ -16,7 +16,6 @@ from uuid import uuid4
 
 from django.utils import timezone
 
-from adjutant.actions import user_store
 from adjutant.actions.v1.base import (
     BaseAction, UserNameAction, UserMixin, ProjectMixin)
 
@@ -42,7 +41,7 @@ class NewProjectAction(BaseAction, ProjectMixin, UserMixin):
             self._validate_domain_id() and
             self._validate_parent_project() and
             self._validate_project_absent())
-        self.action.save()
+        self.save_action()
 
     def _validate_domain_id(self):
         keystone_user = self.action.task.keystone_user
@@ -91,7 +90,7 @@ class NewProjectAction(BaseAction, ProjectMixin, UserMixin):
             keystone_user = self.action.task.keystone_user
 
             try:
-                id_manager = user_store.IdentityManager()
+                id_manager = self.get_id_manager()
                 user = id_manager.get_user(keystone_user['user_id'])
 
                 self.grant_roles(user, default_roles, project_id)
@@ -105,6 +104,7 @@ class NewProjectAction(BaseAction, ProjectMixin, UserMixin):
             # put user_id into action cache:
             self.action.task.cache['user_id'] = user.id
             self.set_cache('user_id', user.id)
+            self.checkpoint()
             self.add_note(("Existing user '%s' attached to project %s" +
                           " with roles: %s")
                           % (user.name, project_id,
@@ -135,15 +135,22 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
         super(NewProjectWithUserAction, self).__init__(*args, **kwargs)
 
     def _validate(self):
-        self.action.valid = (
-            self._validate_domain_id() and
-            self._validate_parent_project() and
-            self._validate_project_absent() and
-            self._validate_user())
-        self.action.save()
+        # The domain first, as it's usually cached, so requests for a
+        # missing one don't go on to look up everything else.
+        self.action.valid = self._validate_domain_id()
+        if self.action.valid:
+            self.prefetch(
+                ('get_project', self.parent_id),
+                ('find_project', self.project_name, self.domain_id),
+                ('find_user', self.username, self.domain_id))
+            self.action.valid = (
+                self._validate_parent_project() and
+                self._validate_project_absent() and
+                self._validate_user())
+        self.save_action()
 
     def _validate_user(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         user = id_manager.find_user(self.username, self.domain_id)
 
         if not user:
@@ -184,7 +191,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
         user_id = self.get_cache('user_id')
         project_id = self.get_cache('project_id')
 
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
 
         user = id_manager.get_user(user_id)
         project = id_manager.get_project(project_id)
@@ -196,7 +203,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
 
         self.action.task.cache['user_state'] = self.action.state
 
-        self.action.save()
+        self.save_action()
 
     def _pre_approve(self):
         self._validate()
@@ -219,7 +226,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
                 self._validate_domain_id() and
                 self._validate_parent_project() and
                 self._validate_project_absent())
-            self.action.save()
+            self.save_action()
 
             if not self.valid:
                 return
@@ -235,7 +242,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
             self.add_note("User already setup.")
         elif not user_id:
             self.action.valid = self._validate_user()
-            self.action.save()
+            self.save_action()
 
             if not self.valid:
                 return
@@ -245,7 +252,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
             self._create_user_for_project()
 
     def _create_user_for_project(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         default_roles = self.settings.get("default_roles", {})
 
         project_id = self.get_cache('project_id')
@@ -262,6 +269,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
                         email=self.email, domain=self.domain_id,
                         created_on=str(timezone.now()))
                     self.set_cache('user_id', user.id)
+                    self.checkpoint()
                 else:
                     user = id_manager.get_user(user_id)
                 # put user_id into action cache:
@@ -275,6 +283,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
                 raise
 
             self.set_cache('roles_granted', True)
+            self.checkpoint()
             self.add_note(
                 "New user '%s' created for project %s with roles: %s" %
                 (self.username, project_id, default_roles))
@@ -297,6 +306,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
                 raise
 
             self.set_cache('roles_granted', True)
+            self.checkpoint()
             self.add_note(("Existing user '%s' setup on project %s" +
                           " with roles: %s")
                           % (self.username, project_id,
@@ -328,6 +338,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
                     'User %s password has been changed.' % self.username)
 
                 self.set_cache('user_id', user.id)
+                self.checkpoint()
             else:
                 user = id_manager.get_user(user_id)
             self.action.task.cache['user_id'] = user.id
@@ -343,6 +354,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
                         (e, self.username, default_roles))
                     raise
                 self.set_cache('roles_granted', True)
+                self.checkpoint()
 
             self.add_note(("Existing user '%s' setup on project %s" +
                           " with roles: %s")
@@ -366,7 +378,7 @@ class NewProjectWithUserAction(UserNameAction, ProjectMixin, UserMixin):
         self.action.task.cache['project_id'] = project_id
         user_id = self.get_cache('user_id')
         self.action.task.cache['user_id'] = user_id
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
 
         if self.action.state in ["default", "disabled"]:
             user = id_manager.get_user(user_id)
@@ -405,7 +417,7 @@ class AddDefaultUsersToProjectAction(BaseAction, ProjectMixin, UserMixin):
         self.roles = self.settings.get('default_roles', [])
 
     def _validate_users(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         all_found = True
         for user in self.users:
             ks_user = id_manager.find_user(user, self.domain_id)
@@ -419,29 +431,31 @@ class AddDefaultUsersToProjectAction(BaseAction, ProjectMixin, UserMixin):
 
     def _pre_validate(self):
         self.action.valid = self._validate_users()
-        self.action.save()
+        self.save_action()
 
     def _validate(self):
         self.action.valid = (
             self._validate_users() and
             self._validate_project_id()
         )
-        self.action.save()
+        self.save_action()
 
     def _pre_approve(self):
         self._pre_validate()
 
     def _post_approve(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         self.project_id = self.action.task.cache.get('project_id', None)
         self._validate()
 
         if self.valid and not self.action.state == "completed":
             try:
-                for user in self.users:
-                    ks_user = id_manager.find_user(user, self.domain_id)
+                ks_users = [id_manager.find_user(user, self.domain_id)
+                            for user in self.users]
 
-                    self.grant_roles(ks_user, self.roles, self.project_id)
+                self.grant_roles_to_users(
+                    ks_users, self.roles, self.project_id)
+                for ks_user in ks_users:
                     self.add_note(
                         'User: "%s" given roles: %s on project: %s.' %
                         (ks_user.name, self.roles, self.project_id))
@@ -451,7 +465,7 @@ class AddDefaultUsersToProjectAction(BaseAction, ProjectMixin, UserMixin):
                     (e, self.project_id))
                 raise
             self.action.state = "completed"
-            self.action.save()
+            self.checkpoint()
             self.add_note("All users added.")
 
     def _submit(self, token_data):
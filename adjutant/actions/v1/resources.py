@@ -14,7 +14,7 @@
 
 from adjutant.actions.v1.base import BaseAction, ProjectMixin
 from django.conf import settings
-from adjutant.actions import openstack_clients, user_store
+from adjutant.actions import openstack_clients
 
 
 class NewDefaultNetworkAction(BaseAction, ProjectMixin):
@@ -38,7 +38,7 @@ class NewDefaultNetworkAction(BaseAction, ProjectMixin):
             self.add_note('ERROR: No region given.')
             return False
 
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         region = id_manager.get_region(self.region)
         if not region:
             self.add_note('ERROR: Region does not exist.')
@@ -70,7 +70,7 @@ class NewDefaultNetworkAction(BaseAction, ProjectMixin):
             self._validate_defaults() and
             self._validate_keystone_user()
         )
-        self.action.save()
+        self.save_action()
 
     def _create_network(self):
         neutron = openstack_clients.get_neutronclient(region=self.region)
@@ -92,6 +92,7 @@ class NewDefaultNetworkAction(BaseAction, ProjectMixin):
                     (e, defaults['network_name']))
                 raise
             self.set_cache('network_id', network['network']['id'])
+            self.checkpoint()
             self.add_note("Network %s created for project %s" %
                           (defaults['network_name'],
                            self.project_id))
@@ -117,6 +118,7 @@ class NewDefaultNetworkAction(BaseAction, ProjectMixin):
                     "Error: '%s' while creating subnet" % e)
                 raise
             self.set_cache('subnet_id', subnet['subnet']['id'])
+            self.checkpoint()
             self.add_note("Subnet created for network %s" %
                           defaults['network_name'])
         else:
@@ -142,6 +144,7 @@ class NewDefaultNetworkAction(BaseAction, ProjectMixin):
                     (e, defaults['router_name']))
                 raise
             self.set_cache('router_id', router['router']['id'])
+            self.checkpoint()
             self.add_note("Router created for project %s" %
                           self.project_id)
         else:
@@ -160,6 +163,7 @@ class NewDefaultNetworkAction(BaseAction, ProjectMixin):
                     "Error: '%s' while attaching interface" % e)
                 raise
             self.set_cache('port_id', interface['port_id'])
+            self.checkpoint()
             self.add_note("Interface added to router for subnet")
         else:
             self.add_note(
@@ -197,7 +201,7 @@ class NewProjectDefaultNetworkAction(NewDefaultNetworkAction):
             self._validate_region() and
             self._validate_defaults()
         )
-        self.action.save()
+        self.save_action()
 
     def _validate(self):
         self.action.valid = (
@@ -205,7 +209,7 @@ class NewProjectDefaultNetworkAction(NewDefaultNetworkAction):
             self._validate_project_id() and
             self._validate_defaults()
         )
-        self.action.save()
+        self.save_action()
 
     def _pre_approve(self):
         self._pre_validate()
@@ -258,7 +262,7 @@ class SetProjectQuotaAction(BaseAction):
                           'set it.')
             return False
 
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         project = id_manager.get_project(self.project_id)
         if not project:
             self.add_note('Project with id %s does not exist.' %
@@ -270,14 +274,14 @@ class SetProjectQuotaAction(BaseAction):
     def _pre_validate(self):
         # Nothing to validate yet.
         self.action.valid = True
-        self.action.save()
+        self.save_action()
 
     def _validate(self):
         # Make sure the project id is valid and can be used
         self.action.valid = (
             self._validate_project_exists()
         )
-        self.action.save()
+        self.save_action()
 
     def _pre_approve(self):
         self._pre_validate()
@@ -314,7 +318,7 @@ class SetProjectQuotaAction(BaseAction):
                     region_name, quota_size))
 
         self.action.state = "completed"
-        self.action.save()
+        self.checkpoint()
 
     def _submit(self, token_data):
         pass
@@ -0,0 +1,349 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+from unittest import skipIf
+
+import mock
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from keystoneauth1 import exceptions as ksa_exceptions
+
+from adjutant.actions import openstack_clients, user_store
+from adjutant.actions.v1.users import NewUserAction
+from adjutant.api.models import Task
+from adjutant.exceptions import DeadlineExceeded
+from adjutant.simulator import KeystoneService, SimulatorServer
+
+try:
+    from adjutant.actions import async_user_store
+except (ImportError, SyntaxError):
+    # Needs Python 3.5+ and aiohttp
+    async_user_store = None
+
+
+class SimulatorTestCase(TestCase):
+    """
+    Runs each test against a fresh simulated Keystone.
+    """
+
+    def setUp(self):
+        self.keystone = KeystoneService()
+        self.server = SimulatorServer([self.keystone]).start()
+        self.settings_override = override_settings(KEYSTONE={
+            'username': 'admin',
+            'password': 'password',
+            'project_name': 'admin',
+            'auth_url': self.server.url + '/v3',
+        })
+        self.settings_override.enable()
+        self.reset()
+
+    def tearDown(self):
+        self.reset()
+        self.settings_override.disable()
+        self.server.stop()
+
+    def reset(self):
+        openstack_clients.reset_clients()
+        openstack_clients.reset_breakers()
+        user_store.role_catalog.clear()
+        user_store.project_cache.clear()
+        user_store.domain_cache.clear()
+        user_store.region_cache.clear()
+        if async_user_store:
+            async_user_store.reset_client()
+
+    def add_project_user(self, name, role_names):
+        project = self.keystone.add_project('test_project')
+        user = self.keystone.add_user(name, email='%s@example.com' % name)
+        for role_name in role_names:
+            self.keystone.add_assignment(user['id'], project['id'], role_name)
+        return project, user
+
+
+class KeystoneClientSimulatorTests(SimulatorTestCase):
+
+    def test_lookups(self):
+        """
+        The keystoneclient IdentityManager works against the simulator.
+        """
+        project, user = self.add_project_user(
+            'test_user', ['_member_', 'project_admin'])
+        id_manager = user_store.IdentityManager()
+
+        self.assertEqual(
+            id_manager.find_user('test_user', 'default').id, user['id'])
+        self.assertEqual(
+            id_manager.get_project(project['id']).name, 'test_project')
+        self.assertEqual(id_manager.find_domain('Default').id, 'default')
+
+        users = id_manager.list_users(project['id'])
+        self.assertEqual([u.name for u in users], ['test_user'])
+        self.assertEqual(
+            sorted(r.name for r in users[0].roles),
+            ['_member_', 'project_admin'])
+
+
+@skipIf(async_user_store is None, "Needs Python 3.5+ and aiohttp.")
+class AsyncIdentityManagerTests(SimulatorTestCase):
+
+    def test_lookups(self):
+        """
+        Reads return the same things the keystoneclient one does.
+        """
+        project, user = self.add_project_user('test_user', ['_member_'])
+        id_manager = async_user_store.IdentityManager()
+
+        found = id_manager.find_user('test_user', 'default')
+        self.assertEqual(found.id, user['id'])
+        self.assertEqual(found.email, 'test_user@example.com')
+        self.assertEqual(id_manager.get_user(user['id']).name, 'test_user')
+        self.assertEqual(
+            id_manager.get_project(project['id']).name, 'test_project')
+        self.assertEqual(
+            id_manager.find_project('test_project', 'default').id,
+            project['id'])
+        self.assertEqual(id_manager.find_domain('Default').id, 'default')
+        self.assertEqual(id_manager.get_domain('default').name, 'Default')
+        self.assertEqual(
+            id_manager.get_region('RegionOne').id, 'RegionOne')
+        self.assertEqual(id_manager.find_role('_member_').name, '_member_')
+        self.assertEqual(
+            [r.name for r in id_manager.get_roles(user['id'], project['id'])],
+            ['_member_'])
+        self.assertEqual(
+            [r.name for r in id_manager.get_all_roles(user['id'])[
+                project['id']]],
+            ['_member_'])
+
+        self.assertIsNone(id_manager.find_user('missing', 'default'))
+        self.assertIsNone(id_manager.get_user('missing'))
+        self.assertIsNone(id_manager.get_project('missing'))
+        self.assertIsNone(id_manager.find_domain('missing'))
+        self.assertIsNone(id_manager.get_region('missing'))
+
+    def test_list_users(self):
+        """
+        Users come back with their roles, and can be filtered.
+        """
+        project, user = self.add_project_user(
+            'test_user', ['_member_', 'project_admin'])
+        other = self.keystone.add_user('other_user')
+        self.keystone.add_assignment(other['id'], project['id'], '_member_')
+        id_manager = async_user_store.IdentityManager()
+
+        users = id_manager.list_users(project['id'])
+        self.assertEqual(
+            sorted(u.name for u in users), ['other_user', 'test_user'])
+        roles = {u.name: sorted(r.name for r in u.roles) for u in users}
+        self.assertEqual(roles['test_user'], ['_member_', 'project_admin'])
+
+        users = id_manager.list_users(project['id'], role='project_admin')
+        self.assertEqual([u.name for u in users], ['test_user'])
+        users = id_manager.list_users(project['id'], name='OTHER')
+        self.assertEqual([u.name for u in users], ['other_user'])
+
+    def test_writes(self):
+        """
+        Users, projects and role assignments can be created and changed.
+        """
+        id_manager = async_user_store.IdentityManager()
+
+        project = id_manager.create_project(
+            'new_project', created_on='2017-01-01', domain='default')
+        user = id_manager.create_user(
+            'new_user', 'secret', 'new@example.com', '2017-01-01',
+            domain='default', default_project=project)
+        role = id_manager.find_role('project_mod')
+        id_manager.add_user_role(user, role, project)
+        # Granting it again is fine.
+        id_manager.add_user_role(user, role, project)
+        id_manager.update_user_email(user, 'changed@example.com')
+        id_manager.disable_user(user)
+
+        stored = self.keystone.users[user.id]
+        self.assertEqual(stored['email'], 'changed@example.com')
+        self.assertFalse(stored['enabled'])
+        self.assertEqual(stored['default_project_id'], project.id)
+        self.assertEqual(self.keystone.passwords[user.id], 'secret')
+        self.assertEqual(
+            [r.name for r in id_manager.get_roles(user, project)],
+            ['project_mod'])
+
+        id_manager.remove_user_role(user, role, project)
+        self.assertEqual(id_manager.get_roles(user, project), [])
+
+        # update_project drops the cached project
+        self.assertEqual(
+            id_manager.get_project(project.id).name, 'new_project')
+        id_manager.update_project(project, description='changed')
+        self.assertEqual(
+            id_manager.get_project(project.id).description, 'changed')
+
+        with self.assertRaises(ksa_exceptions.Conflict):
+            id_manager.create_project(
+                'new_project', created_on='2017-01-01', domain='default')
+
+    def test_gather(self):
+        """
+        Gathered calls return their results in order.
+        """
+        project, user = self.add_project_user('test_user', ['_member_'])
+        id_manager = async_user_store.IdentityManager()
+
+        domain, found_project, found_user, roles = id_manager.gather(
+            ('find_domain', 'Default'),
+            ('get_project', project['id']),
+            ('find_user', 'test_user', 'default'),
+            ('get_roles', user['id'], project['id']))
+
+        self.assertEqual(domain.id, 'default')
+        self.assertEqual(found_project.id, project['id'])
+        self.assertEqual(found_user.id, user['id'])
+        self.assertEqual([r.name for r in roles], ['_member_'])
+
+    def test_gather_cached(self):
+        """
+        Gathered project, domain and region lookups go through the
+        same caches as the lookups made one at a time.
+        """
+        project, user = self.add_project_user('test_user', ['_member_'])
+        id_manager = async_user_store.IdentityManager()
+        self.assertEqual(id_manager.find_domain('Default').id, 'default')
+
+        calls = sum(self.keystone.calls.values())
+        found_project, domain, found_user = id_manager.gather(
+            ('get_project', project['id']),
+            ('find_domain', 'Default'),
+            ('find_user', 'test_user', 'default'))
+        self.assertEqual(found_project.id, project['id'])
+        self.assertEqual(domain.id, 'default')
+        self.assertEqual(found_user.id, user['id'])
+        # Just the project and the user, as the domain was cached.
+        self.assertEqual(sum(self.keystone.calls.values()) - calls, 2)
+
+        calls = sum(self.keystone.calls.values())
+        self.assertEqual(
+            id_manager.get_project(project['id']).id, project['id'])
+        self.assertEqual(sum(self.keystone.calls.values()), calls)
+
+    def test_stage_lookups_overlap(self):
+        """
+        The lookups a NewUserAction prefetches for its checks are in
+        flight at the same time, so its stage takes about as long as
+        one of them, rather than as all of them.
+        """
+        project = self.keystone.add_project('test_project')
+        user = self.keystone.add_user(
+            'test@example.com', email='test@example.com')
+        self.keystone.add_assignment(user['id'], project['id'], '_member_')
+        # Get the token and the role catalog before adding latency.
+        async_user_store.IdentityManager().find_role('_member_')
+        self.keystone.latency = 0.2
+
+        task = Task.objects.create(
+            ip_address="0.0.0.0",
+            keystone_user={
+                'roles': ['admin'],
+                'project_id': project['id'],
+                'project_domain_id': 'default',
+            })
+        action = NewUserAction({
+            'email': 'test@example.com',
+            'project_id': project['id'],
+            'roles': ['_member_'],
+            'domain_id': 'default',
+        }, task=task, order=1)
+
+        with mock.patch('adjutant.actions.user_store.IdentityManager',
+                        async_user_store.IdentityManager):
+            calls = sum(self.keystone.calls.values())
+            start = time.time()
+            action.pre_approve()
+            duration = time.time() - start
+        calls = sum(self.keystone.calls.values()) - calls
+
+        self.assertTrue(action.valid)
+        self.assertEqual(action.action.state, 'complete')
+        # The domain, project and user together, then the user's roles.
+        self.assertEqual(calls, 4)
+        self.assertLess(duration, 0.2 * (calls - 1))
+
+    def test_unknown_role_reloads_once(self):
+        """
+        A role still missing after a reload doesn't reload the
+        catalog again until the next load.
+        """
+        id_manager = async_user_store.IdentityManager()
+        self.assertEqual(id_manager.find_role('_member_').name, '_member_')
+
+        for i in range(2):
+            self.assertIsNone(id_manager.find_role('missing'))
+        self.assertEqual(self.keystone.calls['list_roles'], 2)
+
+        self.keystone.add_role('new_role')
+        self.assertEqual(id_manager.find_role('new_role').name, 'new_role')
+        self.assertEqual(self.keystone.calls['list_roles'], 3)
+
+    def test_denied_stage_no_lookups(self):
+        """
+        A NewUserAction denied by its local checks makes no lookups.
+        """
+        project = self.keystone.add_project('test_project')
+        task = Task.objects.create(
+            ip_address="0.0.0.0",
+            keystone_user={
+                'roles': ['_member_'],
+                'project_id': project['id'],
+                'project_domain_id': 'default',
+            })
+        action = NewUserAction({
+            'email': 'test@example.com',
+            'project_id': project['id'],
+            'roles': ['_member_'],
+            'domain_id': 'default',
+        }, task=task, order=1)
+
+        with mock.patch('adjutant.actions.user_store.IdentityManager',
+                        async_user_store.IdentityManager):
+            action.pre_approve()
+
+        self.assertFalse(action.valid)
+        self.assertEqual(sum(self.keystone.calls.values()), 0)
+
+    def test_outage(self):
+        """
+        Connection errors count against the identity breaker.
+        """
+        id_manager = async_user_store.IdentityManager()
+        self.assertEqual(id_manager.find_domain('Default').id, 'default')
+        self.server.stop()
+
+        with self.assertRaises(ksa_exceptions.ConnectFailure):
+            id_manager.find_user('admin', 'default')
+        self.assertEqual(
+            openstack_clients.get_breaker('identity').failures, 1)
+
+    def test_deadline(self):
+        """
+        The deadline of the calling thread applies.
+        """
+        id_manager = async_user_store.IdentityManager()
+
+        with openstack_clients.deadline(time.time() - 1):
+            with self.assertRaises(DeadlineExceeded):
+                id_manager.find_user('admin', 'default')
@@ -0,0 +1,357 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from datetime import timedelta
+import os
+import threading
+import time
+
+from keystoneauth1 import exceptions as ksa_exceptions
+import mock
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from adjutant.actions import openstack_clients, user_store
+from adjutant.exceptions import DeadlineExceeded, ServiceUnavailable
+
+
+@mock.patch('adjutant.actions.openstack_clients.ks_client.Client')
+class ClientCacheTests(TestCase):
+    """
+    Tests for the process wide client cache.
+    """
+
+    def setUp(self):
+        openstack_clients.reset_clients()
+
+    def tearDown(self):
+        openstack_clients.reset_clients()
+
+    def test_keystoneclient_reused(self, client_class):
+        """
+        Many IdentityManagers should share one Keystone client.
+        """
+        managers = [user_store.IdentityManager() for i in range(10)]
+
+        self.assertEqual(client_class.call_count, 1)
+        for manager in managers:
+            self.assertIs(manager.ks_client, managers[0].ks_client)
+
+    def test_keystoneclient_per_version(self, client_class):
+        """
+        Clients are cached per version, on the same session.
+        """
+        client_class.side_effect = lambda *args, **kwargs: mock.Mock()
+
+        v3 = openstack_clients.get_keystoneclient()
+        v2 = openstack_clients.get_keystoneclient(version="2")
+
+        self.assertEqual(client_class.call_count, 2)
+        self.assertIsNot(v3, v2)
+        self.assertIs(v3, openstack_clients.get_keystoneclient())
+        self.assertIs(
+            client_class.call_args_list[0][1]['session'],
+            client_class.call_args_list[1][1]['session'])
+
+    def test_clients_reset_after_fork(self, client_class):
+        """
+        A forked child must not reuse its parent's session or clients.
+        """
+        client_class.side_effect = lambda *args, **kwargs: mock.Mock()
+
+        parent_session = openstack_clients.get_auth_session()
+        parent_client = openstack_clients.get_keystoneclient()
+
+        with mock.patch.object(os, 'getpid', return_value=-1):
+            child_session = openstack_clients.get_auth_session()
+            child_client = openstack_clients.get_keystoneclient()
+            self.assertIs(
+                child_client, openstack_clients.get_keystoneclient())
+
+        self.assertIsNot(parent_session, child_session)
+        self.assertIsNot(parent_client, child_client)
+        self.assertEqual(client_class.call_count, 2)
+
+    def test_keystoneclient_threaded(self, client_class):
+        """
+        Concurrent first use still only builds one client.
+        """
+        client_class.side_effect = lambda *args, **kwargs: mock.Mock()
+        clients = []
+
+        def get_client():
+            clients.append(openstack_clients.get_keystoneclient())
+
+        threads = [threading.Thread(target=get_client) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(client_class.call_count, 1)
+        self.assertEqual(len(set(id(client) for client in clients)), 1)
+
+
+@mock.patch('adjutant.actions.openstack_clients.cinderclient.Client')
+@mock.patch('adjutant.actions.openstack_clients.novaclient.Client')
+@mock.patch('adjutant.actions.openstack_clients.neutronclient.Client')
+class RegionClientCacheTests(TestCase):
+    """
+    Tests for the per region service clients.
+    """
+
+    def setUp(self):
+        openstack_clients.reset_clients()
+
+    def tearDown(self):
+        openstack_clients.reset_clients()
+
+    def test_clients_per_region(self, neutron_class, nova_class,
+                                cinder_class):
+        """
+        One client per service and region, all on the shared session.
+        """
+        for client_class in [neutron_class, nova_class, cinder_class]:
+            client_class.side_effect = lambda *args, **kwargs: mock.Mock()
+
+        clients = {}
+        for i in range(5):
+            for region in ['RegionOne', 'RegionTwo']:
+                clients[('neutron', region)] = (
+                    openstack_clients.get_neutronclient(region=region))
+                clients[('nova', region)] = (
+                    openstack_clients.get_novaclient(region=region))
+                clients[('cinder', region)] = (
+                    openstack_clients.get_cinderclient(region=region))
+
+        self.assertEqual(len(set(id(c) for c in clients.values())), 6)
+        auth_session = openstack_clients.get_auth_session()
+        for client_class in [neutron_class, nova_class, cinder_class]:
+            self.assertEqual(client_class.call_count, 2)
+            self.assertEqual(
+                set(call[1]['region_name']
+                    for call in client_class.call_args_list),
+                {'RegionOne', 'RegionTwo'})
+            for call in client_class.call_args_list:
+                self.assertIs(call[1]['session'], auth_session)
+
+    def test_clients_per_version(self, neutron_class, nova_class,
+                                 cinder_class):
+        nova_class.side_effect = lambda *args, **kwargs: mock.Mock()
+
+        v2 = openstack_clients.get_novaclient('RegionOne')
+        v21 = openstack_clients.get_novaclient('RegionOne', version='2.1')
+
+        self.assertIsNot(v2, v21)
+        self.assertEqual(nova_class.call_args_list[1][0][0], '2.1')
+
+
+def fake_auth_session(expires_in):
+    auth_session = mock.Mock()
+    auth_session.auth.auth_ref.expires = (
+        timezone.now() + timedelta(seconds=expires_in))
+    return auth_session
+
+
+class AuthRefresherTests(TestCase):
+    """
+    Tests for renewing the shared session's token in the background.
+    """
+
+    def tearDown(self):
+        openstack_clients.reset_clients()
+
+    def test_refresh(self):
+        auth_session = fake_auth_session(10)
+        old_ref = auth_session.auth.auth_ref
+        new_ref = mock.Mock()
+        auth_session.auth.get_auth_ref.return_value = new_ref
+        refresher = openstack_clients.AuthRefresher(auth_session)
+
+        self.assertTrue(refresher.refresh())
+        self.assertIs(auth_session.auth.auth_ref, new_ref)
+
+        auth_session.auth.auth_ref = old_ref
+        auth_session.auth.get_auth_ref.side_effect = Exception('Down')
+        self.assertFalse(refresher.refresh())
+        self.assertIs(auth_session.auth.auth_ref, old_ref)
+
+    @override_settings(CLIENT_SETTINGS={'auth_refresh_margin': 300,
+                                        'auth_refresh_retry': 30})
+    def test_refreshed_ahead_of_expiry(self):
+        """
+        A token inside the margin is renewed straight away,
+        and the next renewal waits for the new one to near expiry.
+        """
+        auth_session = fake_auth_session(200)
+        new_ref = mock.Mock()
+        new_ref.expires = timezone.now() + timedelta(seconds=3600)
+        refreshed = threading.Event()
+
+        def get_auth_ref(session):
+            refreshed.set()
+            return new_ref
+
+        auth_session.auth.get_auth_ref.side_effect = get_auth_ref
+        refresher = openstack_clients.AuthRefresher(auth_session)
+        self.assertAlmostEqual(refresher._next_refresh(), 0)
+
+        refresher.start()
+        self.assertTrue(refreshed.wait(5))
+        refresher.stop()
+        refresher.thread.join(5)
+
+        self.assertFalse(refresher.thread.is_alive())
+        self.assertIs(auth_session.auth.auth_ref, new_ref)
+        self.assertEqual(auth_session.auth.get_auth_ref.call_count, 1)
+        self.assertAlmostEqual(refresher._next_refresh(), 3300, delta=5)
+        self.assertEqual(auth_session.auth.MIN_TOKEN_LIFE_SECONDS, 1)
+
+    @override_settings(CLIENT_SETTINGS={'auth_refresh': True})
+    @mock.patch.object(openstack_clients.AuthRefresher, 'start')
+    def test_refresher_started_with_session(self, start):
+        openstack_clients.reset_clients()
+        auth_session = openstack_clients.get_auth_session()
+
+        self.assertEqual(start.call_count, 1)
+        self.assertIs(
+            openstack_clients.client_auth_refresher.session, auth_session)
+
+        openstack_clients.get_auth_session()
+        self.assertEqual(start.call_count, 1)
+
+    def test_auth_expires_in(self):
+        openstack_clients.reset_clients()
+        self.assertIsNone(openstack_clients.get_auth_expires_in())
+
+        self.assertAlmostEqual(
+            openstack_clients.get_auth_expires_in(fake_auth_session(600)),
+            600, delta=5)
+
+
+@override_settings(CLIENT_SETTINGS={'breaker_failures': 3,
+                                    'breaker_reset': 30})
+class CircuitBreakerTests(TestCase):
+    """
+    Tests for the per service circuit breakers and call deadlines.
+    """
+
+    def setUp(self):
+        openstack_clients.reset_breakers()
+        self.session = openstack_clients.GuardedSession(auth=mock.Mock())
+
+    def tearDown(self):
+        openstack_clients.reset_breakers()
+
+    def test_breaker_opens_and_recovers(self):
+        breaker = openstack_clients.CircuitBreaker('network')
+
+        for i in range(3):
+            breaker.before_call()
+            breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertRaises(ServiceUnavailable, breaker.before_call)
+
+        # after the reset timeout, one trial call is let through
+        breaker.opened_at -= 30
+        breaker.before_call()
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        self.assertRaises(ServiceUnavailable, breaker.before_call)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertRaises(ServiceUnavailable, breaker.before_call)
+
+        breaker.opened_at -= 30
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        breaker.before_call()
+
+    @mock.patch.object(openstack_clients.session.Session, 'request')
+    def test_session_fails_fast(self, request):
+        """
+        Outages of one service open its breaker, and only its breaker.
+        """
+        request.side_effect = ksa_exceptions.ConnectFailure()
+
+        for i in range(3):
+            self.assertRaises(
+                ksa_exceptions.ConnectFailure, self.session.request,
+                '/networks', 'GET', service_type='network')
+        self.assertRaises(
+            ServiceUnavailable, self.session.request,
+            '/networks', 'GET', service_type='network')
+        self.assertEqual(request.call_count, 3)
+
+        request.side_effect = None
+        request.return_value = mock.Mock(status_code=200)
+        self.session.request(
+            '/servers', 'GET', endpoint_filter={'service_type': 'compute'})
+        self.assertEqual(
+            openstack_clients.get_breaker_states()['network']['state'],
+            'open')
+        self.assertEqual(
+            openstack_clients.get_breaker_states()['compute']['state'],
+            'closed')
+
+    @mock.patch.object(openstack_clients.session.Session, 'request')
+    def test_client_errors_not_outages(self, request):
+        request.side_effect = ksa_exceptions.NotFound()
+
+        for i in range(5):
+            self.assertRaises(
+                ksa_exceptions.NotFound, self.session.request,
+                '/users/1', 'GET', service_type='identity')
+
+        request.side_effect = None
+        request.return_value = mock.Mock(status_code=503)
+        for i in range(3):
+            self.session.request('/users', 'GET', service_type='identity')
+        self.assertEqual(
+            openstack_clients.get_breaker('identity').state, 'open')
+
+    @mock.patch.object(openstack_clients.session.Session, 'request')
+    def test_deadline(self, request):
+        request.return_value = mock.Mock(status_code=200)
+
+        with openstack_clients.deadline(time.time() + 10):
+            self.session.request('/users', 'GET')
+            self.assertLessEqual(request.call_args[1]['timeout'], 10)
+
+            # nested deadlines can only be earlier
+            with openstack_clients.deadline(time.time() + 60):
+                self.session.request('/users', 'GET')
+                self.assertLessEqual(request.call_args[1]['timeout'], 10)
+
+        with openstack_clients.deadline(time.time() - 1):
+            self.assertRaises(
+                DeadlineExceeded, self.session.request, '/users', 'GET')
+        self.assertEqual(request.call_count, 2)
+
+        self.session.request('/users', 'GET')
+        self.assertNotIn('timeout', request.call_args[1])
+        self.assertIsNone(openstack_clients.get_deadline())
+
+    @mock.patch.object(openstack_clients.session.Session, 'request')
+    def test_deadline_timeout_not_outage(self, request):
+        request.side_effect = ksa_exceptions.ConnectTimeout()
+
+        for i in range(5):
+            with openstack_clients.deadline(time.time() + 1):
+                self.assertRaises(
+                    DeadlineExceeded, self.session.request, '/users', 'GET')
+        self.assertEqual(
+            openstack_clients.get_breaker('identity').state, 'closed')
@@ -677,6 +677,78 @@ class ProjectActionTests(TestCase):
         project = tests.temp_cache['projects']['test_project']
         self.assertEquals(project.roles['user_id_0'], ['admin'])
 
+    def _setup_default_users(self):
+        project = mock.Mock()
+        project.id = 'test_project_id'
+        project.name = 'test_project'
+        project.domain = 'default'
+        project.roles = {}
+
+        users = {}
+        for i in range(1, 6):
+            user = mock.Mock()
+            user.id = 'user_id_%s' % i
+            user.name = 'user_%s' % i
+            user.domain = 'default'
+            users[user.id] = user
+
+        setup_temp_cache({'test_project': project}, users)
+
+        task = Task.objects.create(
+            ip_address="0.0.0.0", keystone_user={'roles': ['admin']})
+        task.cache = {'project_id': "test_project_id"}
+
+        action = AddDefaultUsersToProjectAction(
+            {'domain_id': 'default'}, task=task, order=1)
+        action.users = ['user_%s' % i for i in range(1, 6)]
+        action.roles = ['_member_', 'project_mod', 'heat_stack_owner']
+        return action
+
+    @override_settings(IDENTITY_SETTINGS={'role_edit_concurrency': 3})
+    def test_add_default_users_concurrent(self):
+        """
+        Many users and roles, granted a few at a time.
+        """
+        action = self._setup_default_users()
+
+        action.pre_approve()
+        self.assertEquals(action.valid, True)
+        action.post_approve()
+        self.assertEquals(action.valid, True)
+        self.assertEquals(action.action.state, 'completed')
+
+        project = tests.temp_cache['projects']['test_project']
+        self.assertEquals(len(project.roles), 5)
+        for roles in project.roles.values():
+            self.assertEquals(
+                sorted(roles), ['_member_', 'heat_stack_owner', 'project_mod'])
+
+    @override_settings(IDENTITY_SETTINGS={'role_edit_concurrency': 3})
+    def test_add_default_users_errors_noted(self):
+        """
+        Every failed grant is noted, and the others still happen.
+        """
+        action = self._setup_default_users()
+        add_user_role = FakeManager.add_user_role
+
+        def failing_add_user_role(manager, user, role, project):
+            if user.name == 'user_2':
+                raise Exception('Keystone error')
+            return add_user_role(manager, user, role, project)
+
+        action.pre_approve()
+        with mock.patch.object(
+                FakeManager, 'add_user_role', failing_add_user_role):
+            self.assertRaises(Exception, action.post_approve)
+
+        notes = action.action.task.action_notes[
+            'AddDefaultUsersToProjectAction']
+        self.assertEquals(
+            len([note for note in notes if 'Keystone error' in note]), 4)
+        project = tests.temp_cache['projects']['test_project']
+        self.assertEquals(len(project.roles), 4)
+        self.assertNotIn('user_id_2', project.roles)
+
     def test_add_default_users_invalid_project(self):
         """Add default users to a project that doesn't exist.
 
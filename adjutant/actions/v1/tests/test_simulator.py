@@ -0,0 +1,122 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from neutronclient.common import exceptions as neutron_exceptions
+
+from adjutant.actions import openstack_clients
+from adjutant.simulator import build_cloud, keystone_settings
+
+
+class SimulatorTests(TestCase):
+    """
+    The real clients, against the simulated cloud.
+    """
+
+    def start(self, **kwargs):
+        self.server = build_cloud(**kwargs).start()
+        self.addCleanup(self.server.stop)
+        settings_override = override_settings(
+            KEYSTONE=keystone_settings(self.server))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        openstack_clients.reset_clients()
+        openstack_clients.reset_breakers()
+        self.addCleanup(openstack_clients.reset_clients)
+        self.addCleanup(openstack_clients.reset_breakers)
+
+    def test_network(self):
+        """
+        A default network can be built with neutronclient.
+        """
+        self.start(regions=['RegionOne', 'RegionTwo'])
+        neutron = openstack_clients.get_neutronclient('RegionOne')
+
+        network = neutron.create_network(body={'network': {
+            'name': 'somenetwork', 'tenant_id': 'project_id',
+            'admin_state_up': True}})
+        subnet = neutron.create_subnet(body={'subnet': {
+            'network_id': network['network']['id'], 'ip_version': 4,
+            'tenant_id': 'project_id', 'cidr': '192.168.1.0/24'}})
+        router = neutron.create_router(body={'router': {
+            'name': 'somerouter', 'tenant_id': 'project_id',
+            'admin_state_up': True}})
+        interface = neutron.add_interface_router(
+            router['router']['id'],
+            body={'subnet_id': subnet['subnet']['id']})
+
+        ports = neutron.list_ports(tenant_id='project_id')['ports']
+        self.assertEqual([port['id'] for port in ports],
+                         [interface['port_id']])
+        # each region has its own resources
+        other = openstack_clients.get_neutronclient('RegionTwo')
+        self.assertEqual(other.list_networks()['networks'], [])
+
+    def test_quotas(self):
+        """
+        Quotas can be set and read back with each client.
+        """
+        self.start()
+        neutron = openstack_clients.get_neutronclient('RegionOne')
+        nova = openstack_clients.get_novaclient('RegionOne')
+        cinder = openstack_clients.get_cinderclient('RegionOne', version='3')
+
+        neutron.update_quota('project_id', {'quota': {'network': 3}})
+        nova.quotas.update('project_id', cores=40)
+        cinder.quotas.update('project_id', gigabytes=500)
+
+        self.assertEqual(
+            neutron.show_quota('project_id')['quota']['network'], 3)
+        self.assertEqual(nova.quotas.get('project_id').cores, 40)
+        self.assertEqual(cinder.quotas.get('project_id').gigabytes, 500)
+
+    def test_data_volume(self):
+        """
+        The cloud is seeded with the requested amount of data.
+        """
+        self.start(projects=3, users_per_project=2, resources_per_project=4)
+        keystone = self.server.service('keystone')
+        nova = openstack_clients.get_novaclient('RegionOne')
+
+        # plus the admin project and user
+        self.assertEqual(len(keystone.projects), 4)
+        self.assertEqual(len(keystone.users), 7)
+        self.assertEqual(
+            len(nova.servers.list(search_opts={'all_tenants': True})), 12)
+
+    def test_latency_and_errors(self):
+        """
+        Calls are slowed down and failed as configured, and counted.
+        """
+        self.start(service_options={
+            'nova': {'latency': 0.2},
+            'neutron': {'error_rate': 1.0},
+        })
+        nova = openstack_clients.get_novaclient('RegionOne')
+        neutron = openstack_clients.get_neutronclient('RegionOne')
+
+        start = time.time()
+        nova.quotas.get('project_id')
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+        with self.assertRaises(neutron_exceptions.ServiceUnavailable):
+            neutron.list_networks()
+        self.assertEqual(
+            self.server.service('neutron').calls['list_resources'], 1)
+        self.assertEqual(
+            self.server.service('nova').calls['get_quota'], 1)
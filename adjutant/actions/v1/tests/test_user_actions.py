@@ -14,8 +14,10 @@
 
 import mock
 
-from django.test.utils import override_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 
+from adjutant.actions.models import Action
 from adjutant.actions.v1.users import (
     EditUserRolesAction, NewUserAction, ResetUserPasswordAction,
     UpdateUserEmailAction)
@@ -1142,3 +1144,94 @@ class UserActionTests(AdjutantTestCase):
         self.assertEquals(
             tests.temp_cache['users']["user_id_1"].name,
             'test_user')
+
+    def test_new_user_stage_saves_once(self):
+        """
+        The changes a stage makes to the action are saved together at
+        the end of it, as one update of just the changed fields.
+        """
+        project = mock.Mock()
+        project.id = 'test_project_id'
+        project.name = 'test_project'
+        project.domain = 'default'
+        project.roles = {}
+
+        setup_temp_cache({'test_project': project}, {})
+
+        task = Task.objects.create(
+            ip_address="0.0.0.0",
+            keystone_user={
+                'roles': ['admin', 'project_mod'],
+                'project_id': 'test_project_id',
+                'project_domain_id': 'default',
+            })
+
+        data = {
+            'email': 'test@example.com',
+            'project_id': 'test_project_id',
+            'roles': ['_member_'],
+            'domain_id': 'default',
+        }
+
+        action = NewUserAction(data, task=task, order=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            action.pre_approve()
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE "actions_action"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('action_data', updates[0])
+        # Just the summary, which isn't saved again at the end.
+        task_updates = [query['sql'] for query in queries.captured_queries
+                        if query['sql'].startswith('UPDATE "api_task"')]
+        self.assertEqual(len(task_updates), 1)
+
+        saved = Action.objects.get(pk=action.action.pk)
+        self.assertTrue(saved.valid)
+        self.assertTrue(saved.need_token)
+        self.assertTrue(saved.auto_approve)
+        self.assertEqual(saved.cache['token_fields'], ['password'])
+        task = Task.objects.get(uuid=task.uuid)
+        self.assertTrue(task.all_valid)
+        self.assertTrue(task.auto_approve)
+        self.assertTrue(task.action_notes['NewUserAction'][-1].startswith(
+            'Auto approve set to True.'))
+
+    def test_changes_tracked_from_stage_start(self):
+        """
+        Loaded actions only start tracking their changes when a stage
+        starts, after which just what changed is dirty.
+        """
+        project = mock.Mock()
+        project.id = 'test_project_id'
+        project.name = 'test_project'
+        project.domain = 'default'
+        project.roles = {}
+
+        setup_temp_cache({'test_project': project}, {})
+
+        task = Task.objects.create(
+            ip_address="0.0.0.0",
+            keystone_user={
+                'roles': ['admin', 'project_mod'],
+                'project_id': 'test_project_id',
+                'project_domain_id': 'default',
+            })
+
+        data = {
+            'email': 'test@example.com',
+            'project_id': 'test_project_id',
+            'roles': ['_member_'],
+            'domain_id': 'default',
+        }
+
+        NewUserAction(data, task=task, order=1)
+
+        action_model = Task.objects.get(uuid=task.uuid).actions[0]
+        self.assertIsNone(action_model._saved_values)
+
+        action = action_model.get_action()
+        action._start_stage('pre_approve')
+        self.assertEqual(action_model.dirty_fields(), [])
+        action_model.cache['token_fields'] = ['password']
+        self.assertEqual(action_model.dirty_fields(), ['cache'])
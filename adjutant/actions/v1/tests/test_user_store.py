@@ -0,0 +1,503 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+import mock
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from adjutant.actions import openstack_clients, user_store
+from adjutant.actions.v1.base import BaseAction
+from adjutant.api.models import Task
+from adjutant.exceptions import ServiceUnavailable
+
+
+def fake_role(role_id, name):
+    role = mock.Mock()
+    role.id = role_id
+    role.name = name
+    return role
+
+
+def fake_ks_client(role_names):
+    ks_client = mock.Mock()
+    ks_client.roles.list.return_value = [
+        fake_role("%s_id" % name, name) for name in role_names]
+    return ks_client
+
+
+class RoleCatalogTests(TestCase):
+
+    def setUp(self):
+        user_store.role_catalog.clear()
+
+    def tearDown(self):
+        user_store.role_catalog.clear()
+
+    def test_roles_loaded_once(self):
+        """
+        Many lookups, by name and id, cost one Keystone call.
+        """
+        ks_client = fake_ks_client(['_member_', 'project_admin'])
+
+        for i in range(5):
+            member = user_store.role_catalog.find_role(ks_client, '_member_')
+            admin = user_store.role_catalog.get_role(
+                ks_client, 'project_admin_id')
+
+        self.assertEqual(member.id, '_member__id')
+        self.assertEqual(admin.name, 'project_admin')
+        self.assertEqual(ks_client.roles.list.call_count, 1)
+
+    def test_unknown_role_reloads(self):
+        """
+        A miss reloads the catalog, in case the role is new.
+        """
+        ks_client = fake_ks_client(['_member_'])
+        user_store.role_catalog.find_role(ks_client, '_member_')
+
+        ks_client.roles.list.return_value = [
+            fake_role('_member__id', '_member_'),
+            fake_role('new_id', 'new_role')]
+        role = user_store.role_catalog.find_role(ks_client, 'new_role')
+
+        self.assertEqual(role.id, 'new_id')
+        self.assertEqual(ks_client.roles.list.call_count, 2)
+
+        self.assertIsNone(
+            user_store.role_catalog.find_role(ks_client, 'missing'))
+
+    def test_unknown_role_reloads_once(self):
+        """
+        A role still missing after a reload doesn't reload the
+        catalog again until the next load.
+        """
+        ks_client = fake_ks_client(['_member_'])
+
+        for i in range(2):
+            self.assertIsNone(
+                user_store.role_catalog.find_role(ks_client, 'missing'))
+        self.assertEqual(ks_client.roles.list.call_count, 1)
+
+        for i in range(2):
+            self.assertIsNone(
+                user_store.role_catalog.get_role(ks_client, 'missing_id'))
+        self.assertEqual(ks_client.roles.list.call_count, 2)
+
+    @override_settings(IDENTITY_SETTINGS={'role_cache_ttl': 0})
+    @mock.patch('adjutant.actions.user_store.get_keystoneclient')
+    def test_stale_catalog_refreshed_in_background(self, get_client):
+        """
+        Once past the TTL the old snapshot is served while a
+        background thread reloads it.
+        """
+        ks_client = fake_ks_client(['_member_'])
+        background_client = fake_ks_client(['_member_', 'heat_stack_owner'])
+        get_client.return_value = background_client
+
+        user_store.role_catalog.find_role(ks_client, '_member_')
+        user_store.role_catalog.loaded_at -= 1
+
+        role = user_store.role_catalog.find_role(ks_client, '_member_')
+        self.assertEqual(role.name, '_member_')
+        user_store.role_catalog.refresh_thread.join()
+
+        self.assertEqual(ks_client.roles.list.call_count, 1)
+        self.assertEqual(background_client.roles.list.call_count, 1)
+        self.assertIn(
+            'heat_stack_owner', user_store.role_catalog.roles_by_name)
+
+    @mock.patch('adjutant.actions.user_store.get_keystoneclient')
+    def test_identity_manager_uses_catalog(self, get_client):
+        """
+        find_role and get_all_roles no longer list roles per call.
+        """
+        ks_client = fake_ks_client(['_member_', 'project_mod'])
+        assignment = mock.Mock()
+        assignment.scope = {'project': {'id': 'project_id'}}
+        assignment.role = {'id': 'project_mod_id'}
+        ks_client.role_assignments.list.return_value = [assignment]
+        get_client.return_value = ks_client
+
+        id_manager = user_store.IdentityManager()
+        for i in range(3):
+            role = id_manager.find_role('_member_')
+            self.assertEqual(role.id, '_member__id')
+            projects = id_manager.get_all_roles('user_id')
+
+        self.assertEqual(projects['project_id'][0].name, 'project_mod')
+        self.assertEqual(ks_client.roles.list.call_count, 1)
+        ks_client.roles.find.assert_not_called()
+
+
+class ListUsersTests(TestCase):
+
+    def setUp(self):
+        user_store.role_catalog.clear()
+
+    def tearDown(self):
+        user_store.role_catalog.clear()
+
+    def fake_project(self, user_count):
+        ks_client = fake_ks_client(['_member_', 'project_mod'])
+        users = []
+        assignments = []
+        for i in range(user_count):
+            user = mock.Mock()
+            user.id = 'user_%s' % i
+            users.append(user)
+            for role in ['_member_', 'project_mod']:
+                assignment = mock.Mock()
+                assignment.user = {
+                    'id': user.id, 'domain': {'id': 'default'}}
+                assignment.role = {'id': '%s_id' % role}
+                assignments.append(assignment)
+        group_assignment = mock.Mock(spec=['group', 'role'])
+        assignments.append(group_assignment)
+        ks_client.role_assignments.list.return_value = assignments
+        # other users in the domain, not in the project
+        ks_client.users.list.return_value = users + [mock.Mock(id='other')]
+        return ks_client
+
+    @mock.patch('adjutant.actions.user_store.get_keystoneclient')
+    def test_list_users_constant_calls(self, get_client):
+        """
+        The number of Keystone calls doesn't grow with the project.
+        """
+        call_counts = []
+        for user_count in [1, 10, 100]:
+            user_store.role_catalog.clear()
+            ks_client = self.fake_project(user_count)
+            get_client.return_value = ks_client
+
+            users = user_store.IdentityManager().list_users('project_id')
+
+            self.assertEqual(len(users), user_count)
+            for user in users:
+                self.assertEqual(
+                    [role.name for role in user.roles],
+                    ['_member_', 'project_mod'])
+            ks_client.users.get.assert_not_called()
+            call_counts.append(len(ks_client.method_calls))
+
+        self.assertEqual(call_counts, [3, 3, 3])
+
+    @mock.patch('adjutant.actions.user_store.get_keystoneclient')
+    def test_list_users_missing_from_listing(self, get_client):
+        """
+        Users the bulk listing didn't return are fetched directly.
+        """
+        ks_client = self.fake_project(2)
+        ks_client.users.list.return_value = []
+        ks_client.users.get.side_effect = lambda user_id: mock.Mock(
+            id=user_id)
+        get_client.return_value = ks_client
+
+        users = user_store.IdentityManager().list_users('project_id')
+
+        self.assertEqual([user.id for user in users], ['user_0', 'user_1'])
+        self.assertEqual(ks_client.users.get.call_count, 2)
+
+    @mock.patch('adjutant.actions.user_store.get_keystoneclient')
+    def test_list_users_unknown_role(self, get_client):
+        """
+        Assignments of roles that aren't in the catalog are skipped.
+        """
+        ks_client = self.fake_project(2)
+        # user_0's _member_ assignment, of a since deleted role.
+        ks_client.role_assignments.list.return_value[0].role = {
+            'id': 'deleted_id'}
+        get_client.return_value = ks_client
+
+        users = user_store.IdentityManager().list_users('project_id')
+
+        roles = {user.id: [role.name for role in user.roles]
+                 for user in users}
+        self.assertEqual(roles, {
+            'user_0': ['project_mod'],
+            'user_1': ['_member_', 'project_mod']})
+
+    @mock.patch('adjutant.actions.user_store.get_keystoneclient')
+    def test_list_users_filtered(self, get_client):
+        """
+        Role and name filters are applied before users are fetched.
+        """
+        ks_client = self.fake_project(3)
+        ks_client.role_assignments.list.return_value[0].role = {
+            'id': 'project_admin_id'}
+        ks_client.roles.list.return_value.append(
+            fake_role('project_admin_id', 'project_admin'))
+        for assignment in ks_client.role_assignments.list.return_value:
+            if hasattr(assignment, 'user'):
+                assignment.user['name'] = assignment.user['id'].upper()
+        get_client.return_value = ks_client
+        id_manager = user_store.IdentityManager()
+
+        users = id_manager.list_users('project_id', role='project_admin')
+        self.assertEqual([user.id for user in users], ['user_0'])
+
+        users = id_manager.list_users('project_id', name='user_2')
+        self.assertEqual([user.id for user in users], ['user_2'])
+        ks_client.users.list.assert_called_with(
+            domain='default', name__icontains='user_2')
+
+        self.assertEqual(
+            id_manager.list_users('project_id', role='admin'), [])
+        ks_client.users.get.assert_not_called()
+
+
+class LookupCacheTests(TestCase):
+
+    def setUp(self):
+        self.cache = user_store.LookupCache('project')
+
+    def tearDown(self):
+        user_store.project_cache.clear()
+
+    def test_hit_within_ttl(self):
+        load = mock.Mock(return_value='project')
+
+        for i in range(5):
+            self.assertEqual(self.cache.get('id', load), 'project')
+
+        self.assertEqual(load.call_count, 1)
+
+    @override_settings(IDENTITY_SETTINGS={'negative_cache_ttl': 10,
+                                          'stale_cache_ttl': 0})
+    def test_not_found_cached_briefly(self):
+        """
+        A 'not found' is cached, but for negative_cache_ttl only.
+        """
+        load = mock.Mock(return_value=None)
+
+        self.assertIsNone(self.cache.get('id', load))
+        self.assertIsNone(self.cache.get('id', load))
+        self.assertEqual(load.call_count, 1)
+
+        self.cache.entries['id'] = (None, self.cache.entries['id'][1] - 11)
+        load.return_value = 'project'
+        self.assertEqual(self.cache.get('id', load), 'project')
+        self.assertEqual(load.call_count, 2)
+
+    @override_settings(IDENTITY_SETTINGS={'project_cache_ttl': 0})
+    def test_stale_refreshed_in_background(self):
+        """
+        Past the TTL the old value is served while a background
+        thread fetches the new one.
+        """
+        self.cache.set('id', 'old')
+        self.cache.entries['id'] = ('old', self.cache.entries['id'][1] - 1)
+        refreshed = threading.Event()
+
+        def load():
+            refreshed.wait()
+            return 'new'
+
+        self.assertEqual(self.cache.get('id', load), 'old')
+        self.assertEqual(self.cache.get('id', load), 'old')
+        self.assertEqual(self.cache.refreshing, {'id'})
+
+        refreshed.set()
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread():
+                thread.join(1)
+
+        self.assertEqual(self.cache.entries['id'][0], 'new')
+        self.assertEqual(self.cache.refreshing, set())
+
+    @override_settings(IDENTITY_SETTINGS={'project_cache_ttl': 0,
+                                          'stale_cache_ttl': 60})
+    def test_stale_served_on_error(self):
+        """
+        If Keystone errors, the last value is served while it is
+        within the stale window.
+        """
+        self.cache.set('id', 'old')
+        self.cache.entries['id'] = ('old', self.cache.entries['id'][1] - 1)
+        load = mock.Mock(side_effect=Exception('Keystone is down'))
+
+        self.assertEqual(self.cache.get('id', load), 'old')
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread():
+                thread.join(1)
+        self.assertEqual(self.cache.get('id', load), 'old')
+        self.assertRaises(Exception, self.cache.get, 'other_id', load)
+
+    @override_settings(IDENTITY_SETTINGS={'project_cache_ttl': 0,
+                                          'stale_cache_ttl': 60})
+    def test_expired_not_served_on_error(self):
+        """
+        Past the stale window the last value is dropped rather than
+        served, and Keystone's error is raised.
+        """
+        self.cache.set('id', 'old')
+        self.cache.entries['id'] = ('old', self.cache.entries['id'][1] - 61)
+        load = mock.Mock(side_effect=Exception('Keystone is down'))
+
+        self.assertRaises(Exception, self.cache.get, 'id', load)
+        self.assertEqual(load.call_count, 1)
+
+    def test_invalidate_project(self):
+        load = mock.Mock(return_value=None)
+        user_store.project_cache.get('project_id', load)
+
+        user_store.invalidate_project('project_id')
+
+        load.return_value = 'project'
+        self.assertEqual(
+            user_store.project_cache.get('project_id', load), 'project')
+        self.assertEqual(load.call_count, 2)
+
+
+class ManagableRolesTests(TestCase):
+
+    def test_managable_roles(self):
+        self.assertEqual(
+            user_store.get_managable_roles(['project_mod']),
+            {'_member_', 'heat_stack_owner', 'project_mod'})
+        self.assertEqual(
+            user_store.get_managable_roles(['project_mod', 'project_admin']),
+            {'_member_', 'heat_stack_owner', 'project_mod', 'project_admin'})
+        self.assertEqual(user_store.get_managable_roles(['_member_']), set())
+
+    def test_managable_roles_follow_settings(self):
+        """
+        The precomputed mapping is rebuilt when ROLES_MAPPING changes.
+        """
+        user_store.get_managable_roles(['project_mod'])
+
+        with override_settings(ROLES_MAPPING={'project_mod': ['_member_']}):
+            self.assertEqual(
+                user_store.get_managable_roles(['project_mod']),
+                {'_member_'})
+
+        self.assertEqual(
+            user_store.get_managable_roles(['project_mod']),
+            {'_member_', 'heat_stack_owner', 'project_mod'})
+
+
+class LookupAction(BaseAction):
+
+    def _pre_approve(self):
+        id_manager = self.get_id_manager()
+        self.project = id_manager.get_project('project_id')
+        self.user = id_manager.find_user('test@example.com', 'default')
+
+    def _post_approve(self):
+        id_manager = self.get_id_manager()
+        id_manager.find_user('test@example.com', 'default')
+        id_manager.get_project('project_id')
+        id_manager.create_user(
+            name='test@example.com', password='123', email=None,
+            created_on=None)
+        self.user = id_manager.find_user('test@example.com', 'default')
+        self.project = id_manager.get_project('project_id')
+
+
+@mock.patch('adjutant.actions.user_store.IdentityManager')
+class IdentityMemoTests(TestCase):
+
+    def setUp(self):
+        self.task = Task.objects.create(
+            ip_address="0.0.0.0", keystone_user={})
+
+    def test_reads_shared_in_stage(self, manager_class):
+        """
+        Actions in the same stage share lookups, which are
+        redone when a stage starts or is run again.
+        """
+        manager = manager_class.return_value
+        actions = [LookupAction({}, task=self.task, order=i)
+                   for i in range(3)]
+
+        for action in actions:
+            action.pre_approve()
+        self.assertEqual(manager.get_project.call_count, 1)
+        self.assertEqual(manager.find_user.call_count, 1)
+        self.assertIs(actions[0].project, actions[2].project)
+
+        actions[0].pre_approve()
+        self.assertEqual(manager.get_project.call_count, 2)
+
+    def test_writes_invalidate(self, manager_class):
+        """
+        Writes drop the reads that depend on what they changed.
+        """
+        manager = manager_class.return_value
+        action = LookupAction({}, task=self.task, order=1)
+
+        action.pre_approve()
+        action.post_approve()
+
+        # the user was looked up again after creating it,
+        # but the project lookup was still memoized.
+        self.assertEqual(manager.find_user.call_count, 3)
+        self.assertEqual(manager.get_project.call_count, 2)
+
+    def test_outside_stage(self, manager_class):
+        action = LookupAction({}, task=self.task, order=1)
+        action.get_id_manager().get_project('project_id')
+        action.get_id_manager().get_project('project_id')
+        self.assertEqual(
+            manager_class.return_value.get_project.call_count, 2)
+
+    @override_settings(CLIENT_SETTINGS={'stage_deadline': 60})
+    def test_stage_deadline_and_errors(self, manager_class):
+        """
+        The actions in a stage share one deadline, and a failing
+        service is noted on the task.
+        """
+        manager = manager_class.return_value
+        deadlines = []
+
+        def get_project(project_id):
+            deadlines.append(openstack_clients.get_deadline())
+            if len(deadlines) > 1:
+                raise ServiceUnavailable("Service 'identity' is failing.")
+
+        manager.get_project.side_effect = get_project
+        action = LookupAction({}, task=self.task, order=1)
+        action.pre_approve()
+
+        self.assertAlmostEqual(deadlines[0], time.time() + 60, delta=5)
+        self.assertIsNone(openstack_clients.get_deadline())
+
+        self.assertRaises(ServiceUnavailable, action.pre_approve)
+        self.assertIn(
+            "Error: Service 'identity' is failing.",
+            self.task.action_notes['LookupAction'][-1])
+
+    def test_gather(self, manager_class):
+        """
+        Gathered reads are served from the memo where they can be,
+        and only the rest are passed on.
+        """
+        manager = manager_class.return_value
+        manager.gather.side_effect = lambda *calls: [
+            '%s:%s' % (call[0], call[1]) for call in calls]
+        memo = user_store.IdentityMemo('pre_approve')
+        id_manager = user_store.MemoizedIdentityManager(memo)
+
+        self.assertEqual(
+            id_manager.gather(('get_project', 'p1'), ('find_domain', 'd1')),
+            ['get_project:p1', 'find_domain:d1'])
+        self.assertEqual(
+            id_manager.gather(('find_domain', 'd1'), ('get_project', 'p2')),
+            ['find_domain:d1', 'get_project:p2'])
+
+        manager.gather.assert_called_with(('get_project', 'p2'))
+        self.assertEqual(manager.gather.call_count, 2)
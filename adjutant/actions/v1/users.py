@@ -37,7 +37,7 @@ class NewUserAction(UserNameAction, ProjectMixin, UserMixin):
     ]
 
     def _validate_target_user(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
 
         # check if user exists and is valid
         # this may mean we need a token.
@@ -90,14 +90,22 @@ class NewUserAction(UserNameAction, ProjectMixin, UserMixin):
         return True
 
     def _validate(self):
+        # The local checks first, so denied requests never reach Keystone.
         self.action.valid = (
             self._validate_role_permissions() and
-            self._validate_keystone_user() and
-            self._validate_domain_id() and
-            self._validate_project_id() and
-            self._validate_target_user()
+            self._validate_keystone_user()
         )
-        self.action.save()
+        if self.action.valid:
+            self.prefetch(
+                ('get_domain', self.domain_id),
+                ('get_project', self.project_id),
+                ('find_user', self.username, self.domain_id))
+            self.action.valid = (
+                self._validate_domain_id() and
+                self._validate_project_id() and
+                self._validate_target_user()
+            )
+        self.save_action()
 
     def _pre_approve(self):
         self._validate()
@@ -169,7 +177,7 @@ class ResetUserPasswordAction(UserNameAction, UserMixin):
         self.blacklist = self.settings.get("blacklisted_roles", {})
 
     def _validate_user_roles(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
 
         self.user = id_manager.find_user(self.username, self.domain.id)
         roles = id_manager.get_all_roles(self.user)
@@ -199,7 +207,7 @@ class ResetUserPasswordAction(UserNameAction, UserMixin):
             self._validate_username_exists() and
             self._validate_user_roles()
         )
-        self.action.save()
+        self.save_action()
 
     def _pre_approve(self):
         self._validate()
@@ -240,7 +248,7 @@ class EditUserRolesAction(UserIdAction, ProjectMixin, UserMixin):
         return True
 
     def _validate_user_roles(self):
-        id_manager = user_store.IdentityManager()
+        id_manager = self.get_id_manager()
         user = self._get_target_user()
         project = id_manager.get_project(self.project_id)
         # user roles
@@ -281,15 +289,23 @@ class EditUserRolesAction(UserIdAction, ProjectMixin, UserMixin):
         return True
 
     def _validate(self):
+        # The local checks first, so denied requests never reach Keystone.
         self.action.valid = (
             self._validate_keystone_user() and
-            self._validate_role_permissions() and
-            self._validate_domain_id() and
-            self._validate_project_id() and
-            self._validate_target_user() and
-            self._validate_user_roles()
+            self._validate_role_permissions()
         )
-        self.action.save()
+        if self.action.valid:
+            self.prefetch(
+                ('get_domain', self.domain_id),
+                ('get_project', self.project_id),
+                ('get_user', self.user_id))
+            self.action.valid = (
+                self._validate_domain_id() and
+                self._validate_project_id() and
+                self._validate_target_user() and
+                self._validate_user_roles()
+            )
+        self.save_action()
 
     def _pre_approve(self):
         self._validate()
@@ -345,7 +361,7 @@ class UpdateUserEmailAction(UserIdAction, UserMixin):
     def _validate(self):
         self.action.valid = (self._validate_user() and
                              self._validate_email_not_in_use())
-        self.action.save()
+        self.save_action()
 
     def _validate_user(self):
         self.user = self._get_target_user()
@@ -358,7 +374,7 @@ class UpdateUserEmailAction(UserIdAction, UserMixin):
             self.domain_id = self.action.task.keystone_user[
                 'project_domain_id']
 
-            id_manager = user_store.IdentityManager()
+            id_manager = self.get_id_manager()
 
             if id_manager.find_user(self.new_email, self.domain_id):
                 self.add_note("User with same username already exists")
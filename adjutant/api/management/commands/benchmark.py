@@ -0,0 +1,61 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from adjutant.benchmarks import load_benchmarks, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = "Runs the Adjutant benchmarks and prints the results as json."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names', nargs='*',
+            help="Benchmarks to run. Runs all of them if none given.")
+        parser.add_argument(
+            '--param', action='append', default=[], dest='params',
+            metavar='NAME=VALUE',
+            help="Passes an argument to the benchmarks, can be repeated. "
+                 "Values are read as json if they can be, e.g. "
+                 "--param sizes=[10000,100000].")
+        parser.add_argument(
+            '--output',
+            help="File to write the results to as well, to compare later.")
+
+    def handle(self, *args, **options):
+        names = options['names']
+        missing = set(names) - set(load_benchmarks().keys())
+        if missing:
+            raise CommandError(
+                "Unknown benchmarks: %s" % ", ".join(sorted(missing)))
+
+        kwargs = {}
+        for param in options['params']:
+            name, _, value = param.partition('=')
+            if not value:
+                raise CommandError("Bad param '%s'." % param)
+            try:
+                kwargs[name] = json.loads(value)
+            except ValueError:
+                kwargs[name] = value
+
+        results = run_benchmarks(names, **kwargs)
+        output = json.dumps(results, indent=4, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        self.stdout.write(output)
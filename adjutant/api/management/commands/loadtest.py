@@ -0,0 +1,104 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from adjutant.benchmarks.load import LoadGenerator, parse_mix
+
+
+def _ms(seconds):
+    return '-' if seconds is None else '%.0f' % (seconds * 1000)
+
+
+class Command(BaseCommand):
+    help = ("Fires a concurrent mix of signups, invites and password "
+            "resets, with their approvals and token submissions, at a "
+            "running Adjutant and reports latency and errors over time.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'url', help="Base URL of the Adjutant API, without /v1.")
+        parser.add_argument(
+            '--mix', default='signup=1,invite=1',
+            help="Comma separated workflow=weight pairs, from: "
+                 "signup, invite, reset_password.")
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument(
+            '--duration', type=float, default=60,
+            help="Seconds to run for.")
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help="Seconds between reports.")
+        parser.add_argument(
+            '--token', help="X-Auth-Token of an admin user.")
+        parser.add_argument(
+            '--header', action='append', default=[],
+            help="Extra 'Name: value' header, can be repeated. Useful "
+                 "with the identity headers directly, when not behind "
+                 "keystonemiddleware.")
+        parser.add_argument(
+            '--reset-email', action='append', default=[],
+            help="Email of an existing user for reset_password, can be "
+                 "repeated.")
+        parser.add_argument('--timeout', type=float, default=30)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument(
+            '--output', help="Also write the final results as JSON here.")
+
+    def handle(self, *args, **options):
+        headers = {}
+        for header in options['header']:
+            name, _, value = header.partition(':')
+            if not value:
+                raise CommandError("Bad header '%s'." % header)
+            headers[name.strip()] = value.strip()
+        if options['token']:
+            headers['X-Auth-Token'] = options['token']
+
+        try:
+            generator = LoadGenerator(
+                options['url'], parse_mix(options['mix']),
+                concurrency=options['concurrency'],
+                duration=options['duration'],
+                headers=headers,
+                reset_emails=options['reset_email'],
+                timeout=options['timeout'],
+                seed=options['seed'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            "%8s %-15s %8s %7s %7s %7s %7s %7s" %
+            ('elapsed', 'call', 'count', 'per_s', 'errors',
+             'p50_ms', 'p95_ms', 'p99_ms'))
+        results = generator.run(
+            interval=options['interval'], report=self.report)
+
+        self.stdout.write("Totals:")
+        self.report(dict(results['calls'], elapsed=results['duration']))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=4, sort_keys=True)
+
+    def report(self, window):
+        elapsed = window.pop('elapsed')
+        for name in ['all'] + sorted(n for n in window if n != 'all'):
+            stats = window[name]
+            self.stdout.write(
+                "%7.0fs %-15s %8d %7.1f %6.1f%% %7s %7s %7s" %
+                (elapsed, name, stats['count'], stats['per_second'] or 0,
+                 100 * (stats['error_rate'] or 0), _ms(stats['p50']),
+                 _ms(stats['p95']), _ms(stats['p99'])))
@@ -0,0 +1,71 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from adjutant.simulator import build_cloud, keystone_settings
+
+
+class Command(BaseCommand):
+    help = ("Serves simulated Keystone, Neutron, Nova and Cinder APIs "
+            "until interrupted, for load testing without a cloud.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=5000)
+        parser.add_argument(
+            '--regions', default='RegionOne',
+            help="Comma separated region names.")
+        parser.add_argument(
+            '--latency', type=float, default=0.0,
+            help="Seconds each call takes.")
+        parser.add_argument(
+            '--jitter', type=float, default=0.0,
+            help="Seconds the latency varies by, either way.")
+        parser.add_argument(
+            '--error-rate', type=float, default=0.0,
+            help="Fraction of calls that fail with a 503.")
+        parser.add_argument('--projects', type=int, default=0)
+        parser.add_argument('--users-per-project', type=int, default=0)
+        parser.add_argument('--resources-per-project', type=int, default=0)
+        parser.add_argument(
+            '--seed', type=int, default=None,
+            help="Seed for the latency and errors, to repeat a run.")
+
+    def handle(self, *args, **options):
+        server = build_cloud(
+            regions=options['regions'].split(','),
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            projects=options['projects'],
+            users_per_project=options['users_per_project'],
+            resources_per_project=options['resources_per_project'],
+            seed=options['seed'],
+            host=options['host'],
+            port=options['port'])
+        server.start()
+        self.stdout.write(
+            "Serving on %s. Set KEYSTONE in the Adjutant config to:\n%s" %
+            (server.url, json.dumps(keystone_settings(server), indent=4)))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
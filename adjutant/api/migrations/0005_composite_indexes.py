@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_auto_20160929_0317'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(
+                fields=['hash_key', 'completed', 'cancelled'],
+                name='api_task_duplicates_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(
+                fields=['project_id', 'task_type', 'completed', 'cancelled'],
+                name='api_task_project_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(
+                fields=['completed', 'created_on'],
+                name='api_task_open_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(
+                fields=['completed', 'completed_on'],
+                name='api_task_completed_on_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(
+                fields=['created_on', 'uuid'],
+                name='api_task_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(
+                fields=['task', 'expires'],
+                name='api_token_task_expires_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(
+                fields=['error', 'acknowledged', 'created_on'],
+                name='api_notification_errors_idx'),
+        ),
+    ]
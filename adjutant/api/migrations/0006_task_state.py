@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_task_states(apps, schema_editor):
+    Task = apps.get_model('api', 'Task')
+    Task.objects.filter(cancelled=True).update(state='cancelled')
+    Task.objects.filter(
+        cancelled=False, completed=True).update(state='completed')
+    Task.objects.filter(
+        cancelled=False, completed=False, approved=True).update(
+            state='awaiting_token')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='state',
+            field=models.CharField(
+                choices=[('pending_approval', 'Pending approval'),
+                         ('awaiting_token', 'Awaiting token'),
+                         ('completed', 'Completed'),
+                         ('cancelled', 'Cancelled')],
+                default='pending_approval', max_length=20),
+        ),
+        migrations.RunPython(set_task_states, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(
+                fields=['state', 'created_on', 'uuid'],
+                name='api_task_state_created_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+from adjutant.api.models import summarize_actions
+
+
+def set_action_summaries(apps, schema_editor):
+    Task = apps.get_model('api', 'Task')
+    Action = apps.get_model('actions', 'Action')
+
+    actions = defaultdict(list)
+    for task_id, valid, need_token, auto_approve in Action.objects.values_list(
+            'task_id', 'valid', 'need_token', 'auto_approve').iterator():
+        actions[task_id].append((valid, need_token, auto_approve))
+
+    # Every task, even those without actions, gets the summary that
+    # Task.update_action_summary would give it. There are few distinct
+    # summaries, so update the tasks for each at once.
+    tasks = defaultdict(list)
+    for task_id in Task.objects.values_list('uuid', flat=True).iterator():
+        summary = summarize_actions(actions.get(task_id, []))
+        tasks[(summary['all_valid'], summary['any_need_token'],
+               summary['auto_approve'])].append(task_id)
+    for (all_valid, any_need_token, auto_approve), task_ids in tasks.items():
+        for start in range(0, len(task_ids), 500):
+            Task.objects.filter(
+                uuid__in=task_ids[start:start + 500]).update(
+                    all_valid=all_valid, any_need_token=any_need_token,
+                    auto_approve=auto_approve)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_task_state'),
+        ('actions', '0002_action_auto_approve'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='all_valid',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='any_need_token',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='auto_approve',
+            field=models.NullBooleanField(default=None),
+        ),
+        migrations.RunPython(
+            set_action_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def copy_action_notes(apps, schema_editor):
+    Task = apps.get_model('api', 'Task')
+    ActionNote = apps.get_model('api', 'ActionNote')
+
+    notes = []
+    tasks = Task.objects.only('uuid', 'created_on', 'action_notes')
+    for task in tasks.iterator():
+        # The old notes have no time of their own, beyond the one
+        # in their text, so they keep their order by id.
+        for action, action_notes in (task.action_notes or {}).items():
+            for note in action_notes:
+                notes.append(ActionNote(
+                    task_id=task.uuid, action=action, note=note,
+                    created_on=task.created_on))
+        if len(notes) >= 1000:
+            ActionNote.objects.bulk_create(notes)
+            notes = []
+    ActionNote.objects.bulk_create(notes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_task_action_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActionNote',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False,
+                    verbose_name='ID')),
+                ('action', models.CharField(max_length=200)),
+                ('created_on', models.DateTimeField(
+                    default=django.utils.timezone.now)),
+                ('note', models.TextField()),
+                ('task', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    to='api.Task')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='actionnote',
+            index=models.Index(
+                fields=['task', 'created_on', 'id'],
+                name='api_actionnote_task_idx'),
+        ),
+        migrations.RunPython(copy_action_notes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='task',
+            name='action_notes',
+        ),
+    ]
@@ -12,6 +12,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import json
+
 from django.db import models
 from uuid import uuid4
 from django.utils import timezone
@@ -22,7 +24,150 @@ def hex_uuid():
     return uuid4().hex
 
 
-class Task(models.Model):
+class DirtyFieldsMixin(object):
+    """
+    Tracks which fields of a model have changed since track_changes
+    or the last save after it, so a run of changes can be saved as one
+    update of just those fields with save_dirty.
+
+    Until track_changes is called every field counts as changed, so
+    models only read, such as those listed by the API, don't pay for
+    keeping a copy of their fields.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(DirtyFieldsMixin, self).__init__(*args, **kwargs)
+        self._saved_values = None
+
+    def _loaded_fields(self, fields=None):
+        # From __dict__, so deferred fields aren't loaded to check.
+        return [field for field in self._meta.concrete_fields
+                if not field.primary_key and
+                field.attname in self.__dict__ and
+                (fields is None or field.name in fields)]
+
+    def _field_values(self, fields=None):
+        # With JSON fields as JSON, as they're changed in place.
+        values = {}
+        for field in self._loaded_fields(fields):
+            value = self.__dict__[field.attname]
+            if isinstance(field, JSONField):
+                value = json.dumps(value, sort_keys=True, default=str)
+            values[field.name] = value
+        return values
+
+    def track_changes(self):
+        """
+        Starts tracking changes from the fields as they are now, if
+        not tracking them already.
+        """
+        if self._saved_values is None:
+            self._saved_values = self._field_values()
+
+    def mark_saved(self, fields=None):
+        """
+        Records the given fields, or all of them, as saved as they
+        are now.
+        """
+        if self._saved_values is not None:
+            self._saved_values.update(self._field_values(fields))
+
+    def dirty_fields(self):
+        """
+        The names of the fields changed since changes were tracked
+        from, or all of them if they aren't tracked.
+        """
+        if self._saved_values is None:
+            return [field.name for field in self._loaded_fields()]
+        return [name for name, value in self._field_values().items()
+                if name not in self._saved_values or
+                self._saved_values[name] != value]
+
+    def save(self, *args, **kwargs):
+        super(DirtyFieldsMixin, self).save(*args, **kwargs)
+        self.mark_saved(kwargs.get('update_fields'))
+
+    def save_dirty(self):
+        """
+        Saves just the changed fields, if any, or all of them if the
+        model is new.
+        """
+        if self._state.adding:
+            self.save()
+            return
+        dirty = self.dirty_fields()
+        if dirty:
+            self.save(update_fields=dirty)
+
+
+def summarize_actions(actions):
+    """
+    The Task summary columns for the given (valid, need_token,
+    auto_approve) of each of its actions.
+    """
+    all_valid = True
+    any_need_token = False
+    auto_approve = None
+    for valid, need_token, action_auto_approve in actions:
+        all_valid = all_valid and valid
+        any_need_token = any_need_token or need_token
+        if action_auto_approve is False:
+            auto_approve = False
+        elif action_auto_approve and auto_approve is None:
+            auto_approve = True
+    return {
+        'all_valid': all_valid,
+        'any_need_token': any_need_token,
+        'auto_approve': auto_approve,
+    }
+
+
+class TaskQuerySet(models.QuerySet):
+
+    def with_actions(self):
+        """
+        Fetches the actions of all the tasks in one extra query,
+        rather than one per task, for serializing many tasks.
+        """
+        action_model = self.model._meta.get_field('action').related_model
+        return self.prefetch_related(models.Prefetch(
+            'action_set', queryset=action_model.objects.order_by('order'),
+            to_attr='prefetched_actions'))
+
+    def with_notes(self):
+        """
+        Fetches the action notes of all the tasks in one extra query.
+        """
+        return self.prefetch_related(models.Prefetch(
+            'actionnote_set',
+            queryset=ActionNote.objects.order_by('created_on', 'id'),
+            to_attr='prefetched_notes'))
+
+    def only_fields(self, fields):
+        """
+        Loads just the columns the given serialized fields need, and
+        the actions and notes only if they are one of them.
+        """
+        columns = [field for field in fields
+                   if field not in ('actions', 'action_notes')]
+        tasks = self.only('uuid', 'created_on', *columns)
+        if 'actions' in fields:
+            tasks = tasks.with_actions()
+        if 'action_notes' in fields:
+            tasks = tasks.with_notes()
+        return tasks
+
+    def for_serializing(self, fields=None):
+        """
+        What Task._to_dict needs for the given fields, or for all of
+        them if none are given.
+        """
+        if fields:
+            return self.only_fields(fields)
+        return self.with_actions().with_notes()
+
+
+class Task(DirtyFieldsMixin, models.Model):
     """
     Wrapper object for the request and related actions.
     Stores the state of the Task and a log for the
@@ -43,26 +188,129 @@ class Task(models.Model):
     # type of the task, for easy grouping
     task_type = models.CharField(max_length=100, db_index=True)
 
-    # Effectively a log of what the actions are doing.
-    action_notes = JSONField(default={})
-
     cancelled = models.BooleanField(default=False, db_index=True)
     approved = models.BooleanField(default=False, db_index=True)
     completed = models.BooleanField(default=False, db_index=True)
 
+    # Where the task is, from the three flags above, so queues like
+    # those pending approval are one indexed column. Set on save.
+    PENDING_APPROVAL = 'pending_approval'
+    # Approved but not completed, nearly always as a token is out.
+    AWAITING_TOKEN = 'awaiting_token'
+    COMPLETED = 'completed'
+    CANCELLED = 'cancelled'
+    STATES = (
+        (PENDING_APPROVAL, 'Pending approval'),
+        (AWAITING_TOKEN, 'Awaiting token'),
+        (COMPLETED, 'Completed'),
+        (CANCELLED, 'Cancelled'),
+    )
+    state = models.CharField(max_length=20, choices=STATES,
+                             default=PENDING_APPROVAL)
+
+    # Summary of the task's actions, kept up to date as they save, so
+    # approval checks and list filters needn't load the actions.
+    all_valid = models.BooleanField(default=False)
+    any_need_token = models.BooleanField(default=False)
+    # As with Action.auto_approve, False from any action overrides
+    # True from the rest, and None if none of them set it.
+    auto_approve = models.NullBooleanField(default=None)
+
     created_on = models.DateTimeField(default=timezone.now)
     approved_on = models.DateTimeField(null=True)
     completed_on = models.DateTimeField(null=True)
 
+    objects = TaskQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # TaskView._handle_duplicates
+            models.Index(fields=['hash_key', 'completed', 'cancelled'],
+                         name='api_task_duplicates_idx'),
+            # Open tasks of a type on a project, as for invites
+            models.Index(
+                fields=['project_id', 'task_type', 'completed', 'cancelled'],
+                name='api_task_project_type_idx'),
+            # StatusView
+            models.Index(fields=['completed', 'created_on'],
+                         name='api_task_open_created_idx'),
+            models.Index(fields=['completed', 'completed_on'],
+                         name='api_task_completed_on_idx'),
+            # Listing tasks, newest first
+            models.Index(fields=['created_on', 'uuid'],
+                         name='api_task_created_idx'),
+            # Listing the tasks in a state, newest first
+            models.Index(fields=['state', 'created_on', 'uuid'],
+                         name='api_task_state_created_idx'),
+        ]
+
+    # What _to_dict includes by default.
+    SERIALIZED_FIELDS = (
+        "uuid", "ip_address", "keystone_user", "approved_by", "project_id",
+        "actions", "task_type", "action_notes", "cancelled", "approved",
+        "completed", "state", "all_valid", "any_need_token", "auto_approve",
+        "created_on", "approved_on", "completed_on",
+    )
+
     def __init__(self, *args, **kwargs):
         super(Task, self).__init__(*args, **kwargs)
         # in memory dict to be used for passing data between actions:
         self.cache = {}
+        # ActionNotes added since the last flush_action_notes:
+        self.pending_notes = []
+
+    def save(self, *args, **kwargs):
+        self.state = self.current_state()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'state' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['state']
+        super(Task, self).save(*args, **kwargs)
+        self.flush_action_notes()
+
+    def current_state(self):
+        """
+        The state the cancelled, approved and completed flags put the
+        task in.
+        """
+        if self.cancelled:
+            return self.CANCELLED
+        if self.completed:
+            return self.COMPLETED
+        if self.approved:
+            return self.AWAITING_TOKEN
+        return self.PENDING_APPROVAL
+
+    def update_action_summary(self):
+        """
+        Recomputes all_valid, any_need_token and auto_approve from the
+        task's actions, and saves just those columns.
+        """
+        summary = summarize_actions(self.action_set.values_list(
+            'valid', 'need_token', 'auto_approve'))
+        for field, value in summary.items():
+            setattr(self, field, value)
+        Task.objects.filter(uuid=self.uuid).update(**summary)
+        self.mark_saved(summary)
 
     @property
     def actions(self):
+        # Set, in order, by TaskQuerySet.with_actions.
+        if hasattr(self, 'prefetched_actions'):
+            return self.prefetched_actions
         return self.action_set.order_by('order')
 
+    @property
+    def action_notes(self):
+        """
+        Effectively a log of what the actions are doing, as a dict of
+        each action's notes, oldest first.
+        """
+        if hasattr(self, 'prefetched_notes'):
+            notes = self.prefetched_notes
+        else:
+            notes = self.actionnote_set.order_by('created_on', 'id')
+        return notes_by_action(list(notes) + self.pending_notes)
+
     @property
     def tokens(self):
         return self.token_set.all()
@@ -71,46 +319,90 @@ class Task(models.Model):
     def notifications(self):
         return self.notification_set.all()
 
-    def _to_dict(self):
-        actions = []
-        for action in self.actions:
-            actions.append({
-                "action_name": action.action_name,
-                "data": action.action_data,
-                "valid": action.valid
-            })
-
-        return {
-            "uuid": self.uuid,
-            "ip_address": self.ip_address,
-            "keystone_user": self.keystone_user,
-            "approved_by": self.approved_by,
-            "project_id": self.project_id,
-            "actions": actions,
-            "task_type": self.task_type,
-            "action_notes": self.action_notes,
-            "cancelled": self.cancelled,
-            "approved": self.approved,
-            "completed": self.completed,
-            "created_on": self.created_on,
-            "approved_on": self.approved_on,
-            "completed_on": self.completed_on,
-        }
+    def _to_dict(self, fields=None):
+        """
+        Only includes the given fields, from SERIALIZED_FIELDS, if any
+        are given, so the rest needn't be loaded.
+        """
+        task_dict = {}
+        for field in fields or self.SERIALIZED_FIELDS:
+            if field == "actions":
+                actions = []
+                for action in self.actions:
+                    actions.append({
+                        "action_name": action.action_name,
+                        "data": action.action_data,
+                        "valid": action.valid
+                    })
+                task_dict["actions"] = actions
+            else:
+                task_dict[field] = getattr(self, field)
+        return task_dict
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         """
         Slightly safer variant of the above for non-admin.
         """
-        task_dict = self._to_dict()
-        task_dict.pop("ip_address")
+        task_dict = self._to_dict(fields)
+        task_dict.pop("ip_address", None)
         return task_dict
 
     def add_action_note(self, action, note):
-        if action in self.action_notes:
-            self.action_notes[action].append(note)
-        else:
-            self.action_notes[action] = [note]
-        self.save()
+        """
+        Adds the note, to be inserted with the others added before
+        the next flush_action_notes, or save.
+        """
+        self.pending_notes.append(
+            ActionNote(task=self, action=action, note=note))
+
+    def flush_action_notes(self):
+        """
+        Inserts the pending notes, all in one query.
+        """
+        if self.pending_notes:
+            ActionNote.objects.bulk_create(self.pending_notes)
+            self.pending_notes = []
+
+
+def notes_by_action(notes):
+    """
+    The text of the given ActionNotes, in a list for each action.
+    """
+    action_notes = {}
+    for note in notes:
+        action_notes.setdefault(note.action, []).append(note.note)
+    return action_notes
+
+
+class ActionNote(models.Model):
+    """
+    A note from an action on what it did to a task. Only ever added
+    to, so notes are inserted rather than rewriting the whole log.
+    """
+
+    task = models.ForeignKey(Task)
+    action = models.CharField(max_length=200)
+    created_on = models.DateTimeField(default=timezone.now)
+    note = models.TextField()
+
+    class Meta:
+        indexes = [
+            # A task's notes in order, and paged by cursor
+            models.Index(fields=['task', 'created_on', 'id'],
+                         name='api_actionnote_task_idx'),
+        ]
+
+
+class TokenQuerySet(models.QuerySet):
+
+    def with_task(self):
+        """
+        Joins in the task type each token serializes, leaving out the
+        large task columns it doesn't need.
+        """
+        return self.select_related('task').only(
+            'token', 'created_on', 'expires', 'task__uuid',
+            'task__task_type')
 
 
 class Token(models.Model):
@@ -123,9 +415,17 @@ class Token(models.Model):
     created_on = models.DateTimeField(default=timezone.now)
     expires = models.DateTimeField(db_index=True)
 
+    objects = TokenQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['task', 'expires'],
+                         name='api_token_task_expires_idx'),
+        ]
+
     def to_dict(self):
         return {
-            "task": self.task.uuid,
+            "task": self.task_id,
             "task_type": self.task.task_type,
             "token": self.token,
             "created_on": self.created_on,
@@ -150,11 +450,18 @@ class Notification(models.Model):
     created_on = models.DateTimeField(default=timezone.now)
     acknowledged = models.BooleanField(default=False, db_index=True)
 
+    class Meta:
+        indexes = [
+            # Unacknowledged errors, newest first, for StatusView
+            models.Index(fields=['error', 'acknowledged', 'created_on'],
+                         name='api_notification_errors_idx'),
+        ]
+
     def to_dict(self):
         return {
             "uuid": self.uuid,
             "notes": self.notes,
-            "task": self.task.uuid,
+            "task": self.task_id,
             "error": self.error,
             "acknowledged": self.acknowledged,
             "created_on": self.created_on
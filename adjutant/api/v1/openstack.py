@@ -13,11 +13,13 @@
 #    under the License.
 
 from django.conf import settings
+from django.db.models import Exists, OuterRef, Prefetch
 from django.utils import timezone
 
 from rest_framework.response import Response
 
 from adjutant.actions import user_store
+from adjutant.actions.models import Action
 from adjutant.api import models
 from adjutant.api import utils
 from adjutant.api.v1 import tasks
@@ -26,9 +28,97 @@ from adjutant.api.v1.utils import add_task_id_for_roles
 
 class UserList(tasks.InviteUser):
 
+    sort_keys = ['id', 'name', 'email', 'status', 'cohort']
+    cohorts = ['Member', 'Invited']
+
     @utils.mod_or_admin
     def get(self, request):
-        """Get a list of all users who have been added to a project"""
+        """
+        Get a list of all users who have been added to a project,
+        and all pending invites.
+
+        Optional query parameters:
+        - 'name', 'email': only users where these contain the value.
+        - 'role': only users with this role.
+        - 'cohort': only 'Member' or only 'Invited' users.
+        - 'sort_key' and 'sort_dir': sort by one of sort_keys, or by
+          id by default, 'asc' (the default) or 'desc'.
+        - 'limit' and 'marker': return at most 'limit' users, starting
+          after 'marker'. If there are more, 'next_marker' is included
+          in the response, to pass as 'marker' for the next page.
+          It holds the sort value as well as the id of the last user,
+          so paging carries on where it left off even if that user has
+          since gone. A user id on its own also works as 'marker'.
+        """
+        params = request.query_params
+        errors = []
+
+        limit = params.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+                if limit < 1:
+                    raise ValueError
+            except ValueError:
+                errors.append("'limit' must be a positive integer.")
+        cohort = params.get('cohort')
+        if cohort and cohort not in self.cohorts:
+            errors.append("'cohort' must be one of: %s." %
+                          ", ".join(self.cohorts))
+        sort_key = params.get('sort_key')
+        if sort_key and sort_key not in self.sort_keys:
+            errors.append("'sort_key' must be one of: %s." %
+                          ", ".join(self.sort_keys))
+        sort_dir = params.get('sort_dir', 'asc')
+        if sort_dir not in ['asc', 'desc']:
+            errors.append("'sort_dir' must be 'asc' or 'desc'.")
+        if errors:
+            return Response({'errors': errors}, status=400)
+
+        filters = {
+            'name': params.get('name'),
+            'email': params.get('email'),
+            'role': params.get('role'),
+        }
+
+        user_list = []
+        if cohort != 'Invited':
+            user_list.extend(self._list_members(request, **filters))
+        if cohort != 'Member':
+            user_list.extend(self._list_invites(request, **filters))
+
+        def sort_value(user):
+            # With the id last, so the order is the same every time.
+            value = (user[sort_key] or '').lower() if sort_key else ''
+            return (value, user['id'])
+
+        user_list.sort(key=sort_value, reverse=(sort_dir == 'desc'))
+
+        marker = params.get('marker')
+        if marker:
+            # Ids don't contain '/', though the sort value might.
+            value, _, marker_id = marker.rpartition('/')
+            marker_value = (value, marker_id)
+            if '/' not in marker:
+                for user in user_list:
+                    if user['id'] == marker_id:
+                        marker_value = sort_value(user)
+                        break
+            if sort_dir == 'desc':
+                user_list = [user for user in user_list
+                             if sort_value(user) < marker_value]
+            else:
+                user_list = [user for user in user_list
+                             if sort_value(user) > marker_value]
+
+        response = {}
+        if limit and len(user_list) > limit:
+            user_list = user_list[:limit]
+            response['next_marker'] = '%s/%s' % sort_value(user_list[-1])
+        response['users'] = user_list
+        return Response(response)
+
+    def _list_members(self, request, name=None, email=None, role=None):
         class_conf = settings.TASK_SETTINGS.get(
             'edit_user', settings.DEFAULT_TASK_SETTINGS)
         role_blacklist = class_conf.get('role_blacklist', [])
@@ -40,57 +130,70 @@ class UserList(tasks.InviteUser):
         can_manage_roles = user_store.get_managable_roles(
             request.keystone_user['roles'])
 
-        active_emails = set()
-        for user in id_manager.list_users(project):
+        for user in id_manager.list_users(project, role=role, name=name):
             skip = False
             roles = []
-            for role in user.roles:
-                if role.name in role_blacklist:
+            for user_role in user.roles:
+                if user_role.name in role_blacklist:
                     skip = True
                     continue
-                roles.append(role.name)
+                roles.append(user_role.name)
             if skip:
                 continue
 
-            email = getattr(user, 'email', '')
+            user_email = getattr(user, 'email', '')
+            if email and email.lower() not in (user_email or '').lower():
+                continue
             enabled = getattr(user, 'enabled')
             user_status = 'Active' if enabled else 'Account Disabled'
-            active_emails.add(email)
             user_list.append({
                 'id': user.id,
                 'name': user.name,
-                'email': email,
+                'email': user_email,
                 'roles': roles,
                 'cohort': 'Member',
                 'status': user_status,
                 'manageable': set(can_manage_roles).issuperset(roles),
             })
+        return user_list
 
-        # Get my active tasks for this project:
+    def _list_invites(self, request, name=None, email=None, role=None):
+        project_id = request.keystone_user['project_id']
+
+        # Get my active tasks for this project, working out their
+        # status and fetching their action data in two queries total:
+        now = timezone.now()
         project_tasks = models.Task.objects.filter(
             project_id=project_id,
             task_type="invite_user",
             completed=0,
-            cancelled=0)
+            cancelled=0
+        ).only('uuid').annotate(
+            expired=Exists(models.Token.objects.filter(
+                task=OuterRef('pk'), expires__lt=now)),
+            failed=Exists(models.Notification.objects.filter(
+                task=OuterRef('pk'), error=True)),
+        ).prefetch_related(Prefetch(
+            'action_set',
+            queryset=Action.objects.only(
+                'task', 'action_data').order_by('order')))
 
         registrations = []
         for task in project_tasks:
             status = "Invited"
-            for token in task.tokens:
-                if token.expired:
-                    status = "Expired"
-
-            for notification in task.notifications:
-                if notification.error:
-                    status = "Failed"
+            if task.expired:
+                status = "Expired"
+            if task.failed:
+                status = "Failed"
 
             task_data = {}
-            for action in task.actions:
+            for action in task.action_set.all():
                 task_data.update(action.action_data)
 
             registrations.append(
                 {'uuid': task.uuid, 'task_data': task_data, 'status': status})
 
+        user_list = []
         for task in registrations:
             # NOTE(adriant): commenting out for now as it causes more confusion
             # than it helps. May uncomment once different duplication checking
@@ -105,9 +208,14 @@ class UserList(tasks.InviteUser):
             if not settings.USERNAME_IS_EMAIL:
                 user['name'] = task['task_data']['username']
 
+            if name and name.lower() not in user['name'].lower():
+                continue
+            if email and email.lower() not in user['email'].lower():
+                continue
+            if role and role not in user['roles']:
+                continue
             user_list.append(user)
-
-        return Response({'users': user_list})
+        return user_list
 
 
 class UserDetail(tasks.TaskView):
@@ -215,20 +215,12 @@ class TaskView(APIViewWithLogger):
         email_conf = class_conf.get('emails', {}).get('initial', None)
         send_stage_email(task, email_conf)
 
-        action_models = task.actions
-        approve_list = [act.get_action().auto_approve for act in action_models]
-
         # TODO(amelia): It would be nice to explicitly test this, however
         #               currently we don't have the right combinations of
         #               actions to allow for it.
-        if False in approve_list:
-            can_auto_approve = False
-        elif True in approve_list:
-            can_auto_approve = True
-        else:
-            can_auto_approve = False
-
-        if can_auto_approve:
+        # NOTE: The actions keep task.auto_approve up to date, as False
+        #       if any of them are False, otherwise True if any are.
+        if task.auto_approve:
             task_name = self.__class__.__name__
             self.logger.info("(%s) - AutoApproving %s request."
                              % (timezone.now(), task_name))
@@ -287,13 +279,11 @@ class TaskView(APIViewWithLogger):
         task.approved_by = request.keystone_user
         task.save()
 
+        if not task.all_valid:
+            return {'errors': ['actions invalid']}, 400
+
         action_models = task.actions
         actions = [act.get_action() for act in action_models]
-        need_token = False
-
-        valid = all([act.valid for act in actions])
-        if not valid:
-            return {'errors': ['actions invalid']}, 400
 
         # post_approve all actions
         for action in actions:
@@ -319,12 +309,11 @@ class TaskView(APIViewWithLogger):
                 }
                 return response_dict, 500
 
-        valid = all([act.valid for act in actions])
-        if not valid:
+        # Kept up to date by the actions as they save:
+        if not task.all_valid:
             return {'errors': ['actions invalid']}, 400
 
-        need_token = any([act.need_token for act in actions])
-        if need_token:
+        if task.any_need_token:
             return self._create_token(task)
 
         # submit all actions
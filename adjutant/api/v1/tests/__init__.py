@@ -67,6 +67,9 @@ def setup_temp_cache(projects, users):
 
 class FakeManager(object):
 
+    def gather(self, *calls):
+        return [getattr(self, call[0])(*call[1:]) for call in calls]
+
     def _project_from_id(self, project):
         if isinstance(project, mock.Mock):
             return project
@@ -93,6 +96,8 @@ class FakeManager(object):
 
     def find_user(self, name, domain):
         domain = self._domain_from_id(domain)
+        if not domain:
+            return None
         global temp_cache
         for user in temp_cache['users'].values():
             if user.name == name and user.domain == domain.id:
@@ -103,19 +108,23 @@ class FakeManager(object):
         global temp_cache
         return temp_cache['users'].get(user_id, None)
 
-    def list_users(self, project):
+    def list_users(self, project, role=None, name=None):
         project = self._project_from_id(project)
         global temp_cache
         roles = temp_cache['projects'][project.name].roles
         users = []
 
         for user_id, user_roles in roles.items():
+            if role and role not in user_roles:
+                continue
             user = self.get_user(user_id)
+            if name and name.lower() not in user.name.lower():
+                continue
             user.roles = []
 
-            for role in user_roles:
+            for user_role in user_roles:
                 r = mock.Mock()
-                r.name = role
+                r.name = user_role
                 user.roles.append(r)
 
             users.append(user)
@@ -18,6 +18,8 @@ from datetime import timedelta
 
 from unittest import skip
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.core import mail
 
@@ -26,6 +28,7 @@ import mock
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from adjutant.actions.models import Action
 from adjutant.api.models import Task, Token, Notification
 from adjutant.api.v1.tests import (FakeManager, setup_temp_cache,
                                    modify_dict_settings)
@@ -1580,3 +1583,440 @@ class AdminAPITests(APITestCase):
             response.json()['notes'],
             ['If user with email exists, reset token will be issued.'])
         self.assertEqual(0, Token.objects.count())
+
+    def test_task_list_cursor(self):
+        """
+        Cursor pagination walks the tasks newest first, both ways,
+        and rows created while paging don't shift later pages.
+        """
+        now = timezone.now()
+        for i in range(5):
+            Task.objects.create(
+                uuid='task%s' % i, ip_address='0.0.0.0', keystone_user={},
+                project_id='test_project_id', task_type='invite_user',
+                # two tasks share a time, to check the tie breaker
+                created_on=now - timedelta(minutes=min(i, 3)))
+
+        headers = {
+            'project_name': "test_project",
+            'project_id': "test_project_id",
+            'roles': "admin,_member_",
+            'username': "test@example.com",
+            'user_id': "test_user_id",
+            'authenticated': True
+        }
+        url = "/v1/tasks"
+
+        response = self.client.get(
+            url, {'limit': 2}, format='json', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [task['uuid'] for task in response.json()['tasks']],
+            ['task0', 'task1'])
+        self.assertEqual(response.json()['prev'], None)
+
+        Task.objects.create(
+            uuid='newtask', ip_address='0.0.0.0', keystone_user={},
+            project_id='test_project_id', task_type='invite_user')
+
+        response = self.client.get(
+            url, {'limit': 2, 'cursor': response.json()['next']},
+            format='json', headers=headers)
+        self.assertEqual(
+            [task['uuid'] for task in response.json()['tasks']],
+            ['task2', 'task4'])
+        middle = response.json()
+
+        response = self.client.get(
+            url, {'limit': 2, 'cursor': middle['next']},
+            format='json', headers=headers)
+        self.assertEqual(
+            [task['uuid'] for task in response.json()['tasks']],
+            ['task3'])
+        self.assertEqual(response.json()['next'], None)
+
+        response = self.client.get(
+            url, {'limit': 2, 'cursor': response.json()['prev']},
+            format='json', headers=headers)
+        self.assertEqual(response.json(), middle)
+
+        response = self.client.get(
+            url, {'limit': 2, 'cursor': middle['prev']},
+            format='json', headers=headers)
+        self.assertEqual(
+            [task['uuid'] for task in response.json()['tasks']],
+            ['task0', 'task1'])
+        self.assertEqual(
+            [task['uuid'] for task in self.client.get(
+                url, {'limit': 2, 'cursor': response.json()['prev']},
+                format='json', headers=headers).json()['tasks']],
+            ['newtask'])
+
+    def test_token_and_notification_list_cursor(self):
+        """
+        Tokens and notifications can be paginated by cursor, with
+        filters, and are all returned without a limit or cursor.
+        """
+        task = Task.objects.create(
+            ip_address='0.0.0.0', keystone_user={},
+            project_id='test_project_id', task_type='invite_user')
+        now = timezone.now()
+        for i in range(3):
+            Token.objects.create(
+                task=task, token='token%s' % i,
+                created_on=now - timedelta(minutes=i),
+                expires=now + timedelta(hours=1))
+            Notification.objects.create(
+                task=task, notes={}, error=bool(i),
+                created_on=now - timedelta(minutes=i))
+
+        headers = {
+            'project_name': "test_project",
+            'project_id': "test_project_id",
+            'roles': "admin,_member_",
+            'username': "test@example.com",
+            'user_id': "test_user_id",
+            'authenticated': True
+        }
+
+        response = self.client.get(
+            "/v1/tokens", {'limit': 2}, format='json', headers=headers)
+        self.assertEqual(
+            [token['token'] for token in response.json()['tokens']],
+            ['token0', 'token1'])
+        response = self.client.get(
+            "/v1/tokens", {'cursor': response.json()['next']},
+            format='json', headers=headers)
+        self.assertEqual(
+            [token['token'] for token in response.json()['tokens']],
+            ['token2'])
+        self.assertEqual(response.json()['next'], None)
+
+        response = self.client.get(
+            "/v1/notifications",
+            {'limit': 1, 'filters': json.dumps({'error': {'exact': True}})},
+            format='json', headers=headers)
+        self.assertEqual(len(response.json()['notifications']), 1)
+        response = self.client.get(
+            "/v1/notifications", {'cursor': response.json()['next']},
+            format='json', headers=headers)
+        self.assertEqual(len(response.json()['notifications']), 1)
+        self.assertTrue(response.json()['notifications'][0]['error'])
+
+        response = self.client.get(
+            "/v1/notifications", format='json', headers=headers)
+        self.assertEqual(
+            list(response.json().keys()), ['notifications'])
+        self.assertEqual(len(response.json()['notifications']), 3)
+
+    def test_list_cursor_invalid(self):
+        """
+        A bad cursor or limit is a 400.
+        """
+        headers = {
+            'project_name': "test_project",
+            'project_id': "test_project_id",
+            'roles': "admin,_member_",
+            'username': "test@example.com",
+            'user_id': "test_user_id",
+            'authenticated': True
+        }
+        for url in ["/v1/tasks", "/v1/tokens", "/v1/notifications"]:
+            response = self.client.get(
+                url, {'cursor': 'gibberish'}, format='json', headers=headers)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.json(), {'errors': ["Invalid cursor."]})
+
+            response = self.client.get(
+                url, {'limit': 0}, format='json', headers=headers)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_query_counts(self):
+        """
+        Listing tasks, tokens and notifications takes the same number
+        of queries however many rows there are.
+        """
+        now = timezone.now()
+        for i in range(5):
+            task = Task.objects.create(
+                ip_address='0.0.0.0', keystone_user={},
+                project_id='test_project_id', task_type='invite_user',
+                completed=bool(i % 2))
+            for order in range(3):
+                Action.objects.create(
+                    action_name='NewUserAction', task=task, order=order)
+            Token.objects.create(
+                task=task, token='token%s' % i,
+                expires=now + timedelta(hours=1))
+            Notification.objects.create(task=task, notes={}, error=True)
+
+        headers = {
+            'project_name': "test_project",
+            'project_id': "test_project_id",
+            'roles': "admin,_member_",
+            'username': "test@example.com",
+            'user_id': "test_user_id",
+            'authenticated': True
+        }
+
+        # tasks, then all their actions, then all their notes
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                "/v1/tasks", format='json', headers=headers)
+        self.assertEqual(len(response.json()['tasks']), 5)
+        self.assertEqual(
+            [action['action_name'] for action
+             in response.json()['tasks'][0]['actions']],
+            ['NewUserAction'] * 3)
+        # plus the page count
+        with self.assertNumQueries(4):
+            self.client.get(
+                "/v1/tasks", {'tasks_per_page': 3}, format='json',
+                headers=headers)
+        with self.assertNumQueries(3):
+            self.client.get(
+                "/v1/tasks", {'limit': 3}, format='json', headers=headers)
+        with self.assertNumQueries(3):
+            self.client.get(
+                "/v1/tasks/%s" % task.uuid, format='json', headers=headers)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                "/v1/tokens", format='json', headers=headers)
+        self.assertEqual(len(response.json()['tokens']), 5)
+        self.assertEqual(
+            response.json()['tokens'][0]['task_type'], 'invite_user')
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                "/v1/notifications", format='json', headers=headers)
+        self.assertEqual(len(response.json()['notifications']), 5)
+
+        # notifications, then each of the two tasks, its actions and
+        # its notes
+        with self.assertNumQueries(7):
+            response = self.client.get(
+                "/v1/status", format='json', headers=headers)
+        self.assertEqual(len(response.json()['error_notifications']), 5)
+
+    def test_task_fields(self):
+        """
+        'fields' limits the tasks to those fields, without loading the
+        other columns, or the actions unless asked for.
+        """
+        for i in range(3):
+            task = Task.objects.create(
+                ip_address='0.0.0.0', keystone_user={},
+                project_id='test_project_id', task_type='invite_user')
+            task.add_action_note('NewUserAction', 'A long note.')
+            task.flush_action_notes()
+            Action.objects.create(
+                action_name='NewUserAction', task=task, order=0)
+
+        headers = {
+            'project_name': "test_project",
+            'project_id': "test_project_id",
+            'roles': "admin,_member_",
+            'username': "test@example.com",
+            'user_id': "test_user_id",
+            'authenticated': True
+        }
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                "/v1/tasks", {'fields': 'uuid,task_type,approved'},
+                format='json', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('action_notes', queries[0]['sql'])
+        self.assertEqual(
+            response.json()['tasks'][0],
+            {'uuid': task.uuid, 'task_type': 'invite_user',
+             'approved': False})
+
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                "/v1/tasks", {'fields': 'uuid,actions', 'limit': 2},
+                format='json', headers=headers)
+        self.assertEqual(
+            response.json()['tasks'][0]['actions'][0]['action_name'],
+            'NewUserAction')
+
+        response = self.client.get(
+            "/v1/tasks/%s" % task.uuid, {'fields': 'uuid,action_notes'},
+            format='json', headers=headers)
+        self.assertEqual(
+            response.json(),
+            {'uuid': task.uuid,
+             'action_notes': {'NewUserAction': ['A long note.']}})
+
+        response = self.client.get(
+            "/v1/tasks", {'fields': 'uuid,cache'},
+            format='json', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.json(), {'errors': ["Unknown fields: cache"]})
+
+    def test_task_state(self):
+        """
+        The task's state follows it through approval, token submission
+        and cancellation, and can be filtered on.
+        """
+        setup_temp_cache({}, {})
+
+        headers = {
+            'project_name': "test_project",
+            'project_id': "test_project_id",
+            'roles': "admin,_member_",
+            'username': "test@example.com",
+            'user_id': "test_user_id",
+            'authenticated': True
+        }
+
+        url = "/v1/actions/CreateProject"
+        data = {'project_name': "test_project", 'email': "test@example.com"}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = {'project_name': "test_project2", 'email': "test2@example.com"}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        task, other_task = Task.objects.order_by('created_on')
+        self.assertEqual(task.state, Task.PENDING_APPROVAL)
+
+        url = "/v1/tasks/" + task.uuid
+        response = self.client.post(url, {'approved': True}, format='json',
+                                    headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            Task.objects.get(uuid=task.uuid).state, Task.AWAITING_TOKEN)
+
+        for state, uuid in [(Task.PENDING_APPROVAL, other_task.uuid),
+                            (Task.AWAITING_TOKEN, task.uuid)]:
+            response = self.client.get(
+                "/v1/tasks",
+                {'filters': json.dumps({'state': {'exact': state}})},
+                format='json', headers=headers)
+            self.assertEqual(
+                [t['uuid'] for t in response.json()['tasks']], [uuid])
+            self.assertEqual(response.json()['tasks'][0]['state'], state)
+
+        new_token = Token.objects.all()[0]
+        url = "/v1/tokens/" + new_token.token
+        response = self.client.post(
+            url, {'password': 'testpassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            Task.objects.get(uuid=task.uuid).state, Task.COMPLETED)
+
+        url = "/v1/tasks/" + other_task.uuid
+        response = self.client.delete(url, format='json', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            Task.objects.get(uuid=other_task.uuid).state, Task.CANCELLED)
+
+    def test_task_action_summary(self):
+        """
+        The task's summary of its actions follows them as they save,
+        and is what approval checks and list filters go by.
+        """
+        setup_temp_cache({}, {})
+
+        headers = {
+            'project_name': "test_project",
+            'project_id': "test_project_id",
+            'roles': "admin,_member_",
+            'username': "test@example.com",
+            'user_id': "test_user_id",
+            'authenticated': True
+        }
+
+        url = "/v1/actions/CreateProject"
+        data = {'project_name': "test_project", 'email': "test@example.com"}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        task = Task.objects.get()
+        self.assertTrue(task.all_valid)
+        self.assertTrue(task.any_need_token)
+        self.assertIsNone(task.auto_approve)
+
+        response = self.client.get(
+            "/v1/tasks",
+            {'filters': json.dumps({'all_valid': {'exact': True},
+                                    'state': {'exact': 'pending_approval'}})},
+            format='json', headers=headers)
+        self.assertEqual(
+            [t['uuid'] for t in response.json()['tasks']], [task.uuid])
+
+        action = Action.objects.filter(task=task).first()
+        action.valid = False
+        action.save()
+        self.assertFalse(Task.objects.get(uuid=task.uuid).all_valid)
+
+        url = "/v1/tasks/" + task.uuid
+        response = self.client.post(url, {'approved': True}, format='json',
+                                    headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        action.valid = True
+        action.save()
+        response = self.client.post(url, {'approved': True}, format='json',
+                                    headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Token.objects.count(), 1)
+
+    def test_task_notes_paginated(self):
+        """
+        Action notes are inserted together, and the task detail can
+        page through them by cursor, newest first.
+        """
+        task = Task.objects.create(
+            ip_address='0.0.0.0', keystone_user={},
+            project_id='test_project_id', task_type='invite_user')
+        for i in range(5):
+            task.add_action_note(
+                'NewUserAction' if i % 2 else 'SendAdditionalEmailAction',
+                'Note %s.' % i)
+        with self.assertNumQueries(1):
+            task.flush_action_notes()
+
+        headers = {
+            'project_name': "test_project",
+            'project_id': "test_project_id",
+            'roles': "admin,_member_",
+            'username': "test@example.com",
+            'user_id': "test_user_id",
+            'authenticated': True
+        }
+        url = "/v1/tasks/" + task.uuid
+
+        response = self.client.get(url, format='json', headers=headers)
+        self.assertEqual(
+            response.json()['action_notes'],
+            {'NewUserAction': ['Note 1.', 'Note 3.'],
+             'SendAdditionalEmailAction': ['Note 0.', 'Note 2.', 'Note 4.']})
+
+        response = self.client.get(
+            url, {'notes_limit': 2}, format='json', headers=headers)
+        self.assertEqual(
+            response.json()['action_notes'],
+            {'NewUserAction': ['Note 3.'],
+             'SendAdditionalEmailAction': ['Note 4.']})
+        self.assertIsNone(response.json()['action_notes_prev'])
+
+        response = self.client.get(
+            url, {'notes_limit': 2,
+                  'notes_cursor': response.json()['action_notes_next']},
+            format='json', headers=headers)
+        self.assertEqual(
+            response.json()['action_notes'],
+            {'NewUserAction': ['Note 1.'],
+             'SendAdditionalEmailAction': ['Note 2.']})
+
+        response = self.client.get(
+            url, {'notes_cursor': 'nonsense'}, format='json',
+            headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -12,14 +12,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from datetime import timedelta
+
 import mock
 
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from django.test.utils import override_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
 
-from adjutant.api.models import Token
+from adjutant.api.models import Notification, Task, Token
+from adjutant.api.v1 import tests
 from adjutant.api.v1.tests import FakeManager, setup_temp_cache
 
 
@@ -194,6 +199,166 @@ class OpenstackAPITests(APITestCase):
             if st_user['id'] == user2.id:
                 self.assertTrue(st_user['manageable'])
 
+    def _setup_user_list(self):
+        users = {}
+        project = mock.Mock()
+        project.id = 'test_project_id'
+        project.name = 'test_project'
+        project.domain = 'default'
+        project.roles = {}
+        for i, name in enumerate(['carol', 'alice', 'bob', 'dave']):
+            user = mock.Mock()
+            user.id = 'user_id_%s' % (i + 1)
+            user.name = name
+            user.email = "%s@example.com" % name
+            user.domain = 'default'
+            user.enabled = True
+            users[user.id] = user
+            project.roles[user.id] = ['_member_']
+        project.roles['user_id_3'].append('project_mod')
+
+        setup_temp_cache({'test_project': project}, users)
+
+        headers = {
+            'project_name': "test_project",
+            'project_id': "test_project_id",
+            'roles': "project_admin,_member_,project_mod",
+            'username': "test@example.com",
+            'user_id': "test_user_id",
+            'authenticated': True
+        }
+        url = "/v1/openstack/users"
+        data = {'email': "erin@example.com", 'roles': ["_member_"],
+                'project_id': 'test_project_id'}
+        response = self.client.post(url, data, format='json', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return headers
+
+    def test_user_list_filters(self):
+        """
+        Users and invites can be filtered by name, email, role and cohort.
+        """
+        headers = self._setup_user_list()
+        url = "/v1/openstack/users"
+
+        def names(params):
+            response = self.client.get(url, params, headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted(user['name'] for user in response.json()['users'])
+
+        self.assertEqual(
+            names({}),
+            ['alice', 'bob', 'carol', 'dave', 'erin@example.com'])
+        self.assertEqual(names({'name': 'AR'}), ['carol'])
+        self.assertEqual(names({'email': 'erin'}), ['erin@example.com'])
+        self.assertEqual(names({'role': 'project_mod'}), ['bob'])
+        self.assertEqual(names({'cohort': 'Invited'}), ['erin@example.com'])
+        self.assertEqual(
+            names({'cohort': 'Member', 'name': 'e'}), ['alice', 'dave'])
+
+    def test_user_list_sort_and_paginate(self):
+        """
+        Users can be sorted, and paged through with limit and marker.
+        """
+        headers = self._setup_user_list()
+        url = "/v1/openstack/users"
+        params = {'sort_key': 'name', 'sort_dir': 'desc', 'limit': 2}
+
+        pages = []
+        while True:
+            response = self.client.get(url, params, headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([user['name'] for user in response.json()['users']])
+            if 'next_marker' not in response.json():
+                break
+            params['marker'] = response.json()['next_marker']
+
+        self.assertEqual(pages, [
+            ['erin@example.com', 'dave'], ['carol', 'bob'], ['alice']])
+
+    def test_user_list_marker_removed(self):
+        """
+        Paging carries on after the marker user even if they have
+        been removed since the last page.
+        """
+        headers = self._setup_user_list()
+        url = "/v1/openstack/users"
+
+        for params in [{'limit': 2},
+                       {'limit': 2, 'sort_key': 'name'},
+                       {'limit': 2, 'sort_key': 'name', 'sort_dir': 'desc'}]:
+            response = self.client.get(url, params, headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            first_page = response.json()['users']
+            expected = self.client.get(
+                url, dict(params, marker=response.json()['next_marker']),
+                headers=headers).json()['users']
+
+            project = tests.temp_cache['projects']['test_project']
+            marker_id = first_page[-1]['id']
+            marker_roles = project.roles.pop(marker_id)
+            response = self.client.get(
+                url, dict(params, marker=response.json()['next_marker']),
+                headers=headers)
+            project.roles[marker_id] = marker_roles
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()['users'], expected)
+
+        # A plain user id works as a marker too.
+        response = self.client.get(
+            url, {'sort_key': 'name', 'marker': 'user_id_2'},
+            headers=headers)
+        self.assertEqual(
+            [user['name'] for user in response.json()['users']],
+            ['bob', 'carol', 'dave', 'erin@example.com'])
+
+    def test_user_list_bad_params(self):
+        headers = self._setup_user_list()
+        url = "/v1/openstack/users"
+
+        for params in [{'limit': 'ten'}, {'limit': 0},
+                       {'sort_key': 'password'}, {'sort_dir': 'up'},
+                       {'cohort': 'Admin'}]:
+            response = self.client.get(url, params, headers=headers)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(len(response.json()['errors']), 1)
+
+    def test_user_list_invites_constant_queries(self):
+        """
+        Listing invites costs the same number of queries however
+        many there are, and still reports their status.
+        """
+        headers = self._setup_user_list()
+        url = "/v1/openstack/users"
+        params = {'cohort': 'Invited'}
+
+        with CaptureQueriesContext(connection) as one_invite:
+            response = self.client.get(url, params, headers=headers)
+        self.assertEqual(response.json()['users'][0]['status'], 'Invited')
+
+        for i in range(4):
+            data = {'email': "new%s@example.com" % i, 'roles': ["_member_"],
+                    'project_id': 'test_project_id'}
+            self.client.post(url, data, format='json', headers=headers)
+        tasks = Task.objects.filter(task_type='invite_user').order_by(
+            'created_on')
+        Token.objects.filter(task=tasks[1]).update(
+            expires=timezone.now() - timedelta(hours=1))
+        Notification.objects.create(task=tasks[2], error=True)
+
+        with CaptureQueriesContext(connection) as five_invites:
+            response = self.client.get(url, params, headers=headers)
+
+        self.assertEqual(len(one_invite), len(five_invites))
+        statuses = dict((user['id'], user['status'])
+                        for user in response.json()['users'])
+        self.assertEqual(len(statuses), 5)
+        self.assertEqual(statuses[tasks[0].uuid], 'Invited')
+        self.assertEqual(statuses[tasks[1].uuid], 'Expired')
+        self.assertEqual(statuses[tasks[2].uuid], 'Failed')
+
     def test_force_reset_password(self):
         """
         Ensure the force password endpoint works as expected,
@@ -12,6 +12,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import base64
+import binascii
 import hashlib
 import json
 
@@ -24,8 +26,10 @@ from decorator import decorator
 from django.conf import settings
 from django.core.exceptions import FieldError
 from django.core.mail import EmailMultiAlternatives
+from django.db.models import Q
 from django.template import loader
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from rest_framework.response import Response
 
@@ -235,6 +239,21 @@ def parse_filters(func, *args, **kwargs):
             return Response({'errors': [str(e)]}, status=400)
 
 
+def parse_fields(params, allowed):
+    """
+    The comma separated 'fields' query parameter as a list, or None
+    if not given. Raises ValueError for fields not in 'allowed'.
+    """
+    fields = params.get('fields')
+    if not fields:
+        return None
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError("Unknown fields: %s" % ", ".join(unknown))
+    return fields
+
+
 def add_task_id_for_roles(request, processed, response_dict, req_roles):
     if request.keystone_user.get('authenticated', False):
 
@@ -243,3 +262,91 @@ def add_task_id_for_roles(request, processed, response_dict, req_roles):
 
         if roles & req_roles:
             response_dict['task'] = processed['task'].uuid
+
+
+# Page size for cursor pagination when only a cursor is given.
+DEFAULT_PAGE_SIZE = 25
+
+
+def encode_cursor(direction, obj):
+    """
+    An opaque cursor for the page after ('next') or before ('prev')
+    the given object.
+    """
+    position = [direction, obj.created_on.isoformat(), obj.pk]
+    return base64.urlsafe_b64encode(
+        json.dumps(position).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        direction, created_on, pk = json.loads(
+            base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+        created_on = parse_datetime(created_on)
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError("Invalid cursor.")
+    if direction not in ('next', 'prev') or created_on is None:
+        raise ValueError("Invalid cursor.")
+    return direction, created_on, pk
+
+
+def uses_cursor(params):
+    """
+    Whether a list request asked for cursor pagination, rather
+    than the legacy page numbers or everything at once.
+    """
+    return 'cursor' in params or 'limit' in params
+
+
+def paginate_by_cursor(queryset, params):
+    """
+    Keyset pagination of the queryset, newest first, on created_on
+    with the primary key as tie breaker. Unlike page numbers this
+    costs the same at any depth, and rows created while paging don't
+    shift later pages.
+
+    'limit' is the page size, and 'cursor' one of the opaque 'next'
+    or 'prev' values from a previous page. Returns the page as a list
+    and a dict with those two cursors, either of which is None when
+    there is nothing further that way.
+
+    Raises ValueError for a bad limit or cursor.
+    """
+    limit = params.get('limit', DEFAULT_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        limit = 0
+    if limit < 1:
+        raise ValueError("'limit' must be a positive integer.")
+
+    cursor = params.get('cursor')
+    direction = 'next'
+    if cursor:
+        direction, created_on, pk = decode_cursor(cursor)
+        if direction == 'next':
+            queryset = queryset.filter(
+                Q(created_on__lt=created_on) |
+                Q(created_on=created_on, pk__lt=pk))
+        else:
+            queryset = queryset.filter(
+                Q(created_on__gt=created_on) |
+                Q(created_on=created_on, pk__gt=pk))
+
+    if direction == 'next':
+        objects = list(queryset.order_by('-created_on', '-pk')[:limit + 1])
+        more = len(objects) > limit
+        objects = objects[:limit]
+        has_next, has_prev = more, bool(cursor)
+    else:
+        objects = list(queryset.order_by('created_on', 'pk')[:limit + 1])
+        more = len(objects) > limit
+        objects = objects[:limit][::-1]
+        has_next, has_prev = True, more
+
+    cursors = {'next': None, 'prev': None}
+    if objects and has_next:
+        cursors['next'] = encode_cursor('next', objects[-1])
+    if objects and has_prev:
+        cursors['prev'] = encode_cursor('prev', objects[0])
+    return objects, cursors
@@ -22,10 +22,12 @@ from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from adjutant.actions import openstack_clients
 from adjutant.api import utils
-from adjutant.api.models import Notification, Task, Token
+from adjutant.api.models import Notification, Task, Token, notes_by_action
 from adjutant.api.v1.utils import (
-    create_notification, create_token, parse_filters, send_stage_email)
+    create_notification, create_token, paginate_by_cursor, parse_fields,
+    parse_filters, send_stage_email, uses_cursor)
 
 
 class APIViewWithLogger(APIView):
@@ -46,8 +48,11 @@ class StatusView(APIViewWithLogger):
 
         Returns a list of unacknowledged error notifications,
         and both the last created and last completed tasks.
+        Also the seconds until the token Adjutant uses to talk to
+        OpenStack expires, and the state of the circuit breaker for
+        each OpenStack service it has called.
 
-        Can returns None, if there are no tasks.
+        Can returns None, if there are no tasks, or no token yet.
         """
         notifications = Notification.objects.filter(
             error=1,
@@ -55,12 +60,12 @@ class StatusView(APIViewWithLogger):
         )
 
         try:
-            last_created_task = Task.objects.filter(
+            last_created_task = Task.objects.for_serializing().filter(
                 completed=0).order_by("-created_on")[0].to_dict()
         except IndexError:
             last_created_task = None
         try:
-            last_completed_task = Task.objects.filter(
+            last_completed_task = Task.objects.for_serializing().filter(
                 completed=1).order_by("-completed_on")[0].to_dict()
         except IndexError:
             last_completed_task = None
@@ -68,7 +73,9 @@ class StatusView(APIViewWithLogger):
         status = {
             "error_notifications": [note.to_dict() for note in notifications],
             "last_created_task": last_created_task,
-            "last_completed_task": last_completed_task
+            "last_completed_task": last_completed_task,
+            "auth_expires_in": openstack_clients.get_auth_expires_in(),
+            "service_breakers": openstack_clients.get_breaker_states(),
         }
 
         return Response(status, status=200)
@@ -81,16 +88,28 @@ class NotificationList(APIViewWithLogger):
     def get(self, request, filters=None, format=None):
         """
         A list of Notification objects as dicts.
+
+        Paginated by cursor if given 'limit' or 'cursor'.
         """
         if filters:
             notifications = Notification.objects.filter(
                 **filters).order_by("-created_on")
         else:
             notifications = Notification.objects.all().order_by("-created_on")
+
+        response = {}
+        if uses_cursor(request.GET):
+            try:
+                notifications, response = paginate_by_cursor(
+                    notifications, request.GET)
+            except ValueError as e:
+                return Response({'errors': [str(e)]}, status=400)
+
         note_list = []
         for notification in notifications:
             note_list.append(notification.to_dict())
-        return Response({"notifications": note_list}, status=200)
+        response["notifications"] = note_list
+        return Response(response, status=200)
 
     @utils.admin
     def post(self, request, format=None):
@@ -162,7 +181,15 @@ class TaskList(APIViewWithLogger):
         """
         A list of dict representations of Task objects
         and their related actions.
+
+        Paginated by cursor with 'limit' and 'cursor', or by the
+        legacy 'tasks_per_page' and 'page'. 'fields' limits each task
+        to the given comma separated fields.
         """
+        try:
+            fields = parse_fields(request.GET, Task.SERIALIZED_FIELDS)
+        except ValueError as e:
+            return Response({'errors': [str(e)]}, status=400)
 
         page = request.GET.get('page', 1)
         tasks_per_page = request.GET.get('tasks_per_page', None)
@@ -172,6 +199,10 @@ class TaskList(APIViewWithLogger):
                 tasks = Task.objects.filter(**filters).order_by("-created_on")
             else:
                 tasks = Task.objects.all().order_by("-created_on")
+            tasks = tasks.for_serializing(fields)
+
+            if uses_cursor(request.GET):
+                return self._cursor_page(request, tasks, fields, admin=True)
 
             if tasks_per_page:
                 paginator = Paginator(tasks, tasks_per_page)
@@ -190,7 +221,7 @@ class TaskList(APIViewWithLogger):
 
             task_list = []
             for task in tasks:
-                task_list.append(task._to_dict())
+                task_list.append(task._to_dict(fields))
             if tasks_per_page:
                 return Response({'tasks': task_list,
                                  'pages': paginator.num_pages,
@@ -212,16 +243,35 @@ class TaskList(APIViewWithLogger):
                 tasks = Task.objects.filter(
                     project_id__exact=request.keystone_user['project_id']
                 ).order_by("-created_on")
+            tasks = tasks.for_serializing(fields)
+
+            if uses_cursor(request.GET):
+                return self._cursor_page(request, tasks, fields, admin=False)
 
             paginator = Paginator(tasks, tasks_per_page)
             tasks = paginator.page(page)
 
             task_list = []
             for task in tasks:
-                task_list.append(task.to_dict())
+                task_list.append(task.to_dict(fields))
             return Response({'tasks': task_list,
                              'pages': paginator.num_pages}, status=200)
 
+    def _cursor_page(self, request, tasks, fields, admin):
+        try:
+            tasks, cursors = paginate_by_cursor(tasks, request.GET)
+        except ValueError as e:
+            return Response({'errors': [str(e)]}, status=400)
+
+        task_list = []
+        for task in tasks:
+            if admin:
+                task_list.append(task._to_dict(fields))
+            else:
+                task_list.append(task.to_dict(fields))
+        cursors['tasks'] = task_list
+        return Response(cursors, status=200)
+
 
 class TaskDetail(APIViewWithLogger):
 
@@ -230,20 +280,53 @@ class TaskDetail(APIViewWithLogger):
         """
         Dict representation of a Task object
         and its related actions.
+
+        'fields' limits it to the given comma separated fields.
+
+        The action notes are paginated by cursor, newest first, with
+        'notes_limit' and 'notes_cursor', as for the lists.
         """
+        try:
+            fields = parse_fields(request.GET, Task.SERIALIZED_FIELDS)
+        except ValueError as e:
+            return Response({'errors': [str(e)]}, status=400)
+
+        notes_params = {
+            param[len('notes_'):]: value
+            for param, value in request.GET.items()
+            if param in ('notes_limit', 'notes_cursor')}
+        page_notes = (uses_cursor(notes_params) and
+                      (not fields or 'action_notes' in fields))
+        if page_notes:
+            # The page of notes is added after, rather than all of them.
+            fields = [field for field in fields or Task.SERIALIZED_FIELDS
+                      if field != 'action_notes']
+
+        tasks = Task.objects.for_serializing(fields)
         try:
             if 'admin' in request.keystone_user['roles']:
-                task = Task.objects.get(uuid=uuid)
-                return Response(task._to_dict())
+                task = tasks.get(uuid=uuid)
+                task_dict = task._to_dict(fields)
             else:
-                task = Task.objects.get(
+                task = tasks.get(
                     uuid=uuid, project_id=request.keystone_user['project_id'])
-                return Response(task.to_dict())
+                task_dict = task.to_dict(fields)
         except Task.DoesNotExist:
             return Response(
                 {'errors': ['No task with this id.']},
                 status=404)
 
+        if page_notes:
+            try:
+                notes, cursors = paginate_by_cursor(
+                    task.actionnote_set.all(), notes_params)
+            except ValueError as e:
+                return Response({'errors': [str(e)]}, status=400)
+            task_dict['action_notes'] = notes_by_action(reversed(notes))
+            task_dict['action_notes_next'] = cursors['next']
+            task_dict['action_notes_prev'] = cursors['prev']
+        return Response(task_dict)
+
     @utils.admin
     def put(self, request, uuid, format=None):
         """
@@ -376,12 +459,7 @@ class TaskDetail(APIViewWithLogger):
                 status=400)
 
         # we check that the task is valid before approving it:
-        valid = True
-        for action in task.actions:
-            if not action.valid:
-                valid = False
-
-        if not valid:
+        if not task.all_valid:
             return Response(
                 {'errors':
                     ['Cannot approve an invalid task. ' +
@@ -401,9 +479,6 @@ class TaskDetail(APIViewWithLogger):
         task.approved_on = timezone.now()
         task.save()
 
-        need_token = False
-        valid = True
-
         actions = []
 
         for action in task.actions:
@@ -428,13 +503,9 @@ class TaskDetail(APIViewWithLogger):
 
                 return Response(notes, status=500)
 
-            if not action.valid:
-                valid = False
-            if action.need_token:
-                need_token = True
-
-        if valid:
-            if need_token:
+        # Kept up to date by the actions as they save:
+        if task.all_valid:
+            if task.any_need_token:
                 token = create_token(task)
                 try:
                     class_conf = settings.TASK_SETTINGS.get(
@@ -555,15 +626,27 @@ class TokenList(APIViewWithLogger):
     def get(self, request, filters=None, format=None):
         """
         A list of dict representations of Token objects.
+
+        Paginated by cursor if given 'limit' or 'cursor'.
         """
         if filters:
             tokens = Token.objects.filter(**filters).order_by("-created_on")
         else:
             tokens = Token.objects.all().order_by("-created_on")
+        tokens = tokens.with_task()
+
+        response = {}
+        if uses_cursor(request.GET):
+            try:
+                tokens, response = paginate_by_cursor(tokens, request.GET)
+            except ValueError as e:
+                return Response({'errors': [str(e)]}, status=400)
+
         token_list = []
         for token in tokens:
             token_list.append(token.to_dict())
-        return Response({"tokens": token_list})
+        response["tokens"] = token_list
+        return Response(response)
 
     @utils.mod_or_admin
     def post(self, request, format=None):
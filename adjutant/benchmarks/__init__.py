@@ -0,0 +1,68 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmarks for Adjutant.
+
+These are not tests, they don't pass or fail, they measure things so
+changes can be compared. Run them with:
+
+    adjutant-api benchmark [<name> ...]
+
+Each benchmark is a function registered by name that returns a dict
+of results.
+"""
+
+from importlib import import_module
+
+# Modules which register benchmarks when imported:
+BENCHMARK_MODULES = [
+    'adjutant.benchmarks.clients',
+    'adjutant.benchmarks.indexes',
+    'adjutant.benchmarks.listing',
+    'adjutant.benchmarks.micro',
+    'adjutant.benchmarks.workflows',
+]
+
+# Dict of benchmark names and their functions.
+# - This is populated by registering benchmarks.
+BENCHMARKS = {}
+
+
+def register_benchmark(name):
+    def wrapper(func):
+        BENCHMARKS[name] = func
+        return func
+    return wrapper
+
+
+def load_benchmarks():
+    for module in BENCHMARK_MODULES:
+        import_module(module)
+    return BENCHMARKS
+
+
+def run_benchmarks(names=None, **kwargs):
+    """
+    Runs the named benchmarks (or all of them) and returns a dict
+    of benchmark name to results.
+    """
+    benchmarks = load_benchmarks()
+    if not names:
+        names = sorted(benchmarks.keys())
+
+    results = {}
+    for name in names:
+        results[name] = benchmarks[name](**kwargs)
+    return results
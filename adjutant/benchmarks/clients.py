@@ -0,0 +1,72 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+from django.test.utils import override_settings
+
+from adjutant.actions import openstack_clients, user_store
+from adjutant.benchmarks import register_benchmark
+from adjutant.simulator import build_cloud, keystone_settings
+
+# NOTE: Roughly how many times a signup task builds an
+# IdentityManager across pre_approve, post_approve and submit.
+MANAGERS_PER_TASK = 12
+
+
+def _run_tasks(tasks, pooled, keystone):
+    openstack_clients.reset_clients()
+    calls_before = sum(keystone.calls.values())
+    # Hold on to the clients so their ids aren't reused.
+    clients = {}
+    start = time.time()
+    for i in range(tasks):
+        for j in range(MANAGERS_PER_TASK):
+            if not pooled:
+                # What every IdentityManager used to do.
+                openstack_clients.reset_clients()
+            ks_client = user_store.IdentityManager().ks_client
+            clients[id(ks_client)] = ks_client
+    duration = time.time() - start
+    openstack_clients.reset_clients()
+    return {
+        'clients_built': len(clients),
+        'clients_per_task': float(len(clients)) / tasks,
+        'keystone_calls': sum(keystone.calls.values()) - calls_before,
+        'seconds': duration,
+    }
+
+
+@register_benchmark('clients')
+def client_construction(tasks=100, latency=0.0, **kwargs):
+    """
+    Counts how many Keystone clients get built per task, with and
+    without the process wide client cache, against a simulated
+    Keystone with the given latency.
+    """
+    server = build_cloud(latency=latency).start()
+    keystone = server.service('keystone')
+    results = {
+        'tasks': tasks,
+        'managers_per_task': MANAGERS_PER_TASK,
+        'service_latency': latency,
+    }
+    try:
+        with override_settings(KEYSTONE=keystone_settings(server)):
+            for pooled in (False, True):
+                mode = 'pooled' if pooled else 'unpooled'
+                results[mode] = _run_tasks(tasks, pooled, keystone)
+    finally:
+        server.stop()
+    return results
@@ -0,0 +1,111 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Query plans and timings of the hot queries, with and without the
+composite indexes declared in the models' Meta.indexes.
+
+Uses the seeded history from the list_scaling benchmark, so the
+planner sees the same spread of open and finished tasks.
+"""
+
+from django.db import connection
+from django.utils import timezone
+
+from adjutant.actions.models import Action
+from adjutant.api.models import Notification, Task, Token
+from adjutant.benchmarks import register_benchmark
+from adjutant.benchmarks.listing import seed_dataset
+from adjutant.benchmarks.utils import benchmark_database, explain, time_calls
+
+INDEXED_MODELS = [Task, Token, Notification, Action]
+
+
+def _hot_queries():
+    """
+    The queries the composite indexes are for, as the code runs them,
+    against a task still in progress.
+    """
+    task = Task.objects.filter(completed=0, cancelled=0).order_by(
+        '-created_on').only('uuid', 'hash_key', 'project_id').first()
+    return [
+        ('task_duplicates', Task.objects.filter(
+            hash_key=task.hash_key, completed=0, cancelled=0)),
+        ('project_open_invites', Task.objects.filter(
+            project_id=task.project_id, task_type='invite_user',
+            completed=0, cancelled=0).only('uuid')),
+        ('status_last_created', Task.objects.filter(
+            completed=0).order_by('-created_on')[:1]),
+        ('status_last_completed', Task.objects.filter(
+            completed=1).order_by('-completed_on')[:1]),
+        ('status_error_notifications', Notification.objects.filter(
+            error=1, acknowledged=0).order_by('-created_on')),
+        ('task_unexpired_tokens', Token.objects.filter(
+            task=task, expires__gt=timezone.now())),
+        ('task_actions', Action.objects.filter(
+            task=task).order_by('order')),
+        ('tasks_newest_page', Task.objects.order_by(
+            '-created_on', '-uuid')[:25]),
+        ('tasks_pending_approval', Task.objects.filter(
+            state=Task.PENDING_APPROVAL).order_by(
+                '-created_on', '-uuid')[:25]),
+    ]
+
+
+def _set_indexes(add):
+    with connection.schema_editor() as editor:
+        for model in INDEXED_MODELS:
+            for index in model._meta.indexes:
+                if add:
+                    editor.add_index(model, index)
+                else:
+                    editor.remove_index(model, index)
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+
+def _measure(repeats):
+    results = {}
+    for name, queryset in _hot_queries():
+        sql, params = queryset.query.sql_with_params()
+        results[name] = {
+            'plan': explain(sql, params),
+            'seconds': time_calls(
+                lambda: list(queryset.all()), number=repeats, repeat=1),
+        }
+    return results
+
+
+@register_benchmark('indexes')
+def indexes(size=100000, repeats=20, **kwargs):
+    """
+    Seeds a file backed database with 'size' tasks, then times and
+    explains the queries the composite indexes on Task, Token,
+    Notification and Action are for, first with those indexes
+    dropped and then with them in place.
+    """
+    results = {
+        'size': size,
+        'indexes': sorted(
+            index.name for model in INDEXED_MODELS
+            for index in model._meta.indexes),
+    }
+    with benchmark_database():
+        seed_dataset(size)
+        _set_indexes(add=False)
+        results['before'] = _measure(repeats)
+        _set_indexes(add=True)
+        results['after'] = _measure(repeats)
+    return results
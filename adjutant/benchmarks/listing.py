@@ -0,0 +1,323 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+How the admin list endpoints scale with the size of the database.
+
+Seeds a database with a large, deterministic, history of tasks, with
+their actions, notes, tokens and notifications, then times the list
+endpoints with their common filters at each size, along with their
+queries, query plans and memory.
+"""
+
+from collections import deque
+from datetime import timedelta
+import gc
+import hashlib
+import json
+import time
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.test import APIRequestFactory
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from adjutant.actions.models import Action
+from adjutant.api.models import ActionNote, Notification, Task, Token
+from adjutant.api.v1 import views
+from adjutant.api.v1.utils import encode_cursor
+from adjutant.benchmarks import register_benchmark
+from adjutant.benchmarks.utils import (
+    benchmark_database, query_plans, summarize)
+from adjutant.benchmarks.workflows import ADMIN
+
+# Task types, and the actions each has, roughly in the proportions a
+# public cloud sees them.
+TASK_TYPES = [
+    ('signup', ['NewProjectWithUserAction',
+                'NewProjectDefaultNetworkAction',
+                'SetProjectQuotaAction'], 20),
+    ('invite_user', ['NewUserAction'], 30),
+    ('reset_password', ['ResetUserPasswordAction'], 35),
+    ('edit_roles', ['EditUserRolesAction'], 10),
+    ('update_email', ['UpdateUserEmailAction'], 5),
+]
+
+BATCH_SIZE = 2000
+
+# Seconds between seeded tasks, so a million spans about a year.
+TASK_INTERVAL = 30
+
+
+def _bucket(i, salt, size=100):
+    """
+    A deterministic, well spread, number in range(size) for row i.
+    """
+    digest = hashlib.md5(('%s-%s' % (salt, i)).encode('utf-8')).digest()
+    return (ord(digest[0:1]) * 256 + ord(digest[1:2])) % size
+
+
+def _task_type(i):
+    point = _bucket(i, 'type')
+    for task_type, actions, weight in TASK_TYPES:
+        if point < weight:
+            return task_type, actions
+        point -= weight
+    return TASK_TYPES[-1][:2]
+
+
+def _build_task(i, projects, now, total):
+    """
+    Task i of the seeded history, and its actions, notes, tokens and
+    notifications. Older tasks are nearly all finished, the newest
+    are the ones still waiting on approval or a token.
+    """
+    task_type, action_names = _task_type(i)
+    created_on = now - timedelta(seconds=(total - i) * TASK_INTERVAL)
+    recent = total - i < total // 20 + 10
+    state = _bucket(i, 'state')
+    cancelled = state < 5
+    approved = not cancelled and (not recent or state < 60)
+    awaiting_token = approved and recent and state < 30
+    completed = approved and not awaiting_token
+    project_id = 'project-%s' % (i % projects)
+    email = 'user-%s@example.com' % i
+
+    task = Task(
+        uuid='%032x' % i,
+        hash_key=hashlib.sha256(str(i).encode('utf-8')).hexdigest(),
+        ip_address='10.0.%s.%s' % (i // 256 % 256, i % 256),
+        keystone_user={
+            'project_id': project_id, 'user_id': 'user-%s' % i,
+            'username': email, 'roles': ['project_admin', '_member_'],
+            'project_domain_id': 'default', 'user_domain_id': 'default',
+            'authenticated': True},
+        project_id=project_id,
+        task_type=task_type,
+        cancelled=cancelled,
+        approved=approved,
+        completed=completed,
+        created_on=created_on,
+        approved_on=created_on + timedelta(minutes=5) if approved else None,
+        completed_on=(created_on + timedelta(minutes=10)
+                      if completed else None),
+    )
+    task.state = task.current_state()
+    # As the actions below would set them as they save.
+    task.all_valid = True
+    task.any_need_token = awaiting_token or completed
+    if approved:
+        task.approved_by = ADMIN
+
+    actions = [
+        Action(action_name=name, task_id=task.uuid, order=order,
+               valid=True, need_token=awaiting_token or completed,
+               state='complete' if completed else 'default',
+               action_data={'email': email, 'project_id': project_id,
+                            'roles': ['_member_']},
+               created=created_on)
+        for order, name in enumerate(action_names)]
+
+    notes = [
+        ActionNote(task_id=task.uuid, action=name, note=note,
+                   created_on=created_on)
+        for name in action_names
+        for note in ("Action %s checked for task %s." % (name, i),
+                     "Existing user %s with matching email." % email)]
+
+    tokens = []
+    if awaiting_token:
+        tokens.append(Token(
+            task_id=task.uuid, token='%032x' % i, created_on=created_on,
+            expires=created_on + timedelta(hours=24)))
+
+    notifications = []
+    if task_type == 'signup' or _bucket(i, 'error') < 2:
+        error = _bucket(i, 'error') < 2
+        notifications.append(Notification(
+            uuid='%032x' % i, task_id=task.uuid, error=error,
+            acknowledged=not recent, created_on=created_on,
+            notes={'notes': [
+                "Task %s needs attention." % task.uuid if error else
+                "New task for approval: %s" % task_type]}))
+
+    return task, actions, notes, tokens, notifications
+
+
+def seed_dataset(total, projects=1000, now=None):
+    """
+    Seeds an empty database with 'total' tasks spread over 'projects'
+    projects, ending at 'now'.
+    """
+    now = now or timezone.now()
+    for start in range(0, total, BATCH_SIZE):
+        tasks, actions, notes, tokens, notifications = [], [], [], [], []
+        for i in range(start, min(start + BATCH_SIZE, total)):
+            (task, task_actions, task_notes, task_tokens,
+             task_notifications) = _build_task(i, projects, now, total)
+            tasks.append(task)
+            actions.extend(task_actions)
+            notes.extend(task_notes)
+            tokens.extend(task_tokens)
+            notifications.extend(task_notifications)
+        with transaction.atomic():
+            Task.objects.bulk_create(tasks)
+            Action.objects.bulk_create(actions)
+            ActionNote.objects.bulk_create(notes)
+            Token.objects.bulk_create(tokens)
+            Notification.objects.bulk_create(notifications)
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+
+def _cases(total, full_list_limit):
+    """
+    Name, view and query parameters for each endpoint and its common
+    filters, leaving out those listing a whole table above
+    full_list_limit tasks.
+    """
+    def filters(**fields):
+        return {'filters': json.dumps(
+            {field: {'exact': value} for field, value in fields.items()})}
+
+    token_task = Token.objects.order_by('-created_on').values_list(
+        'task_id', flat=True).first()
+    notification_task = Notification.objects.order_by(
+        '-created_on').values_list('task_id', flat=True).first()
+    expired = json.dumps({'expires': {'lt': timezone.now().isoformat()}})
+    deep_page = max(total // 25 // 2, 1)
+    # The same page as deep_page, by cursor.
+    deep_cursor = encode_cursor('next', Task.objects.order_by(
+        '-created_on', '-pk')[max((deep_page - 1) * 25 - 1, 0)])
+    cases = [
+        ('tasks.page_1', views.TaskList,
+         {'tasks_per_page': 25, 'page': 1}, False),
+        ('tasks.deep_page', views.TaskList,
+         {'tasks_per_page': 25, 'page': deep_page}, False),
+        ('tasks.cursor_first', views.TaskList, {'limit': 25}, False),
+        ('tasks.cursor_deep', views.TaskList,
+         {'limit': 25, 'cursor': deep_cursor}, False),
+        ('tasks.pending_approval', views.TaskList,
+         dict(filters(approved=False, cancelled=False), tasks_per_page=25),
+         False),
+        ('tasks.awaiting_token', views.TaskList,
+         dict(filters(approved=True, completed=False, cancelled=False),
+              tasks_per_page=25), False),
+        ('tasks.state_pending_approval', views.TaskList,
+         dict(filters(state=Task.PENDING_APPROVAL), tasks_per_page=25),
+         False),
+        ('tasks.state_awaiting_token', views.TaskList,
+         dict(filters(state=Task.AWAITING_TOKEN), tasks_per_page=25),
+         False),
+        ('tasks.by_type', views.TaskList,
+         dict(filters(task_type='signup'), tasks_per_page=25), False),
+        ('tasks.by_project', views.TaskList,
+         filters(project_id='project-1'), False),
+        ('tokens.all', views.TokenList, {}, True),
+        ('tokens.by_task', views.TokenList, filters(task=token_task),
+         False),
+        ('tokens.expired', views.TokenList, {'filters': expired}, False),
+        ('notifications.all', views.NotificationList, {}, True),
+        ('notifications.unacknowledged_errors', views.NotificationList,
+         filters(error=True, acknowledged=False), False),
+        ('notifications.by_task', views.NotificationList,
+         filters(task=notification_task), False),
+        ('status', views.StatusView, {}, False),
+    ]
+    return [(name, view, params) for name, view, params, full in cases
+            if not full or total <= full_list_limit]
+
+
+def _measure(view, params, repeats):
+    factory = APIRequestFactory()
+    view = view.as_view()
+
+    def call():
+        request = factory.get('/v1/', params)
+        request.keystone_user = dict(ADMIN)
+        response = view(request)
+        response.render()
+        return response
+
+    # Django caps the query log, which would cap the count of an N+1.
+    queries_log = connection.queries_log
+    connection.queries_log = deque()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            response = call()
+        result = {
+            'status': response.status_code,
+            'response_bytes': len(response.content),
+            'queries': len(queries),
+            'query_plans': query_plans(queries),
+        }
+    finally:
+        connection.queries_log = queries_log
+
+    if tracemalloc:
+        gc.collect()
+        tracemalloc.start()
+        call()
+        result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    durations = []
+    for i in range(repeats):
+        start = time.time()
+        call()
+        durations.append(time.time() - start)
+    result['latency'] = summarize(durations)
+    return result
+
+
+@register_benchmark('list_scaling')
+def list_scaling(sizes=(10000,), repeats=5, full_list_limit=100000,
+                 **kwargs):
+    """
+    For each size, in tasks, seeds a new file backed database and
+    times TaskList, TokenList, NotificationList and StatusView with
+    their common filters.
+
+    Each case reports its latency, queries, the plans of its first
+    few distinct queries, response size and peak Python memory.
+    Listing every token or notification is skipped above
+    full_list_limit tasks, as those lists are unbounded.
+    """
+    results = {'repeats': repeats, 'sizes': {}}
+    for total in sorted(sizes):
+        with benchmark_database():
+            start = time.time()
+            seed_dataset(total)
+            size_results = {
+                'seed_seconds': time.time() - start,
+                'rows': {
+                    'tasks': Task.objects.count(),
+                    'actions': Action.objects.count(),
+                    'action_notes': ActionNote.objects.count(),
+                    'tokens': Token.objects.count(),
+                    'notifications': Notification.objects.count(),
+                },
+                'cases': {},
+            }
+            for name, view, params in _cases(total, full_list_limit):
+                size_results['cases'][name] = _measure(view, params, repeats)
+        results['sizes'][str(total)] = size_results
+    return results
@@ -0,0 +1,251 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Load generator for a running Adjutant, used by 'adjutant-api loadtest'.
+
+Worker threads run a weighted mix of workflows, each a chain of API
+calls, as fast as they can for a set duration. Every call is
+recorded, so latency and errors can be reported per call type and
+per time window.
+"""
+
+from collections import defaultdict
+import json
+import random
+import threading
+import time
+from uuid import uuid4
+
+import requests
+
+from adjutant.benchmarks.utils import summarize
+
+WORKFLOWS = ['signup', 'invite', 'reset_password']
+
+
+def parse_mix(mix):
+    """
+    Parses 'signup=5,invite=1' into a dict of workflow weights.
+    """
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in WORKFLOWS:
+            raise ValueError(
+                "Unknown workflow '%s', must be one of: %s" %
+                (name, ", ".join(WORKFLOWS)))
+        try:
+            weights[name] = float(weight or 1)
+        except ValueError:
+            raise ValueError("Bad weight for workflow '%s'." % name)
+        if not weights[name] >= 0:
+            raise ValueError("Bad weight for workflow '%s'." % name)
+    if not any(weights.values()):
+        raise ValueError("At least one workflow needs a weight above 0.")
+    return weights
+
+
+class Call(object):
+    __slots__ = ['name', 'started', 'duration', 'status', 'ok']
+
+    def __init__(self, name, started, duration, status, ok):
+        self.name = name
+        self.started = started
+        self.duration = duration
+        self.status = status
+        self.ok = ok
+
+
+class LoadGenerator(object):
+    """
+    Runs 'mix' (workflow name to weight) against the Adjutant at 'url'
+    with 'concurrency' threads for 'duration' seconds.
+
+    'headers' are sent with every call, and need to make the caller an
+    admin, as approving tasks and finding their tokens is admin only.
+    Behind keystonemiddleware that means an admin's X-Auth-Token.
+
+    Password resets pick from 'reset_emails', which must be users
+    that exist.
+    """
+
+    def __init__(self, url, mix, concurrency=10, duration=60,
+                 headers=None, reset_emails=(), timeout=30, seed=None):
+        self.url = url.rstrip('/')
+        self.mix = mix
+        self.concurrency = concurrency
+        self.duration = duration
+        self.headers = headers or {}
+        self.reset_emails = list(reset_emails)
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.run_id = uuid4().hex[:8]
+        self.counter = 0
+        self.lock = threading.Lock()
+        self.calls = []
+        self.started = None
+        self.stop_at = None
+
+        if 'reset_password' in mix and not self.reset_emails:
+            raise ValueError(
+                "The reset_password workflow needs emails to reset.")
+
+    def _next(self):
+        with self.lock:
+            self.counter += 1
+            name = self._weighted(sorted(self.mix))
+            email = (self.random.choice(self.reset_emails)
+                     if self.reset_emails else None)
+            return name, self.counter, email
+
+    def _weighted(self, names):
+        point = self.random.uniform(0, sum(self.mix[n] for n in names))
+        for name in names:
+            point -= self.mix[name]
+            if point <= 0:
+                return name
+        return names[-1]
+
+    def _call(self, session, name, method, path, data=None, params=None):
+        started = time.time()
+        status = None
+        body = None
+        try:
+            response = session.request(
+                method, self.url + path, json=data, params=params,
+                headers=self.headers, timeout=self.timeout)
+            status = response.status_code
+            try:
+                body = response.json()
+            except ValueError:
+                body = None
+        except requests.RequestException:
+            pass
+        ok = status is not None and status < 400
+        with self.lock:
+            self.calls.append(
+                Call(name, started, time.time() - started, status, ok))
+        return body if ok else None
+
+    def _submit_token(self, session, task):
+        body = self._call(
+            session, 'lookup_token', 'GET', '/v1/tokens',
+            params={'filters': json.dumps({'task': {'exact': task}})})
+        if not body or not body.get('tokens'):
+            return
+        token = body['tokens'][0]['token']
+        self._call(session, 'submit_token', 'POST', '/v1/tokens/' + token,
+                   {'password': 'load-test-%s' % self.run_id})
+
+    def signup(self, session, n, email):
+        name = 'load-%s-%s' % (self.run_id, n)
+        body = self._call(session, 'signup', 'POST', '/v1/openstack/sign-up',
+                          {'project_name': name,
+                           'email': '%s@example.com' % name})
+        if body and body.get('task'):
+            if self._call(session, 'approve', 'POST',
+                          '/v1/tasks/' + body['task'], {'approved': True}):
+                self._submit_token(session, body['task'])
+
+    def invite(self, session, n, email):
+        body = self._call(session, 'invite', 'POST', '/v1/openstack/users',
+                          {'email': 'load-%s-%s@example.com' % (
+                              self.run_id, n),
+                           'roles': ['_member_']})
+        if body and body.get('task'):
+            self._submit_token(session, body['task'])
+
+    def reset_password(self, session, n, email):
+        body = self._call(session, 'reset_password', 'POST',
+                          '/v1/openstack/users/password-reset',
+                          {'email': email})
+        if body and body.get('task'):
+            self._submit_token(session, body['task'])
+
+    def _work(self):
+        session = requests.Session()
+        while time.time() < self.stop_at:
+            name, n, email = self._next()
+            getattr(self, name)(session, n, email)
+
+    def run(self, interval=None, report=None):
+        """
+        Runs the load, calling report(window) every interval seconds
+        with the stats of the calls started in that window.
+        """
+        self.started = time.time()
+        self.stop_at = self.started + self.duration
+        workers = [threading.Thread(target=self._work)
+                   for i in range(self.concurrency)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        window_start = self.started
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=0.1)
+            if interval and report and time.time() - window_start >= interval:
+                report(self.window(window_start, time.time()))
+                window_start = time.time()
+        if interval and report:
+            report(self.window(window_start, time.time()))
+        return self.summary()
+
+    def _stats(self, calls, seconds):
+        by_name = defaultdict(list)
+        for call in calls:
+            by_name[call.name].append(call)
+
+        def stats(calls):
+            errors = [call for call in calls if not call.ok]
+            statuses = defaultdict(int)
+            for call in errors:
+                statuses[str(call.status or 'no response')] += 1
+            result = summarize([call.duration for call in calls])
+            result.update({
+                'per_second': len(calls) / seconds if seconds else None,
+                'errors': len(errors),
+                'error_rate': (float(len(errors)) / len(calls)
+                               if calls else None),
+                'error_statuses': dict(statuses),
+            })
+            return result
+
+        results = {'all': stats(calls)}
+        for name, name_calls in by_name.items():
+            results[name] = stats(name_calls)
+        return results
+
+    def window(self, start, end):
+        with self.lock:
+            calls = [call for call in self.calls
+                     if start <= call.started < end]
+        window = self._stats(calls, end - start)
+        window['elapsed'] = end - self.started
+        return window
+
+    def summary(self):
+        with self.lock:
+            calls = list(self.calls)
+        duration = time.time() - self.started
+        return {
+            'url': self.url,
+            'mix': self.mix,
+            'concurrency': self.concurrency,
+            'duration': duration,
+            'calls': self._stats(calls, duration),
+        }
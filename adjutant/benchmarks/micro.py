@@ -0,0 +1,283 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Micro-benchmarks of the helpers every request goes through.
+
+The inputs are fixed corpora defined here, rather than the deployed
+config or database, so results can be compared between commits and
+machines.
+"""
+
+from datetime import timedelta
+import json
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from adjutant.actions.models import Action
+from adjutant.api import utils as api_utils
+from adjutant.api.models import Task, Token
+from adjutant.api.v1.utils import create_task_hash, parse_filters
+from adjutant.benchmarks import register_benchmark
+from adjutant.benchmarks.utils import benchmark_database, time_calls
+from adjutant.utils import dict_merge, setup_task_settings
+
+
+class _Serializer(object):
+    def __init__(self, validated_data):
+        self.validated_data = validated_data
+
+
+class _Request(object):
+    def __init__(self, keystone_user, filters=None):
+        self.keystone_user = keystone_user
+        self.query_params = {}
+        if filters is not None:
+            self.query_params['filters'] = filters
+
+
+def _keystone_user(roles):
+    return {
+        'authenticated': True,
+        'project_id': 'project_id',
+        'roles': roles,
+        'user_id': 'user_id',
+        'username': 'test@example.com',
+    }
+
+
+# create_task_hash: lists of actions as the TaskViews build them.
+TASK_HASH_CORPUS = {
+    'signup': ('signup', [
+        {'name': 'NewProjectWithUserAction', 'serializer': _Serializer({
+            'project_name': 'a_project', 'email': 'test@example.com',
+            'username': 'test@example.com', 'domain_id': 'default',
+            'parent_id': None})},
+        {'name': 'NewProjectDefaultNetworkAction', 'serializer': _Serializer({
+            'setup_network': True, 'region': 'RegionOne'})},
+        {'name': 'SetProjectQuotaAction', 'serializer': None},
+    ]),
+    'invite': ('invite_user', [
+        {'name': 'NewUserAction', 'serializer': _Serializer({
+            'email': 'test@example.com', 'username': 'test@example.com',
+            'project_id': 'project_id', 'domain_id': 'default',
+            'roles': ['_member_', 'project_mod', 'heat_stack_owner']})},
+    ]),
+    'edit_many_roles': ('edit_roles', [
+        {'name': 'EditUserRolesAction', 'serializer': _Serializer({
+            'user_id': 'user_id', 'project_id': 'project_id',
+            'domain_id': 'default', 'remove': False,
+            'roles': ['role_%s' % i for i in range(50)]})},
+    ]),
+}
+
+# parse_filters: the 'filters' query parameter as clients send it.
+FILTERS_CORPUS = {
+    'none': None,
+    'one_field': json.dumps({'task_type': {'exact': 'signup'}}),
+    'many_fields': json.dumps({
+        'task_type': {'exact': 'signup'},
+        'project_id': {'exact': 'project_id'},
+        'approved': {'exact': False},
+        'cancelled': {'exact': False},
+        'created_on': {'gte': '2017-01-01', 'lt': '2017-02-01'},
+        'keystone_user__username': {'icontains': 'example.com'},
+    }),
+    'malformed': '{"task_type": "signup"',
+}
+
+# require_roles: who is calling.
+ROLES_CORPUS = {
+    'admin': _keystone_user(['admin', '_member_']),
+    'project_mod': _keystone_user(['project_mod', '_member_']),
+    'member': _keystone_user(['_member_']),
+    'unauthenticated': {},
+}
+
+
+def _emails(prefix):
+    return {
+        stage: {
+            'subject': '%s %s' % (prefix, stage),
+            'reply': 'no-reply@example.com',
+            'from': 'bounce+%(task_uuid)s@example.com',
+            'template': '%s.txt' % stage,
+        } for stage in ('initial', 'token', 'completed')
+    }
+
+
+# dict_merge and setup_task_settings: shaped like conf/conf.yaml.
+DEFAULT_TASK_SETTINGS = {
+    'emails': _emails('Default'),
+    'notifications': {
+        'EmailNotification': {
+            'standard': {'emails': ['example@example.com'],
+                         'reply': 'no-reply@example.com',
+                         'template': 'notification.txt'},
+            'error': {'emails': ['errors@example.com'],
+                      'reply': 'no-reply@example.com',
+                      'template': 'notification.txt'},
+        },
+    },
+}
+
+DEFAULT_ACTION_SETTINGS = {
+    'NewProjectDefaultNetworkAction': {
+        'RegionOne': {
+            'DNS_NAMESERVERS': ['193.168.1.2', '193.168.1.3'],
+            'SUBNET_CIDR': '192.168.1.0/24',
+            'network_name': 'somenetwork',
+            'public_network': '3cb50f61-5bce-4c03-96e6-8e262e12bb35',
+            'router_name': 'somerouter',
+            'subnet_name': 'somesubnet',
+        },
+    },
+    'NewUserAction': {'allowed_roles': ['project_mod', '_member_']},
+    'ResetUserPasswordAction': {
+        'blacklisted_roles': ['admin'],
+    },
+    'SetProjectQuotaAction': {
+        'regions': {'RegionOne': {'quota_size': 'small'}},
+    },
+    'SendAdditionalEmailAction': {
+        stage: {'email_current_user': False, 'subject': stage,
+                'template': '%s.txt' % stage}
+        for stage in ('initial', 'token', 'completed')
+    },
+}
+
+TASK_SETTINGS = dict(
+    ('task_type_%s' % i, {
+        'emails': _emails('Task %s' % i),
+        'notifications': {
+            'EmailNotification': {
+                'standard': {'emails': ['task-%s@example.com' % i]}},
+        },
+        'action_settings': {
+            'NewUserAction': {'allowed_roles': ['role_%s' % i]},
+        },
+        'duplicate_policy': 'cancel',
+    }) for i in range(20)
+)
+
+
+def _undecorated(self, request, filters=None):
+    return filters
+
+
+_filtered = parse_filters(_undecorated)
+_admin = api_utils.admin(_undecorated)
+_mod_or_admin = api_utils.mod_or_admin(_undecorated)
+# What TaskList.get and TokenList.get stack up.
+_admin_filtered = api_utils.admin(parse_filters(_undecorated))
+
+
+def _create_objects():
+    task = Task.objects.create(
+        ip_address='0.0.0.0', keystone_user=ROLES_CORPUS['project_mod'],
+        project_id='project_id', task_type='invite_user')
+    task.add_action_note('NewUserAction', 'Existing user with matching email.')
+    task.flush_action_notes()
+    for order, (name, data) in enumerate([
+            ('NewUserAction', {'email': 'test@example.com',
+                               'roles': ['_member_']}),
+            ('SendAdditionalEmailAction', {}),
+            ('UpdateUserEmailAction', {'new_email': 'new@example.com'})]):
+        Action.objects.create(
+            action_name=name, action_data=data, task=task, order=order,
+            valid=True)
+    token = Token.objects.create(
+        task=task, token='a' * 32,
+        expires=timezone.now() + timedelta(hours=24))
+    return task, token
+
+
+def _time_queries(func, number):
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    result = time_calls(func, number=number)
+    result['queries_per_call'] = len(queries)
+    return result
+
+
+@register_benchmark('micro')
+def micro(number=1000, **kwargs):
+    """
+    Times, per call, the helpers every task or request goes through,
+    over the fixed corpora above:
+
+    - create_task_hash, for each action list.
+    - parse_filters, for each filters parameter.
+    - require_roles, through the admin and mod_or_admin decorators,
+      for each caller, against the undecorated function.
+    - dict_merge and setup_task_settings, over the example settings.
+    - Task._to_dict and Token.to_dict, against a fresh database, with
+      their queries, against just loading the object.
+    """
+    results = {'number': number}
+
+    results['create_task_hash'] = {
+        name: time_calls(
+            lambda: create_task_hash(*TASK_HASH_CORPUS[name]), number)
+        for name in TASK_HASH_CORPUS}
+
+    results['parse_filters'] = {
+        name: time_calls(
+            lambda: _filtered(None, _Request({}, FILTERS_CORPUS[name])),
+            number)
+        for name in FILTERS_CORPUS}
+
+    roles = {'undecorated': time_calls(
+        lambda: _undecorated(None, _Request(ROLES_CORPUS['admin'])),
+        number)}
+    for name in ROLES_CORPUS:
+        roles['admin.%s' % name] = time_calls(
+            lambda: _admin(None, _Request(ROLES_CORPUS[name])), number)
+        roles['mod_or_admin.%s' % name] = time_calls(
+            lambda: _mod_or_admin(None, _Request(ROLES_CORPUS[name])),
+            number)
+    roles['admin_with_filters'] = time_calls(
+        lambda: _admin_filtered(None, _Request(
+            ROLES_CORPUS['admin'], FILTERS_CORPUS['one_field'])),
+        number)
+    results['require_roles'] = roles
+
+    results['dict_merge'] = time_calls(
+        lambda: dict_merge(DEFAULT_TASK_SETTINGS,
+                           TASK_SETTINGS['task_type_0']), number)
+    results['setup_task_settings'] = time_calls(
+        lambda: setup_task_settings(
+            DEFAULT_TASK_SETTINGS, DEFAULT_ACTION_SETTINGS, TASK_SETTINGS),
+        max(number // 100, 1))
+
+    with benchmark_database():
+        task, token = _create_objects()
+        model_number = max(number // 10, 1)
+        results['task_to_dict'] = {
+            'load': _time_queries(
+                lambda: Task.objects.get(uuid=task.uuid), model_number),
+            'load_and_to_dict': _time_queries(
+                lambda: Task.objects.get(uuid=task.uuid)._to_dict(),
+                model_number),
+        }
+        results['token_to_dict'] = {
+            'load': _time_queries(
+                lambda: Token.objects.get(token=token.token), model_number),
+            'load_and_to_dict': _time_queries(
+                lambda: Token.objects.get(token=token.token).to_dict(),
+                model_number),
+        }
+    return results
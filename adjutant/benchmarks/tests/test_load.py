@@ -0,0 +1,101 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+
+from adjutant.benchmarks.load import Call, LoadGenerator, parse_mix
+
+
+class ParseMixTests(TestCase):
+
+    def test_parse_mix(self):
+        """
+        Weights default to 1, and spaces around names are ignored.
+        """
+        self.assertEqual(
+            parse_mix('signup=5, invite'), {'signup': 5.0, 'invite': 1.0})
+        self.assertEqual(
+            parse_mix('reset_password=0.5,signup=0'),
+            {'reset_password': 0.5, 'signup': 0.0})
+
+    def test_bad_mix(self):
+        for mix in ['', 'signup=1,delete_everything=1', 'signup=lots',
+                    'signup=-1', 'signup=nan', 'signup=0,invite=0']:
+            with self.assertRaises(ValueError):
+                parse_mix(mix)
+
+    def test_bad_mix_command(self):
+        """
+        Bad options are reported before any load is started.
+        """
+        for options in [{'mix': 'signup=1,bogus=1'},
+                        {'mix': 'reset_password=1'},
+                        {'header': ['no value']}]:
+            with self.assertRaises(CommandError):
+                call_command('loadtest', 'http://localhost:1', **options)
+
+
+class LoadGeneratorTests(TestCase):
+
+    def test_weighted(self):
+        """
+        Workflows are picked in proportion to their weights, and never
+        if their weight is 0.
+        """
+        mix = {'signup': 3, 'invite': 1, 'reset_password': 0}
+        generator = LoadGenerator(
+            'http://localhost', mix, reset_emails=['test@example.com'],
+            seed=1)
+
+        picks = [generator._next()[0] for i in range(4000)]
+
+        self.assertEqual(picks.count('reset_password'), 0)
+        self.assertAlmostEqual(
+            picks.count('signup') / 4000.0, 0.75, delta=0.03)
+        self.assertEqual(generator.counter, 4000)
+
+    def test_stats(self):
+        """
+        Latency and errors are reported overall and per call, for the
+        calls started in each window.
+        """
+        generator = LoadGenerator('http://localhost', {'signup': 1})
+        generator.started = 100.0
+        generator.calls = [
+            Call('signup', 100.0, 0.1, 200, True),
+            Call('signup', 100.5, 0.3, 500, False),
+            Call('approve', 101.0, 0.2, 200, True),
+            Call('approve', 101.5, 0.4, None, False),
+            Call('signup', 102.0, 0.5, 200, True),
+        ]
+
+        window = generator.window(100.0, 102.0)
+
+        self.assertEqual(window['elapsed'], 2.0)
+        self.assertEqual(window['all']['count'], 4)
+        self.assertEqual(window['all']['per_second'], 2.0)
+        self.assertEqual(window['all']['errors'], 2)
+        self.assertEqual(window['all']['error_rate'], 0.5)
+        self.assertEqual(window['all']['p50'], 0.2)
+        self.assertEqual(window['all']['p99'], 0.4)
+        self.assertEqual(
+            window['signup']['error_statuses'], {'500': 1})
+        self.assertEqual(
+            window['approve']['error_statuses'], {'no response': 1})
+
+        empty = generator.window(200.0, 201.0)
+        self.assertEqual(empty['all']['count'], 0)
+        self.assertIsNone(empty['all']['error_rate'])
+        self.assertIsNone(empty['all']['p50'])
@@ -0,0 +1,78 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from django.test import TestCase
+
+from adjutant.api.models import Task
+from adjutant.benchmarks.utils import percentile, StageRecorder, summarize
+from adjutant.simulator import KeystoneService
+
+
+class PercentileTests(TestCase):
+
+    def test_percentile(self):
+        """
+        Nearest rank percentiles, of the values in any order.
+        """
+        values = [5, 1, 4, 2, 3, 6, 8, 7, 10, 9]
+        self.assertEqual(percentile(values, 50), 5)
+        self.assertEqual(percentile(values, 95), 10)
+        self.assertEqual(percentile(values, 100), 10)
+        self.assertEqual(percentile(values, 10), 1)
+        self.assertEqual(percentile(values, 11), 2)
+        self.assertEqual(percentile(values, 0), 1)
+
+    def test_percentile_edges(self):
+        self.assertIsNone(percentile([], 50))
+        for percent in [0, 50, 99, 100]:
+            self.assertEqual(percentile([0.3], percent), 0.3)
+
+    def test_summarize(self):
+        self.assertEqual(summarize([0.4, 0.1, 0.2, 0.3]), {
+            'count': 4, 'mean': 0.25, 'p50': 0.2, 'p95': 0.4, 'p99': 0.4})
+        self.assertEqual(summarize([]), {
+            'count': 0, 'mean': None, 'p50': None, 'p95': None,
+            'p99': None})
+
+
+class StageRecorderTests(TestCase):
+
+    def test_stages(self):
+        """
+        Each run of a stage records its queries, external calls and
+        whether it failed.
+        """
+        keystone = KeystoneService()
+        recorder = StageRecorder([keystone])
+
+        with recorder.stage('create') as result:
+            Task.objects.create(ip_address="0.0.0.0", keystone_user={})
+            keystone.calls['find_user'] += 2
+        with recorder.stage('create') as result:
+            keystone.calls['find_user'] += 1
+            result['ok'] = False
+        with self.assertRaises(ValueError):
+            with recorder.stage('fail'):
+                raise ValueError()
+
+        results = recorder.results()
+        self.assertEqual(results['create']['latency']['count'], 2)
+        self.assertEqual(results['create']['errors'], 1)
+        self.assertEqual(results['create']['queries_per_run'], 0.5)
+        self.assertEqual(results['create']['max_queries'], 1)
+        self.assertEqual(
+            results['create']['external_calls_per_run'], {'keystone': 1.5})
+        self.assertEqual(results['fail']['errors'], 1)
+        self.assertEqual(
+            results['fail']['external_calls_per_run'], {'keystone': 0})
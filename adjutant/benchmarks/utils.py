@@ -0,0 +1,189 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from collections import defaultdict
+from contextlib import contextmanager
+import math
+import os
+import shutil
+import tempfile
+import time
+import timeit
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def percentile(values, percent):
+    """
+    The nearest rank percentile of the given values, or None if
+    there are none.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def summarize(durations):
+    """
+    Count, mean and p50/p95/p99 of a list of durations in seconds.
+    """
+    return {
+        'count': len(durations),
+        'mean': sum(durations) / len(durations) if durations else None,
+        'p50': percentile(durations, 50),
+        'p95': percentile(durations, 95),
+        'p99': percentile(durations, 99),
+    }
+
+
+def time_calls(func, number=1000, repeat=5):
+    """
+    Calls func() number times, repeat times over, and returns the
+    best and mean seconds per call across the repeats, timeit style.
+    """
+    per_call = []
+    for i in range(repeat):
+        start = timeit.default_timer()
+        for j in range(number):
+            func()
+        per_call.append((timeit.default_timer() - start) / number)
+    return {
+        'calls': number * repeat,
+        'best': min(per_call),
+        'mean': sum(per_call) / len(per_call),
+    }
+
+
+def explain(sql, params=None):
+    """
+    The database's query plan for the given SQL, as a list of lines.
+    """
+    if connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif connection.vendor == 'postgresql':
+        prefix = 'EXPLAIN ANALYZE '
+    else:
+        prefix = 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        rows = cursor.fetchall()
+    if connection.vendor == 'sqlite':
+        # id, parent, notused, detail
+        return [row[-1] for row in rows]
+    return [' | '.join(str(column) for column in row) for row in rows]
+
+
+def query_plans(queries, limit=5):
+    """
+    The plans of the first 'limit' distinct queries captured by a
+    CaptureQueriesContext.
+    """
+    plans = []
+    seen = set()
+    for query in queries.captured_queries:
+        sql = query['sql']
+        if sql in seen or not sql.upper().startswith('SELECT'):
+            continue
+        seen.add(sql)
+        plans.append({'sql': sql, 'plan': explain(sql)})
+        if len(plans) >= limit:
+            break
+    return plans
+
+
+@contextmanager
+def benchmark_database():
+    """
+    Runs the enclosed code against a new, migrated, test database,
+    which is dropped afterwards.
+
+    For sqlite this is a file in a temporary directory rather than
+    in memory, so queries pay for disk the way a deployment would.
+    """
+    directory = tempfile.mkdtemp()
+    if connection.vendor == 'sqlite':
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = (
+            os.path.join(directory, 'benchmark.sqlite3'))
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class StageRecorder(object):
+    """
+    Records the duration, database queries and external calls of
+    each run of named stages, and whether the stage worked.
+
+    External calls are counted from the services of a simulator.
+    """
+
+    def __init__(self, services=()):
+        self.services = services
+        self.durations = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.calls = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def _count_calls(self):
+        return {service.name: sum(service.calls.values())
+                for service in self.services}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the enclosed code as a run of the named stage. Set
+        'ok' on the yielded dict to False if the stage failed.
+        """
+        result = {'ok': True}
+        calls_before = self._count_calls()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            try:
+                yield result
+            except Exception:
+                result['ok'] = False
+                raise
+            finally:
+                self.durations[name].append(time.time() - start)
+                self.queries[name].append(len(queries))
+                calls_after = self._count_calls()
+                self.calls[name].append({
+                    service: calls_after[service] - calls_before[service]
+                    for service in calls_after})
+                if not result['ok']:
+                    self.errors[name] += 1
+
+    def results(self):
+        results = {}
+        for name, durations in self.durations.items():
+            stage_calls = self.calls[name]
+            results[name] = {
+                'latency': summarize(durations),
+                'errors': self.errors[name],
+                'queries_per_run': (
+                    float(sum(self.queries[name])) / len(durations)),
+                'max_queries': max(self.queries[name]),
+                'external_calls_per_run': {
+                    service: float(sum(c[service] for c in stage_calls)) /
+                    len(stage_calls)
+                    for service in stage_calls[0]},
+            }
+        return results
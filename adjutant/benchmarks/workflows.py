@@ -0,0 +1,198 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+from django.core import mail
+from django.test.utils import override_settings
+
+from rest_framework.test import APIRequestFactory
+
+from adjutant.actions import openstack_clients, user_store
+from adjutant.api.models import Task, Token
+from adjutant.api.v1 import openstack, views
+from adjutant.benchmarks import register_benchmark
+from adjutant.benchmarks.utils import benchmark_database, StageRecorder
+from adjutant.simulator import build_cloud, keystone_settings
+
+ADMIN = {
+    'project_domain_id': 'default',
+    'project_name': 'admin',
+    'project_id': 'admin_project_id',
+    'roles': ['admin', '_member_'],
+    'user_domain_id': 'default',
+    'username': 'admin',
+    'user_id': 'admin_user_id',
+    'authenticated': True,
+}
+
+
+def _reset_caches():
+    openstack_clients.reset_clients()
+    openstack_clients.reset_breakers()
+    user_store.role_catalog.clear()
+    user_store.project_cache.clear()
+    user_store.domain_cache.clear()
+    user_store.region_cache.clear()
+
+
+class WorkflowRunner(object):
+    """
+    Drives tasks through their whole lifecycle by calling the views,
+    the way the API would, recording each step as a stage.
+
+    Each workflow returns True if it got to the end.
+    """
+
+    def __init__(self, keystone, recorder):
+        self.keystone = keystone
+        self.recorder = recorder
+        self.factory = APIRequestFactory()
+        self.signup_view = openstack.SignUp.as_view()
+        self.invite_view = openstack.UserList.as_view()
+        self.reset_view = openstack.UserResetPassword.as_view()
+        self.roles_view = openstack.UserRoles.as_view()
+        self.task_view = views.TaskDetail.as_view()
+        self.token_view = views.TokenDetail.as_view()
+
+        # A project admin, and a plain member, for each seeded project.
+        self.projects = []
+        for project in sorted(keystone.projects.values(),
+                              key=lambda p: p['name']):
+            members = sorted(
+                (keystone.users[user_id] for user_id in set(
+                    user_id for user_id, project_id, role
+                    in keystone.assignments if project_id == project['id'])),
+                key=lambda u: u['name'])
+            if len(members) < 2:
+                continue
+            admin, member = members[0], members[1]
+            keystone.add_assignment(
+                admin['id'], project['id'], 'project_admin')
+            self.projects.append((project, admin, member))
+
+    def _call(self, stage, view, data, keystone_user=None, method='post',
+              **kwargs):
+        request = getattr(self.factory, method)(
+            '/v1/', data, format='json')
+        request.keystone_user = keystone_user or {}
+        with self.recorder.stage(stage) as result:
+            response = view(request, **kwargs)
+            result['ok'] = 200 <= response.status_code < 300
+        return result['ok']
+
+    def _submit_token(self, stage, task, data):
+        token = Token.objects.filter(task=task).first()
+        if not token:
+            return False
+        return self._call(stage, self.token_view, data, id=token.token)
+
+    def _project_admin(self, i):
+        project, admin, member = self.projects[i % len(self.projects)]
+        keystone_user = {
+            'project_domain_id': 'default',
+            'project_name': project['name'],
+            'project_id': project['id'],
+            'roles': ['project_admin', '_member_'],
+            'user_domain_id': 'default',
+            'username': admin['name'],
+            'user_id': admin['id'],
+            'authenticated': True,
+        }
+        return keystone_user, member
+
+    def signup(self, i):
+        ok = self._call('signup.create', self.signup_view, {
+            'project_name': 'signup-%s' % i,
+            'email': 'signup-%s@example.com' % i})
+        task = Task.objects.filter(task_type='signup').order_by(
+            '-created_on').first()
+        ok = ok and self._call(
+            'signup.approve', self.task_view, {'approved': True}, ADMIN,
+            uuid=task.uuid)
+        return ok and self._submit_token(
+            'signup.submit', task, {'password': 'password'})
+
+    def invite(self, i):
+        keystone_user, member = self._project_admin(i)
+        email = 'invite-%s@example.com' % i
+        ok = self._call('invite.create', self.invite_view, {
+            'email': email, 'roles': ['_member_']}, keystone_user)
+        task = Task.objects.filter(task_type='invite_user').order_by(
+            '-created_on').first()
+        return ok and self._submit_token(
+            'invite.submit', task, {'password': 'password'})
+
+    def reset_password(self, i):
+        keystone_user, member = self._project_admin(i)
+        ok = self._call('reset_password.create', self.reset_view, {
+            'email': member['email']})
+        task = Task.objects.filter(task_type='reset_password').order_by(
+            '-created_on').first()
+        return ok and self._submit_token(
+            'reset_password.submit', task, {'password': 'new_password'})
+
+    def user_roles(self, i):
+        keystone_user, member = self._project_admin(i)
+        method = 'delete' if (i // len(self.projects)) % 2 else 'put'
+        return self._call(
+            'user_roles.%s' % method, self.roles_view,
+            {'roles': ['project_mod']}, keystone_user, method=method,
+            user_id=member['id'])
+
+
+@register_benchmark('workflows')
+def workflows(iterations=20, latency=0.0, projects=10, **kwargs):
+    """
+    Runs signup, invite, password reset and role edit tasks from start
+    to finish through the views, against a simulated cloud with the
+    given latency per call and a file backed database.
+
+    Reports tasks per second for each workflow, and for each stage
+    its latency percentiles, database queries and calls to each
+    OpenStack service.
+    """
+    server = build_cloud(
+        latency=latency, projects=projects, users_per_project=2).start()
+    recorder = StageRecorder(server.services)
+    results = {
+        'iterations': iterations,
+        'service_latency': latency,
+        'workflows': {},
+    }
+    try:
+        with benchmark_database(), override_settings(
+                KEYSTONE=keystone_settings(server),
+                EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            _reset_caches()
+            runner = WorkflowRunner(server.service('keystone'), recorder)
+            for name in ['signup', 'invite', 'reset_password', 'user_roles']:
+                workflow = getattr(runner, name)
+                completed = 0
+                start = time.time()
+                for i in range(iterations):
+                    completed += bool(workflow(i))
+                    mail.outbox = []
+                duration = time.time() - start
+                results['workflows'][name] = {
+                    'completed': completed,
+                    'failed': iterations - completed,
+                    'seconds': duration,
+                    'tasks_per_second': completed / duration,
+                }
+    finally:
+        _reset_caches()
+        server.stop()
+    results['stages'] = recorder.results()
+    return results
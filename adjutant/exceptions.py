@@ -32,3 +32,11 @@ class ActionNotFound(BaseException):
 
 class SerializerMissingException(BaseException):
     """ Serializer configured but it does not exist """
+
+
+class ServiceUnavailable(BaseException):
+    """An OpenStack service is failing, so calls to it are being refused."""
+
+
+class DeadlineExceeded(BaseException):
+    """Ran out of time for calls to OpenStack services."""
@@ -26,6 +26,7 @@ https://docs.djangoproject.com/en/1.8/ref/settings/
 import os
 import sys
 import yaml
+from django.core.exceptions import ImproperlyConfigured
 from adjutant.utils import setup_task_settings
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
@@ -165,6 +166,20 @@ PLUGIN_SETTINGS = CONFIG.get('PLUGIN_SETTINGS', {})
 
 ROLES_MAPPING = CONFIG['ROLES_MAPPING']
 
+# Tuning for how Adjutant talks to Keystone.
+IDENTITY_SETTINGS = CONFIG.get('IDENTITY_SETTINGS', {})
+
+if IDENTITY_SETTINGS.get('backend') == 'asyncio':
+    try:
+        import aiohttp  # noqa
+    except (ImportError, SyntaxError):
+        raise ImproperlyConfigured(
+            "IDENTITY_SETTINGS backend 'asyncio' needs Python 3.5+ and "
+            "aiohttp, installed with: pip install python-adjutant[asyncio]")
+
+# Tuning for the shared session and clients used to talk to OpenStack.
+CLIENT_SETTINGS = CONFIG.get('CLIENT_SETTINGS', {})
+
 PROJECT_QUOTA_SIZES = CONFIG.get('PROJECT_QUOTA_SIZES')
 
 # Defaults for backwards compatibility.
@@ -0,0 +1,37 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Local, in memory stand-ins for the OpenStack APIs Adjutant talks to,
+served over real HTTP so the real client code can be tested, load
+tested and profiled without a cloud.
+
+Each service can be given a latency (plus or minus some jitter) and
+an error rate, and seeded with as much data as is wanted.
+
+Usage:
+
+    server = build_cloud(latency=0.05, projects=100, users_per_project=5)
+    server.start()
+    ... point KEYSTONE at keystone_settings(server) ...
+    server.stop()
+"""
+
+from adjutant.simulator.cinder import CinderService  # noqa
+from adjutant.simulator.cloud import build_cloud, keystone_settings  # noqa
+from adjutant.simulator.keystone import KeystoneService  # noqa
+from adjutant.simulator.neutron import NeutronService  # noqa
+from adjutant.simulator.nova import NovaService  # noqa
+from adjutant.simulator.server import (  # noqa
+    HttpError, RegionalService, Service, SimulatorServer)
@@ -0,0 +1,110 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from adjutant.simulator.server import HttpError, RegionalService, new_id
+
+DEFAULT_QUOTA = {
+    'gigabytes': 1000,
+    'volumes': 10,
+    'snapshots': 10,
+    'backups': 10,
+    'backup_gigabytes': 1000,
+    'per_volume_gigabytes': -1,
+}
+
+
+class CinderService(RegionalService):
+    """
+    The parts of the Cinder v2 and v3 APIs that Adjutant uses: quota
+    sets, plus listing volumes and snapshots.
+
+    Served under '/<version>/<project id>' like a real Cinder, for the
+    catalog types 'volume', 'volumev2' and 'volumev3'.
+    """
+
+    name = 'cinder'
+    prefix = '/volume'
+
+    routes = [
+        ('GET', '/v[23]/(?P<tenant>[^/]+)/os-quota-sets/'
+                '(?P<project_id>[^/]+)', 'get_quota'),
+        ('PUT', '/v[23]/(?P<tenant>[^/]+)/os-quota-sets/'
+                '(?P<project_id>[^/]+)', 'update_quota'),
+        ('GET', '/v[23]/(?P<tenant>[^/]+)/(?P<collection>volumes|snapshots)'
+                '(/detail)?', 'list_resources'),
+    ]
+
+    @property
+    def service_types(self):
+        return ['volume', 'volumev2', 'volumev3']
+
+    def endpoint_url(self, region, service_type):
+        version = 'v3' if service_type == 'volumev3' else 'v2'
+        keystone = self.server.service('keystone')
+        # NOTE: a real catalog has the project of the token
+        # here, but any project works for what Adjutant does.
+        project_id = keystone.admin_project_id if keystone else 'admin'
+        return '%s/%s/%s/%s' % (self.url, region, version, project_id)
+
+    def add_resource(self, region, collection, project_id, name, size=1):
+        resource = {'id': new_id(), 'name': name, 'size': size,
+                    'status': 'available',
+                    'os-vol-tenant-attr:tenant_id': project_id,
+                    'project_id': project_id}
+        self.data(region, collection)[resource['id']] = resource
+        return resource
+
+    def populate(self, project_ids, per_project=1, region=None):
+        """
+        Gives each project per_project volumes and snapshots, in the
+        given or every region.
+        """
+        regions = [region] if region else self.regions
+        for region in regions:
+            for project_id in project_ids:
+                for collection in ['volumes', 'snapshots']:
+                    for i in range(per_project):
+                        self.add_resource(
+                            region, collection, project_id,
+                            '%s-%s' % (collection[:-1], i))
+
+    def _quota(self, region, project_id):
+        quota = dict(DEFAULT_QUOTA)
+        quota.update(self.data(region, 'quotas').get(project_id, {}))
+        quota['id'] = project_id
+        return quota
+
+    # Routes
+
+    def get_quota(self, request, region, tenant, project_id):
+        return 200, {'quota_set': self._quota(region, project_id)}
+
+    def update_quota(self, request, region, tenant, project_id):
+        try:
+            values = dict(request.body['quota_set'])
+        except (TypeError, KeyError):
+            raise HttpError(400)
+        values.pop('tenant_id', None)
+        self.data(region, 'quotas').setdefault(project_id, {}).update(values)
+        return 200, {'quota_set': self._quota(region, project_id)}
+
+    def list_resources(self, request, region, tenant, collection):
+        resources = self.data(region, collection).values()
+        project_id = request.param('project_id')
+        if project_id is None and request.param('all_tenants') is None:
+            project_id = tenant
+        if project_id is not None:
+            resources = [resource for resource in resources
+                         if resource['project_id'] == project_id]
+        return 200, {collection: list(resources)}
@@ -0,0 +1,73 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from adjutant.simulator.cinder import CinderService
+from adjutant.simulator.keystone import KeystoneService
+from adjutant.simulator.neutron import NeutronService
+from adjutant.simulator.nova import NovaService
+from adjutant.simulator.server import SimulatorServer
+
+
+def build_cloud(regions=('RegionOne',), latency=0.0, jitter=0.0,
+                error_rate=0.0, projects=0, users_per_project=0,
+                resources_per_project=0, seed=None, host='127.0.0.1',
+                port=0, service_options=None):
+    """
+    Returns a SimulatorServer, not yet started, with Keystone, Neutron,
+    Nova and Cinder services for the given regions.
+
+    latency, jitter and error_rate apply to every service, and can be
+    set per service by name in service_options, e.g.:
+
+        service_options={'nova': {'latency': 0.5}}
+
+    The cloud is seeded with the given number of projects, each with
+    users_per_project users, and resources_per_project of each kind
+    of resource in each region.
+    """
+    service_options = service_options or {}
+
+    def options(name):
+        service_kwargs = {'latency': latency, 'jitter': jitter,
+                          'error_rate': error_rate, 'seed': seed}
+        service_kwargs.update(service_options.get(name, {}))
+        return service_kwargs
+
+    keystone = KeystoneService(**options('keystone'))
+    for region in regions:
+        keystone.regions[region] = {'id': region, 'description': ''}
+    services = [keystone] + [
+        service_class(regions=regions, **options(service_class.name))
+        for service_class in (NeutronService, NovaService, CinderService)]
+
+    project_ids = [
+        project['id'] for project in keystone.populate(
+            projects=projects, users_per_project=users_per_project)]
+    if resources_per_project:
+        for service in services[1:]:
+            service.populate(project_ids, per_project=resources_per_project)
+
+    return SimulatorServer(services, host=host, port=port)
+
+
+def keystone_settings(server):
+    """
+    The KEYSTONE settings for Adjutant to use the given server.
+    """
+    return {
+        'username': 'admin',
+        'password': 'password',
+        'project_name': 'admin',
+        'auth_url': server.url + '/v3',
+    }
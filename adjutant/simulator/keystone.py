@@ -0,0 +1,459 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from datetime import datetime, timedelta
+import itertools
+
+from adjutant.simulator.server import HttpError, Service, new_id
+
+
+def isotime(when):
+    return when.strftime('%Y-%m-%dT%H:%M:%S.000000Z')
+
+
+class KeystoneService(Service):
+    """
+    The parts of the Keystone v3 API that Adjutant uses, backed by
+    in memory dicts.
+
+    Starts with a 'Default' domain, an 'admin' project and user
+    (password 'password'), the roles in 'role_names', and 'RegionOne'.
+    """
+
+    name = 'keystone'
+    service_type = 'identity'
+    prefix = ''
+    endpoint_path = '/v3'
+
+    role_names = ['admin', '_member_', 'project_admin', 'project_mod',
+                  'heat_stack_owner']
+
+    routes = [
+        ('GET', '/', 'get_versions'),
+        ('GET', '/v3', 'get_version'),
+        ('POST', '/v3/auth/tokens', 'create_token'),
+        ('GET', '/v3/auth/tokens', 'validate_token'),
+        ('GET', '/v3/users', 'list_users'),
+        ('POST', '/v3/users', 'create_user'),
+        ('GET', '/v3/users/(?P<user_id>[^/]+)', 'get_user'),
+        ('PATCH', '/v3/users/(?P<user_id>[^/]+)', 'update_user'),
+        ('GET', '/v3/roles', 'list_roles'),
+        ('GET', '/v3/roles/(?P<role_id>[^/]+)', 'get_role'),
+        ('GET', '/v3/role_assignments', 'list_role_assignments'),
+        ('GET', '/v3/projects/(?P<project_id>[^/]+)/users/'
+                '(?P<user_id>[^/]+)/roles', 'list_user_project_roles'),
+        ('PUT', '/v3/projects/(?P<project_id>[^/]+)/users/'
+                '(?P<user_id>[^/]+)/roles/(?P<role_id>[^/]+)', 'grant_role'),
+        ('DELETE', '/v3/projects/(?P<project_id>[^/]+)/users/'
+                   '(?P<user_id>[^/]+)/roles/(?P<role_id>[^/]+)',
+         'revoke_role'),
+        ('GET', '/v3/projects', 'list_projects'),
+        ('POST', '/v3/projects', 'create_project'),
+        ('GET', '/v3/projects/(?P<project_id>[^/]+)', 'get_project'),
+        ('PATCH', '/v3/projects/(?P<project_id>[^/]+)', 'update_project'),
+        ('GET', '/v3/domains', 'list_domains'),
+        ('GET', '/v3/domains/(?P<domain_id>[^/]+)', 'get_domain'),
+        ('GET', '/v3/regions', 'list_regions'),
+        ('GET', '/v3/regions/(?P<region_id>[^/]+)', 'get_region'),
+    ]
+
+    def __init__(self, token_lifetime=3600, **kwargs):
+        super(KeystoneService, self).__init__(**kwargs)
+        self.token_lifetime = token_lifetime
+        self.tokens = {}
+        self.token_bodies = {}
+        self.domains = {}
+        self.projects = {}
+        self.users = {}
+        self.passwords = {}
+        self.roles = {}
+        self.assignments = set()
+        self.regions = {}
+
+        self.add_domain('Default', domain_id='default')
+        for name in self.role_names:
+            self.add_role(name)
+        self.regions['RegionOne'] = {'id': 'RegionOne', 'description': ''}
+        admin_project = self.add_project('admin')
+        self.admin_project_id = admin_project['id']
+        admin = self.add_user('admin', password='password')
+        self.add_assignment(admin['id'], admin_project['id'], 'admin')
+
+    # Data setup
+
+    def add_domain(self, name, domain_id=None):
+        domain = {'id': domain_id or new_id(), 'name': name,
+                  'enabled': True, 'description': ''}
+        self.domains[domain['id']] = domain
+        return domain
+
+    def add_role(self, name):
+        role = {'id': new_id(), 'name': name, 'domain_id': None}
+        self.roles[role['id']] = role
+        return role
+
+    def add_project(self, name, domain_id='default', **extra):
+        project = {'id': new_id(), 'name': name, 'domain_id': domain_id,
+                   'parent_id': domain_id, 'enabled': True,
+                   'description': '', 'is_domain': False}
+        project.update(extra)
+        self.projects[project['id']] = project
+        return project
+
+    def add_user(self, name, domain_id='default', password=None, **extra):
+        user = {'id': new_id(), 'name': name, 'domain_id': domain_id,
+                'enabled': True}
+        user.update(extra)
+        self.users[user['id']] = user
+        self.passwords[user['id']] = password
+        return user
+
+    def add_assignment(self, user_id, project_id, role_name):
+        role = self.find_role(role_name)
+        self.assignments.add((user_id, project_id, role['id']))
+
+    def find_role(self, name):
+        for role in self.roles.values():
+            if role['name'] == name:
+                return role
+
+    def populate(self, projects=0, users_per_project=0,
+                 roles=('_member_',), domain_id='default'):
+        """
+        Adds the given number of projects, each with users_per_project
+        users having the given roles on it. Returns the new projects.
+        """
+        added = []
+        for i in range(projects):
+            project = self.add_project('project-%s' % i, domain_id)
+            for j in range(users_per_project):
+                name = 'user-%s-%s@example.com' % (i, j)
+                user = self.add_user(
+                    name, domain_id, password='password', email=name)
+                for role in roles:
+                    self.add_assignment(user['id'], project['id'], role)
+            added.append(project)
+        return added
+
+    # Helpers
+
+    def _link(self, path):
+        return {'self': self.url + path}
+
+    def _resource(self, resource, path):
+        resource = dict(resource)
+        resource['links'] = self._link('/v3/%s/%s' % (path, resource['id']))
+        return resource
+
+    def _list(self, key, path, resources, request, filters):
+        found = []
+        for resource in resources:
+            if all(self._matches(resource, name, request.param(param))
+                   for param, name in filters):
+                found.append(self._resource(resource, path))
+        return 200, {key: found, 'links': {
+            'self': self.url + '/v3/' + path,
+            'next': None, 'previous': None}}
+
+    @staticmethod
+    def _matches(resource, field, value):
+        if value is None:
+            return True
+        if field.endswith('__icontains'):
+            field = field[:-len('__icontains')]
+            return value.lower() in (resource.get(field) or '').lower()
+        return str(resource.get(field)) == value
+
+    def _get(self, collection, resource_id):
+        try:
+            return collection[resource_id]
+        except KeyError:
+            raise HttpError(404)
+
+    def _show(self, key, collection, resource_id, path):
+        return 200, {key: self._resource(
+            self._get(collection, resource_id), path)}
+
+    def check_token(self, request):
+        token = request.headers.get('X-Auth-Token')
+        expires = self.tokens.get(token)
+        if not expires or expires < datetime.utcnow():
+            raise HttpError(401)
+
+    def _body(self, request, key):
+        try:
+            return dict(request.body[key])
+        except (TypeError, KeyError):
+            raise HttpError(400)
+
+    # Routes
+
+    def _version(self):
+        return {
+            'id': 'v3.8',
+            'status': 'stable',
+            'updated': '2017-02-22T00:00:00Z',
+            'links': [{'rel': 'self', 'href': self.url + '/v3/'}],
+            'media-types': [{
+                'base': 'application/json',
+                'type': 'application/vnd.openstack.identity-v3+json'}],
+        }
+
+    def get_versions(self, request):
+        return 300, {'versions': {'values': [self._version()]}}
+
+    def get_version(self, request):
+        return 200, {'version': self._version()}
+
+    def _catalog(self):
+        catalog = []
+        for service in self.server.services:
+            for service_type, region in itertools.product(
+                    service.service_types, service.endpoint_regions()):
+                catalog.append({
+                    'id': new_id(),
+                    'type': service_type,
+                    'name': service.name,
+                    'endpoints': [{
+                        'id': new_id(),
+                        'interface': interface,
+                        'region': region,
+                        'region_id': region,
+                        'url': service.endpoint_url(region, service_type),
+                    } for interface in ['public', 'internal', 'admin']],
+                })
+        return catalog
+
+    def endpoint_regions(self):
+        return sorted(self.regions)
+
+    def endpoint_url(self, region, service_type):
+        return self.url + self.endpoint_path
+
+    def create_token(self, request):
+        try:
+            auth = request.body['auth']
+            password = auth['identity']['password']['user']
+        except (TypeError, KeyError):
+            raise HttpError(400)
+        user = None
+        for candidate in self.users.values():
+            if (candidate['name'] == password.get('name') or
+                    candidate['id'] == password.get('id')):
+                user = candidate
+        if not user or self.passwords.get(user['id']) != password.get(
+                'password'):
+            raise HttpError(401)
+
+        project = None
+        scope = (auth.get('scope') or {}).get('project')
+        if scope:
+            for candidate in self.projects.values():
+                if (candidate['name'] == scope.get('name') or
+                        candidate['id'] == scope.get('id')):
+                    project = candidate
+            if not project:
+                raise HttpError(401)
+
+        token_id = new_id()
+        now = datetime.utcnow()
+        expires = now + timedelta(seconds=self.token_lifetime)
+        self.tokens[token_id] = expires
+        domain = self.domains[user['domain_id']]
+        token = {
+            'methods': ['password'],
+            'expires_at': isotime(expires),
+            'issued_at': isotime(now),
+            'user': {'id': user['id'], 'name': user['name'],
+                     'domain': {'id': domain['id'], 'name': domain['name']}},
+            'audit_ids': [new_id()],
+        }
+        if project:
+            project_domain = self.domains[project['domain_id']]
+            token['project'] = {
+                'id': project['id'], 'name': project['name'],
+                'domain': {'id': project_domain['id'],
+                           'name': project_domain['name']}}
+            token['roles'] = [
+                {'id': role_id, 'name': self.roles[role_id]['name']}
+                for user_id, project_id, role_id in self.assignments
+                if user_id == user['id'] and project_id == project['id']]
+            token['catalog'] = self._catalog()
+        self.token_bodies[token_id] = token
+        return 201, {'token': token}, {'X-Subject-Token': token_id}
+
+    def validate_token(self, request):
+        self.check_token(request)
+        token = request.headers.get('X-Subject-Token')
+        if token not in self.tokens:
+            raise HttpError(404)
+        return 200, {'token': self.token_bodies[token]}
+
+    def list_users(self, request):
+        self.check_token(request)
+        return self._list(
+            'users', 'users', self.users.values(), request,
+            [('name', 'name'), ('domain_id', 'domain_id'),
+             ('name__icontains', 'name__icontains'),
+             ('enabled', 'enabled')])
+
+    def get_user(self, request, user_id):
+        self.check_token(request)
+        return self._show('user', self.users, user_id, 'users')
+
+    def create_user(self, request):
+        self.check_token(request)
+        data = self._body(request, 'user')
+        password = data.pop('password', None)
+        data.setdefault('domain_id', 'default')
+        for user in self.users.values():
+            if (user['name'] == data.get('name') and
+                    user['domain_id'] == data['domain_id']):
+                raise HttpError(409)
+        user = self.add_user(password=password, **data)
+        return 201, {'user': self._resource(user, 'users')}
+
+    def update_user(self, request, user_id):
+        self.check_token(request)
+        user = self._get(self.users, user_id)
+        data = self._body(request, 'user')
+        if 'password' in data:
+            self.passwords[user_id] = data.pop('password')
+        user.update(data)
+        return 200, {'user': self._resource(user, 'users')}
+
+    def list_roles(self, request):
+        self.check_token(request)
+        return self._list(
+            'roles', 'roles', self.roles.values(), request,
+            [('name', 'name')])
+
+    def get_role(self, request, role_id):
+        self.check_token(request)
+        return self._show('role', self.roles, role_id, 'roles')
+
+    def list_role_assignments(self, request):
+        self.check_token(request)
+        user_filter = request.param('user.id')
+        project_filter = request.param('scope.project.id')
+        role_filter = request.param('role.id')
+        include_names = request.param('include_names') in ['True', 'true']
+
+        assignments = []
+        for user_id, project_id, role_id in sorted(self.assignments):
+            if ((user_filter and user_id != user_filter) or
+                    (project_filter and project_id != project_filter) or
+                    (role_filter and role_id != role_filter)):
+                continue
+            assignment = {
+                'user': {'id': user_id},
+                'role': {'id': role_id},
+                'scope': {'project': {'id': project_id}},
+                'links': {'assignment': '%s/v3/projects/%s/users/%s/'
+                          'roles/%s' % (self.url, project_id, user_id,
+                                        role_id)},
+            }
+            if include_names:
+                user = self.users.get(user_id, {})
+                domain = self.domains.get(user.get('domain_id'), {})
+                assignment['user'].update({
+                    'name': user.get('name'),
+                    'domain': {'id': domain.get('id'),
+                               'name': domain.get('name')}})
+                assignment['role']['name'] = self.roles[role_id]['name']
+                assignment['scope']['project']['name'] = self.projects.get(
+                    project_id, {}).get('name')
+            assignments.append(assignment)
+        return 200, {'role_assignments': assignments, 'links': {
+            'self': self.url + '/v3/role_assignments',
+            'next': None, 'previous': None}}
+
+    def list_user_project_roles(self, request, project_id, user_id):
+        self.check_token(request)
+        self._get(self.projects, project_id)
+        self._get(self.users, user_id)
+        roles = [
+            self._resource(self.roles[role_id], 'roles')
+            for a_user, a_project, role_id in self.assignments
+            if a_user == user_id and a_project == project_id]
+        return 200, {'roles': roles, 'links': {
+            'self': self.url + request.path, 'next': None,
+            'previous': None}}
+
+    def grant_role(self, request, project_id, user_id, role_id):
+        self.check_token(request)
+        self._get(self.projects, project_id)
+        self._get(self.users, user_id)
+        self._get(self.roles, role_id)
+        self.assignments.add((user_id, project_id, role_id))
+        return 204, None
+
+    def revoke_role(self, request, project_id, user_id, role_id):
+        self.check_token(request)
+        try:
+            self.assignments.remove((user_id, project_id, role_id))
+        except KeyError:
+            raise HttpError(404)
+        return 204, None
+
+    def list_projects(self, request):
+        self.check_token(request)
+        return self._list(
+            'projects', 'projects', self.projects.values(), request,
+            [('name', 'name'), ('domain_id', 'domain_id'),
+             ('parent_id', 'parent_id')])
+
+    def get_project(self, request, project_id):
+        self.check_token(request)
+        return self._show('project', self.projects, project_id, 'projects')
+
+    def create_project(self, request):
+        self.check_token(request)
+        data = self._body(request, 'project')
+        data.setdefault('domain_id', 'default')
+        for project in self.projects.values():
+            if (project['name'] == data.get('name') and
+                    project['domain_id'] == data['domain_id']):
+                raise HttpError(409)
+        name = data.pop('name')
+        domain_id = data.pop('domain_id')
+        if not data.get('parent_id'):
+            data['parent_id'] = domain_id
+        project = self.add_project(name, domain_id, **data)
+        return 201, {'project': self._resource(project, 'projects')}
+
+    def update_project(self, request, project_id):
+        self.check_token(request)
+        project = self._get(self.projects, project_id)
+        project.update(self._body(request, 'project'))
+        return 200, {'project': self._resource(project, 'projects')}
+
+    def list_domains(self, request):
+        self.check_token(request)
+        return self._list(
+            'domains', 'domains', self.domains.values(), request,
+            [('name', 'name')])
+
+    def get_domain(self, request, domain_id):
+        self.check_token(request)
+        return self._show('domain', self.domains, domain_id, 'domains')
+
+    def list_regions(self, request):
+        self.check_token(request)
+        return self._list(
+            'regions', 'regions', self.regions.values(), request, [])
+
+    def get_region(self, request, region_id):
+        self.check_token(request)
+        return self._show('region', self.regions, region_id, 'regions')
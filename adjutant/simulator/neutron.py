@@ -0,0 +1,145 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from adjutant.simulator.server import HttpError, RegionalService, new_id
+
+DEFAULT_QUOTA = {
+    'network': 10,
+    'subnet': 10,
+    'router': 10,
+    'port': 50,
+    'floatingip': 50,
+    'security_group': 20,
+    'security_group_rule': 100,
+}
+
+
+class NeutronService(RegionalService):
+    """
+    The parts of the Neutron v2.0 API that Adjutant uses: networks,
+    subnets, routers, router interfaces and quotas, and listing the
+    other resources that count against quota.
+    """
+
+    name = 'neutron'
+    service_type = 'network'
+    prefix = '/network'
+
+    # (collection, resource key)
+    collections = [
+        ('networks', 'network'),
+        ('subnets', 'subnet'),
+        ('routers', 'router'),
+        ('ports', 'port'),
+        ('floatingips', 'floatingip'),
+        ('security-groups', 'security_group'),
+        ('security-group-rules', 'security_group_rule'),
+    ]
+
+    routes = [
+        ('GET', '/v2.0/quotas/(?P<project_id>[^/]+)', 'get_quota'),
+        ('PUT', '/v2.0/quotas/(?P<project_id>[^/]+)', 'update_quota'),
+        ('GET', '/v2.0/(?P<collection>[a-z-]+)', 'list_resources'),
+        ('POST', '/v2.0/(?P<collection>networks|subnets|routers)',
+         'create_resource'),
+        ('GET', '/v2.0/(?P<collection>[a-z-]+)/(?P<resource_id>[^/]+)',
+         'get_resource'),
+        ('PUT', '/v2.0/routers/(?P<router_id>[^/]+)/add_router_interface',
+         'add_router_interface'),
+    ]
+
+    def _key(self, collection):
+        for name, key in self.collections:
+            if name == collection:
+                return key
+        raise HttpError(404)
+
+    def add_resource(self, region, collection, project_id, **fields):
+        resource = {'id': new_id(), 'tenant_id': project_id,
+                    'project_id': project_id}
+        resource.update(fields)
+        self.data(region, collection)[resource['id']] = resource
+        return resource
+
+    def populate(self, project_ids, per_project=1, region=None):
+        """
+        Gives each project per_project of every kind of resource,
+        in the given or every region.
+        """
+        regions = [region] if region else self.regions
+        for region in regions:
+            for project_id in project_ids:
+                for collection, key in self.collections:
+                    for i in range(per_project):
+                        self.add_resource(
+                            region, collection, project_id,
+                            name='%s-%s' % (key, i))
+
+    # Routes
+
+    def list_resources(self, request, region, collection):
+        self._key(collection)
+        resources = self._filter(
+            self.data(region, collection).values(), request,
+            ['tenant_id', 'project_id', 'name', 'network_id',
+             'device_id'])
+        return 200, {collection.replace('-', '_'): resources}
+
+    def get_resource(self, request, region, collection, resource_id):
+        key = self._key(collection)
+        try:
+            resource = self.data(region, collection)[resource_id]
+        except KeyError:
+            raise HttpError(404)
+        return 200, {key: resource}
+
+    def create_resource(self, request, region, collection):
+        key = self._key(collection)
+        try:
+            fields = dict(request.body[key])
+        except (TypeError, KeyError):
+            raise HttpError(400)
+        project_id = fields.pop('tenant_id', fields.pop('project_id', None))
+        if collection == 'subnets':
+            if fields.get('network_id') not in self.data(region, 'networks'):
+                raise HttpError(404)
+        resource = self.add_resource(region, collection, project_id, **fields)
+        return 201, {key: resource}
+
+    def add_router_interface(self, request, region, router_id):
+        router = self.data(region, 'routers').get(router_id)
+        subnet = self.data(region, 'subnets').get(
+            (request.body or {}).get('subnet_id'))
+        if not router or not subnet:
+            raise HttpError(404)
+        port = self.add_resource(
+            region, 'ports', router['tenant_id'],
+            network_id=subnet['network_id'], device_id=router_id,
+            device_owner='network:router_interface')
+        return 200, {'id': router_id, 'tenant_id': router['tenant_id'],
+                     'port_id': port['id'], 'subnet_id': subnet['id'],
+                     'subnet_ids': [subnet['id']]}
+
+    def get_quota(self, request, region, project_id):
+        quota = dict(DEFAULT_QUOTA)
+        quota.update(self.data(region, 'quotas').get(project_id, {}))
+        return 200, {'quota': quota}
+
+    def update_quota(self, request, region, project_id):
+        try:
+            values = dict(request.body['quota'])
+        except (TypeError, KeyError):
+            raise HttpError(400)
+        self.data(region, 'quotas').setdefault(project_id, {}).update(values)
+        return self.get_quota(request, region, project_id)
@@ -0,0 +1,123 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from adjutant.simulator.server import HttpError, RegionalService, new_id
+
+DEFAULT_QUOTA = {
+    'instances': 10,
+    'cores': 20,
+    'ram': 51200,
+    'key_pairs': 100,
+    'metadata_items': 128,
+    'injected_files': 5,
+    'injected_file_content_bytes': 10240,
+    'injected_file_path_bytes': 255,
+    'server_groups': 10,
+    'server_group_members': 10,
+}
+
+
+class NovaService(RegionalService):
+    """
+    The parts of the Nova v2.1 API that Adjutant uses: quota sets and
+    limits, plus listing servers.
+    """
+
+    name = 'nova'
+    service_type = 'compute'
+    prefix = '/compute'
+
+    routes = [
+        ('GET', '/v2.1', 'get_version'),
+        ('GET', '/v2.1/os-quota-sets/(?P<project_id>[^/]+)', 'get_quota'),
+        ('GET', '/v2.1/os-quota-sets/(?P<project_id>[^/]+)/defaults',
+         'get_default_quota'),
+        ('PUT', '/v2.1/os-quota-sets/(?P<project_id>[^/]+)',
+         'update_quota'),
+        ('GET', '/v2.1/limits', 'get_limits'),
+        ('GET', '/v2.1/servers', 'list_servers'),
+        ('GET', '/v2.1/servers/detail', 'list_servers'),
+    ]
+
+    def endpoint_url(self, region, service_type):
+        return '%s/%s/v2.1' % (self.url, region)
+
+    def add_server(self, region, project_id, name, vcpus=1, ram=512):
+        server = {'id': new_id(), 'name': name, 'tenant_id': project_id,
+                  'status': 'ACTIVE', 'flavor': {'vcpus': vcpus, 'ram': ram}}
+        self.data(region, 'servers')[server['id']] = server
+        return server
+
+    def populate(self, project_ids, per_project=1, region=None):
+        """
+        Gives each project per_project servers, in the given or
+        every region.
+        """
+        regions = [region] if region else self.regions
+        for region in regions:
+            for project_id in project_ids:
+                for i in range(per_project):
+                    self.add_server(region, project_id, 'server-%s' % i)
+
+    def _quota(self, region, project_id):
+        quota = dict(DEFAULT_QUOTA)
+        quota.update(self.data(region, 'quotas').get(project_id, {}))
+        quota['id'] = project_id
+        return quota
+
+    # Routes
+
+    def get_version(self, request, region):
+        return 200, {'version': {
+            'id': 'v2.1', 'status': 'CURRENT', 'version': '2.38',
+            'min_version': '2.1', 'links': []}}
+
+    def get_quota(self, request, region, project_id):
+        return 200, {'quota_set': self._quota(region, project_id)}
+
+    def get_default_quota(self, request, region, project_id):
+        quota = dict(DEFAULT_QUOTA)
+        quota['id'] = project_id
+        return 200, {'quota_set': quota}
+
+    def update_quota(self, request, region, project_id):
+        try:
+            values = dict(request.body['quota_set'])
+        except (TypeError, KeyError):
+            raise HttpError(400)
+        values.pop('tenant_id', None)
+        values.pop('force', None)
+        self.data(region, 'quotas').setdefault(project_id, {}).update(values)
+        return 200, {'quota_set': self._quota(region, project_id)}
+
+    def get_limits(self, request, region):
+        project_id = request.param('tenant_id')
+        quota = self._quota(region, project_id)
+        servers = [server for server in self.data(region, 'servers').values()
+                   if server['tenant_id'] == project_id]
+        return 200, {'limits': {'rate': [], 'absolute': {
+            'maxTotalInstances': quota['instances'],
+            'maxTotalCores': quota['cores'],
+            'maxTotalRAMSize': quota['ram'],
+            'maxTotalKeypairs': quota['key_pairs'],
+            'totalInstancesUsed': len(servers),
+            'totalCoresUsed': sum(s['flavor']['vcpus'] for s in servers),
+            'totalRAMUsed': sum(s['flavor']['ram'] for s in servers),
+        }}}
+
+    def list_servers(self, request, region):
+        servers = self._filter(
+            self.data(region, 'servers').values(), request,
+            ['tenant_id', 'name', 'status'])
+        return 200, {'servers': servers}
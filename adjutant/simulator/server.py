@@ -0,0 +1,304 @@
+# Copyright (C) 2017 Catalyst IT Ltd
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from collections import Counter
+import json
+import random
+import re
+import threading
+import time
+from uuid import uuid4
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib import parse
+
+
+def new_id():
+    return uuid4().hex
+
+
+class HttpError(Exception):
+    """Raised by a route to return an error response."""
+
+    def __init__(self, status, message=None):
+        self.status = status
+        self.message = message or BaseHTTPServer.BaseHTTPRequestHandler.\
+            responses.get(status, ('Error',))[0]
+
+
+class Service(object):
+    """
+    A simulated API, served under 'prefix' on a SimulatorServer.
+
+    'routes' is a list of (method, path regex, handler name). The
+    handler is called with the request, followed by the named groups
+    of the regex, and returns (status, body) or (status, body, headers).
+
+    Every call first waits 'latency' seconds, give or take up to
+    'jitter', and then fails with 'error_status' for 'error_rate' of
+    calls. Calls are counted by handler name in 'calls'.
+    """
+
+    name = None
+    service_type = None
+    prefix = ''
+    routes = []
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=503, seed=None):
+        self.lock = threading.RLock()
+        self.server = None
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self._routes = [
+            (method, re.compile('^%s$' % path), handler)
+            for method, path, handler in self.routes]
+
+    @property
+    def url(self):
+        return self.server.url + self.prefix
+
+    @property
+    def service_types(self):
+        return [self.service_type] if self.service_type else []
+
+    def endpoint_regions(self):
+        return []
+
+    def endpoint_url(self, region, service_type):
+        return self.url
+
+    def match(self, method, path):
+        if not path.startswith(self.prefix):
+            return None
+        path = path[len(self.prefix):] or '/'
+        for route_method, regex, handler in self._routes:
+            found = regex.match(path)
+            if found and route_method == method:
+                return getattr(self, handler), found.groupdict()
+        return None
+
+    def authorize(self, request):
+        """ Raises an HttpError if the request may not be made. """
+
+    def before_call(self, handler_name):
+        """
+        Counts the call, then applies the latency and error rate.
+        """
+        with self.lock:
+            self.calls[handler_name] += 1
+            delay = self.latency
+            if self.jitter:
+                delay += self.random.uniform(-self.jitter, self.jitter)
+            failed = (self.error_rate and
+                      self.random.random() < self.error_rate)
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            raise HttpError(self.error_status)
+
+
+class RegionalService(Service):
+    """
+    A Service with separate data for each of its regions, served
+    under '<prefix>/<region>'. Handlers get the region as an argument,
+    and 'data(region, collection)' returns a dict of that region's
+    resources of the given kind.
+    """
+
+    def __init__(self, regions=('RegionOne',), **kwargs):
+        super(RegionalService, self).__init__(**kwargs)
+        self.regions = list(regions)
+        self._data = {region: {} for region in self.regions}
+
+    def endpoint_regions(self):
+        return list(self.regions)
+
+    def endpoint_url(self, region, service_type):
+        return '%s/%s' % (self.url, region)
+
+    def authorize(self, request):
+        keystone = self.server.service('keystone')
+        if keystone is not None:
+            keystone.check_token(request)
+
+    def data(self, region, collection):
+        return self._data[region].setdefault(collection, {})
+
+    def match(self, method, path):
+        if not path.startswith(self.prefix + '/'):
+            return None
+        region, _, rest = path[len(self.prefix) + 1:].partition('/')
+        if region not in self._data:
+            return None
+        for route_method, regex, handler in self._routes:
+            found = regex.match('/' + rest)
+            if found and route_method == method:
+                kwargs = found.groupdict()
+                kwargs['region'] = region
+                return getattr(self, handler), kwargs
+        return None
+
+    def _filter(self, resources, request, fields):
+        """
+        The resources matching the query, for the given fields.
+        """
+        found = []
+        for resource in resources:
+            if all(request.param(field) is None or
+                   str(resource.get(field)) == request.param(field)
+                   for field in fields):
+                found.append(resource)
+        return found
+
+
+class Request(object):
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def param(self, name, default=None):
+        return self.query.get(name, [default])[0]
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one go, or the client's delayed ACKs
+    # add tens of milliseconds to every call.
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        if self.server.simulator.httpd is None:
+            # Stopped, so drop kept alive connections too.
+            self.close_connection = True
+            return
+        url = parse.urlparse(self.path)
+        path = url.path.rstrip('/') or '/'
+        if path.endswith('.json'):
+            # older clients ask for the format in the path
+            path = path[:-len('.json')]
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            body = json.loads(body.decode('utf-8')) if body else None
+        except ValueError:
+            body = None
+        request = Request(
+            self.command, path, parse.parse_qs(url.query),
+            self.headers, body)
+
+        headers = {}
+        try:
+            result = self.server.simulator.dispatch(request)
+            status, response_body = result[:2]
+            if len(result) > 2:
+                headers = result[2]
+        except HttpError as e:
+            status = e.status
+            response_body = {'error': {'code': e.status,
+                                       'message': e.message}}
+        except Exception as e:
+            status = 500
+            response_body = {'error': {'code': 500, 'message': str(e)}}
+
+        data = b''
+        if response_body is not None:
+            data = json.dumps(response_body).encode('utf-8')
+            headers.setdefault('Content-Type', 'application/json')
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_HEAD = _handle
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SimulatorServer(object):
+    """
+    Serves the given services over HTTP on localhost, from a
+    background thread.
+    """
+
+    def __init__(self, services, host='127.0.0.1', port=0):
+        self.services = services
+        self.host = host
+        self.port = port
+        self.httpd = None
+        self.thread = None
+        for service in services:
+            service.server = self
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % (self.host, self.port)
+
+    def service(self, name):
+        for service in self.services:
+            if service.name == name:
+                return service
+
+    def dispatch(self, request):
+        # longest prefix first, so '' (e.g. keystone) is the fallback
+        for service in sorted(self.services, key=lambda s: -len(s.prefix)):
+            found = service.match(request.method, request.path)
+            if found:
+                handler, kwargs = found
+                service.before_call(handler.__name__)
+                service.authorize(request)
+                with service.lock:
+                    return handler(request, **kwargs)
+        raise HttpError(404)
+
+    def start(self):
+        self.httpd = _HTTPServer((self.host, self.port), _Handler)
+        self.httpd.simulator = self
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.thread.join()
+            self.httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
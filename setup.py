@@ -42,6 +42,9 @@ setup(
             'notifications/templates/*.txt',
             'notifications/*/templates/*.txt']},
     install_requires=required,
+    extras_require={
+        'asyncio': ["aiohttp>=3.3.0;python_version>='3.5'"],
+    },
     entry_points={
         'console_scripts': [
             'adjutant-api = adjutant:management_command',